@@ -12,7 +12,8 @@ from datetime import timedelta
 from src.models.user import db, User, Role
 from src.models.content import Category, Page, Post, Tag, Media, Setting
 from src.models.accounting import Company, AccountType, Account, CostCenter, JournalEntry, JournalEntryLine, FiscalPeriod
-from src.models.fiscal import TaxType, TaxRate, Customer, Product, Invoice, InvoiceItem, InvoiceTax
+from src.models.fiscal import TaxType, TaxRate, Customer, Product, Invoice, InvoiceItem, InvoiceTax, StockMovement, IcmsMonthlyRollup, IcmsMonthlyRollupLine
+from src.models.search import SearchDocument, SearchTerm
 from src.models.financial import BankAccount, BankTransaction, PaymentMethod, Supplier, Receivable, Payable, CashFlow
 
 # Importar rotas
@@ -21,6 +22,8 @@ from src.routes.auth import auth_bp
 from src.routes.content import content_bp
 from src.routes.accounting import accounting_bp
 from src.routes.fiscal import fiscal_bp
+from src.services.search_index import init_search_index
+from src.services.schema_upgrades import upgrade_schema
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
@@ -37,6 +40,9 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Cache de documentos fiscais (fora da pasta estática, que é pública)
+app.config['DANFE_FOLDER'] = os.path.join(os.path.dirname(__file__), 'database', 'danfe')
+
 # Inicializar extensões
 CORS(app, origins="*")
 jwt = JWTManager(app)
@@ -279,9 +285,15 @@ def create_initial_data():
 with app.app_context():
     db.create_all()
     
+    # Colunas e índices acrescentados a tabelas já existentes
+    upgrade_schema()
+    
     # Criar dados iniciais se não existirem
     if not Role.query.first():
         create_initial_data()
+    
+    # Índice de busca textual (FTS5 quando disponível)
+    init_search_index()
 
 # Criar diretório de uploads se não existir
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
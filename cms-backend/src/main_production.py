@@ -12,7 +12,8 @@ from datetime import timedelta
 from src.models.user import db, User, Role
 from src.models.content import Page, Post, Category, Media
 from src.models.accounting import Company, AccountType, Account, CostCenter, JournalEntry, JournalEntryLine, FiscalPeriod
-from src.models.fiscal import TaxType, TaxRate, Customer, Product, Invoice, InvoiceItem, InvoiceTax
+from src.models.fiscal import TaxType, TaxRate, Customer, Product, Invoice, InvoiceItem, InvoiceTax, StockMovement, IcmsMonthlyRollup, IcmsMonthlyRollupLine
+from src.models.search import SearchDocument, SearchTerm
 from src.models.financial import BankAccount, BankTransaction, PaymentMethod, Supplier, Receivable, Payable, CashFlow
 from src.models.departments import Department, Permission, RolePermission, DepartmentModule, WorkflowStep, DepartmentMetric
 
@@ -22,10 +23,15 @@ from src.routes.auth import auth_bp
 from src.routes.content import content_bp
 from src.routes.accounting import accounting_bp
 from src.routes.fiscal import fiscal_bp
+from src.services.search_index import init_search_index
+from src.services.schema_upgrades import upgrade_schema
 from src.routes.financial import financial_bp
 from src.routes.sales import sales_bp
 from src.routes.departments import departments_bp
 from src.routes.hr_advanced import hr_bp
+from src.services.payroll_tax import seed_tax_tables
+from src.services.payroll_posting import seed_payroll_accounts
+from src.services.provisions import seed_provision_accounts
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
@@ -42,6 +48,12 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Cache de documentos fiscais (fora da pasta estática, que é pública)
+app.config['DANFE_FOLDER'] = os.path.join(os.path.dirname(__file__), 'database', 'danfe')
+
+# Acervo de holerites em PDF (arquivos nomeados pelo hash do conteúdo)
+app.config['PAYSLIP_FOLDER'] = os.path.join(os.path.dirname(__file__), 'database', 'payslips')
+
 # Inicializar extensões
 CORS(app, origins="*")
 jwt = JWTManager(app)
@@ -181,6 +193,8 @@ def create_production_data():
         Account(company_id=company.id, code='2.1.1.03', name='INSS A RECOLHER', account_type_id=13, level=4),
         Account(company_id=company.id, code='2.1.1.04', name='PROVISÃO PARA FÉRIAS', account_type_id=13, level=4),
         Account(company_id=company.id, code='2.1.1.05', name='PROVISÃO PARA 13º SALÁRIO', account_type_id=13, level=4),
+        Account(company_id=company.id, code='2.1.1.06', name='IRRF A RECOLHER', account_type_id=13, level=4),
+        Account(company_id=company.id, code='2.1.1.07', name='DESCONTOS EM FOLHA A REPASSAR', account_type_id=13, level=4),
         
         # PASSIVO CIRCULANTE - OBRIGAÇÕES TRIBUTÁRIAS
         Account(company_id=company.id, code='2.1.2.01', name='ICMS A RECOLHER', account_type_id=14, level=4),
@@ -213,6 +227,10 @@ def create_production_data():
         Account(company_id=company.id, code='4.3.01', name='DESPESAS ADMINISTRATIVAS', account_type_id=27, level=3),
         Account(company_id=company.id, code='4.3.02', name='DESPESAS COMERCIAIS', account_type_id=27, level=3),
         Account(company_id=company.id, code='4.3.03', name='DESPESAS FINANCEIRAS', account_type_id=27, level=3),
+        Account(company_id=company.id, code='4.3.04', name='SALÁRIOS E ORDENADOS', account_type_id=27, level=3),
+        Account(company_id=company.id, code='4.3.05', name='FGTS', account_type_id=27, level=3),
+        Account(company_id=company.id, code='4.3.06', name='FÉRIAS', account_type_id=27, level=3),
+        Account(company_id=company.id, code='4.3.07', name='13º SALÁRIO', account_type_id=27, level=3),
     ]
     
     for account in accounts:
@@ -369,9 +387,22 @@ def create_production_data():
 with app.app_context():
     db.create_all()
     
+    # Colunas e índices acrescentados a tabelas já existentes
+    upgrade_schema()
+    
     # Criar dados iniciais se não existirem
     if not Role.query.first():
         create_production_data()
+    
+    # Índice de busca textual (FTS5 quando disponível)
+    init_search_index()
+    
+    # Tabelas progressivas de INSS e IRRF
+    seed_tax_tables()
+    
+    # Contas da folha e das provisões acrescentadas ao plano padrão
+    seed_payroll_accounts()
+    seed_provision_accounts()
 
 # Criar diretório de uploads se não existir
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
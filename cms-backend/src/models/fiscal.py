@@ -239,6 +239,7 @@ class Invoice(db.Model):
     # Relacionamentos
     items = db.relationship('InvoiceItem', backref='invoice', lazy=True, cascade='all, delete-orphan')
     tax_calculations = db.relationship('InvoiceTax', backref='invoice', lazy=True, cascade='all, delete-orphan')
+    company = db.relationship('Company')
     created_by_user = db.relationship('User', foreign_keys=[created_by])
     
     def __repr__(self):
@@ -391,3 +392,87 @@ class InvoiceTax(db.Model):
             'tax_amount': float(self.tax_amount) if self.tax_amount else 0
         }
 
+# Índice parcial por expressão: lista de estoque baixo sem varrer todos os produtos
+db.Index(
+    'ix_products_stock_shortage',
+    Product.company_id,
+    Product.current_stock - Product.minimum_stock,
+    sqlite_where=Product.manage_stock == True,
+    postgresql_where=Product.manage_stock == True
+)
+
+# Relatórios por período (SPED, ICMS por UF) filtram a empresa e a data de emissão
+db.Index('ix_invoices_company_issue_date', Invoice.company_id, Invoice.issue_date)
+
+class StockMovement(db.Model):
+    """Movimentações de estoque (registro apenas de inclusão)"""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_product', 'product_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), index=True)
+    movement_type = db.Column(db.String(20), nullable=False)  # invoice_issue, invoice_cancel
+    quantity = db.Column(db.Numeric(15, 3), nullable=False)  # positivo = entrada, negativo = saída
+    notes = db.Column(db.String(255))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relacionamentos
+    product = db.relationship('Product')
+    
+    def __repr__(self):
+        return f'<StockMovement {self.product_id} {self.quantity}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'company_id': self.company_id,
+            'product_id': self.product_id,
+            'invoice_id': self.invoice_id,
+            'movement_type': self.movement_type,
+            'quantity': float(self.quantity) if self.quantity else 0,
+            'notes': self.notes,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class IcmsMonthlyRollup(db.Model):
+    """Consolidação mensal de ICMS por UF de destino (cache do relatório por estado)"""
+    __tablename__ = 'icms_monthly_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('company_id', 'year', 'month', name='uq_icms_monthly_rollups_period'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relacionamentos
+    lines = db.relationship('IcmsMonthlyRollupLine', backref='rollup', lazy=True, cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<IcmsMonthlyRollup {self.company_id} {self.year}-{self.month:02d}>'
+
+class IcmsMonthlyRollupLine(db.Model):
+    """Totais do mês por UF, CFOP, CST e alíquota"""
+    __tablename__ = 'icms_monthly_rollup_lines'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    rollup_id = db.Column(db.Integer, db.ForeignKey('icms_monthly_rollups.id', ondelete='CASCADE'), nullable=False, index=True)
+    state = db.Column(db.String(2))
+    cfop = db.Column(db.String(4))
+    cst = db.Column(db.String(3))
+    rate = db.Column(db.Numeric(5, 2))
+    item_count = db.Column(db.Integer, default=0)
+    operation_value = db.Column(db.Numeric(15, 2), default=0)
+    icms_base = db.Column(db.Numeric(15, 2), default=0)
+    icms_value = db.Column(db.Numeric(15, 2), default=0)
+    
+    def __repr__(self):
+        return f'<IcmsMonthlyRollupLine {self.state} {self.cfop} {self.cst}>'
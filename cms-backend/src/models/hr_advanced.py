@@ -6,6 +6,10 @@ import json
 class Employee(db.Model):
     """Modelo avançado para colaboradores"""
     __tablename__ = 'employees'
+    __table_args__ = (
+        db.Index('ix_employees_admission_date', 'admission_date', 'department_id'),
+        db.Index('ix_employees_dismissal_date', 'dismissal_date', 'department_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -128,6 +132,9 @@ class PayrollPeriod(db.Model):
 class PayrollItem(db.Model):
     """Itens da folha de pagamento"""
     __tablename__ = 'payroll_items'
+    __table_args__ = (
+        db.UniqueConstraint('period_id', 'employee_id', name='uq_payroll_items_period_employee'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
@@ -144,6 +151,7 @@ class PayrollItem(db.Model):
     vacation_pay = db.Column(db.Float, default=0)
     thirteenth_salary = db.Column(db.Float, default=0)
     other_earnings = db.Column(db.Float, default=0)
+    taxable_benefits = db.Column(db.Float, default=0)  # benefícios tributáveis em utilidade: só entram nas bases
     
     # Descontos
     inss = db.Column(db.Float, default=0)
@@ -168,9 +176,151 @@ class PayrollItem(db.Model):
     paid_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class Payslip(db.Model):
+    """Holerite renderizado (PDF guardado no arquivo endereçado pelo hash do conteúdo)"""
+    __tablename__ = 'payslips'
+    __table_args__ = (
+        db.UniqueConstraint('period_id', 'employee_id', name='uq_payslips_period_employee'),
+        db.Index('ix_payslips_period_department', 'period_id', 'department_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    period_id = db.Column(db.Integer, db.ForeignKey('payroll_periods.id'), nullable=False)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'))  # departamento na renderização
+    
+    source_hash = db.Column(db.String(64), nullable=False)  # dados usados na renderização
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 do PDF (nome do arquivo)
+    size = db.Column(db.Integer)
+    rendered_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PayrollTaxTable(db.Model):
+    """Tabelas progressivas de INSS e IRRF com data de vigência"""
+    __tablename__ = 'payroll_tax_tables'
+    __table_args__ = (
+        db.UniqueConstraint('tax', 'effective_date', name='uq_payroll_tax_tables_tax_date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tax = db.Column(db.String(10), nullable=False)  # inss, irrf
+    effective_date = db.Column(db.Date, nullable=False)
+    description = db.Column(db.String(200))
+    base_ceiling = db.Column(db.Float)  # teto do salário de contribuição (INSS)
+    dependent_deduction = db.Column(db.Float, default=0)  # dedução por dependente (IRRF)
+    simplified_deduction = db.Column(db.Float, default=0)  # desconto simplificado mensal (IRRF)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relacionamentos
+    brackets = db.relationship('PayrollTaxBracket', backref='table', lazy=True, cascade='all, delete-orphan')
+    
+    @property
+    def sorted_brackets(self):
+        """Faixas em ordem crescente, com a faixa sem limite por último"""
+        return sorted(self.brackets, key=lambda bracket: (bracket.upper_limit is None, bracket.upper_limit or 0))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tax': self.tax,
+            'effective_date': self.effective_date.isoformat() if self.effective_date else None,
+            'description': self.description,
+            'base_ceiling': self.base_ceiling,
+            'dependent_deduction': self.dependent_deduction,
+            'simplified_deduction': self.simplified_deduction,
+            'brackets': [{
+                'upper_limit': bracket.upper_limit,
+                'rate': bracket.rate,
+                'deduction': bracket.deduction
+            } for bracket in self.sorted_brackets]
+        }
+
+class PayrollTaxBracket(db.Model):
+    """Faixas de uma tabela progressiva (alíquota e parcela a deduzir)"""
+    __tablename__ = 'payroll_tax_brackets'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    table_id = db.Column(db.Integer, db.ForeignKey('payroll_tax_tables.id'), nullable=False, index=True)
+    upper_limit = db.Column(db.Float)  # vazio = sem limite (última faixa)
+    rate = db.Column(db.Float, nullable=False)  # alíquota em %
+    deduction = db.Column(db.Float, default=0)  # parcela a deduzir
+
+class PayrollJob(db.Model):
+    """Cálculo paralelo de folha executado em segundo plano"""
+    __tablename__ = 'payroll_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    period_id = db.Column(db.Integer, db.ForeignKey('payroll_periods.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
+    chunk_size = db.Column(db.Integer, nullable=False)
+    workers = db.Column(db.Integer)
+    total_employees = db.Column(db.Integer, default=0)
+    processed_employees = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)  # último progresso (início ou faixa gravada)
+    
+    # Relacionamentos
+    period = db.relationship('PayrollPeriod', backref='jobs')
+    chunks = db.relationship('PayrollJobChunk', backref='job', lazy=True, order_by='PayrollJobChunk.sequence')
+    
+    def to_dict(self, include_chunks=False):
+        data = {
+            'id': self.id,
+            'period_id': self.period_id,
+            'status': self.status,
+            'chunk_size': self.chunk_size,
+            'workers': self.workers,
+            'total_employees': self.total_employees,
+            'processed_employees': self.processed_employees,
+            'progress': round(100.0 * self.processed_employees / self.total_employees, 1) if self.total_employees else 100.0,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None
+        }
+        if include_chunks:
+            data['chunks'] = [chunk.to_dict() for chunk in self.chunks]
+        return data
+
+class PayrollJobChunk(db.Model):
+    """Faixa de colaboradores de um cálculo paralelo (gravada em transação própria)"""
+    __tablename__ = 'payroll_job_chunks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('payroll_jobs.id'), nullable=False, index=True)
+    sequence = db.Column(db.Integer, nullable=False)
+    first_employee_id = db.Column(db.Integer, nullable=False)
+    last_employee_id = db.Column(db.Integer, nullable=False)
+    employee_count = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
+    attempts = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sequence': self.sequence,
+            'first_employee_id': self.first_employee_id,
+            'last_employee_id': self.last_employee_id,
+            'employee_count': self.employee_count,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error_message': self.error_message,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
 class TimeRecord(db.Model):
     """Registros de ponto"""
     __tablename__ = 'time_records'
+    __table_args__ = (
+        db.Index('ix_time_records_date_employee', 'record_date', 'employee_id'),
+        db.UniqueConstraint('employee_id', 'record_date', name='uq_time_records_employee_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
@@ -201,6 +351,119 @@ class TimeRecord(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class TimeBankSummary(db.Model):
+    """Resumo mensal de ponto e banco de horas por colaborador"""
+    __tablename__ = 'time_bank_summaries'
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'year', 'month', name='uq_time_bank_summaries_employee_month'),
+        db.Index('ix_time_bank_summaries_period', 'year', 'month'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    
+    # Totais do mês
+    worked_days = db.Column(db.Integer, default=0)
+    worked_hours = db.Column(db.Float, default=0)
+    overtime_hours = db.Column(db.Float, default=0)
+    night_shift_hours = db.Column(db.Float, default=0)
+    absence_days = db.Column(db.Integer, default=0)
+    unjustified_absence_days = db.Column(db.Integer, default=0)
+    
+    # Banco de horas
+    balance_hours = db.Column(db.Float, default=0)  # saldo do mês (extras - faltas injustificadas)
+    carried_balance = db.Column(db.Float, default=0)  # saldo trazido do mês anterior
+    closing_balance = db.Column(db.Float, default=0)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'employee_id': self.employee_id,
+            'year': self.year,
+            'month': self.month,
+            'worked_days': self.worked_days,
+            'worked_hours': self.worked_hours,
+            'overtime_hours': self.overtime_hours,
+            'night_shift_hours': self.night_shift_hours,
+            'absence_days': self.absence_days,
+            'unjustified_absence_days': self.unjustified_absence_days,
+            'balance_hours': self.balance_hours,
+            'carried_balance': self.carried_balance,
+            'closing_balance': self.closing_balance,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class HeadcountSnapshot(db.Model):
+    """Fotografia mensal de quadro de pessoal e turnover por departamento (meses encerrados)"""
+    __tablename__ = 'headcount_snapshots'
+    __table_args__ = (
+        db.Index('ix_headcount_snapshots_period', 'year', 'month', 'department_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'))  # nulo = sem departamento
+    
+    opening_headcount = db.Column(db.Integer, default=0)
+    admissions = db.Column(db.Integer, default=0)
+    dismissals = db.Column(db.Integer, default=0)
+    closing_headcount = db.Column(db.Integer, default=0)
+    
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'year': self.year,
+            'month': self.month,
+            'department_id': self.department_id,
+            'opening_headcount': self.opening_headcount,
+            'admissions': self.admissions,
+            'dismissals': self.dismissals,
+            'closing_headcount': self.closing_headcount,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+class ProvisionSnapshot(db.Model):
+    """Fotografia mensal das provisões de férias e 13º salário por colaborador"""
+    __tablename__ = 'provision_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'year', 'month', name='uq_provision_snapshots_employee_month'),
+        db.Index('ix_provision_snapshots_period', 'year', 'month', 'department_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'))  # departamento no fechamento do mês
+    salary = db.Column(db.Float, default=0)
+    
+    # Avos adquiridos e saldo provisionado no fim do mês
+    vacation_months = db.Column(db.Integer, default=0)  # período em curso + último período completo não pago
+    vacation_provision = db.Column(db.Float, default=0)  # inclui o terço constitucional
+    thirteenth_months = db.Column(db.Integer, default=0)  # ano civil
+    thirteenth_provision = db.Column(db.Float, default=0)
+    
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'employee_id': self.employee_id,
+            'year': self.year,
+            'month': self.month,
+            'department_id': self.department_id,
+            'salary': self.salary,
+            'vacation_months': self.vacation_months,
+            'vacation_provision': self.vacation_provision,
+            'thirteenth_months': self.thirteenth_months,
+            'thirteenth_provision': self.thirteenth_provision,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
 class Benefit(db.Model):
     """Catálogo de benefícios"""
     __tablename__ = 'benefits'
@@ -323,6 +586,11 @@ class InternalCommunication(db.Model):
     published_at = db.Column(db.DateTime)
     expires_at = db.Column(db.DateTime)
     
+    # Contadores mantidos na publicação, leitura e confirmação
+    recipient_count = db.Column(db.Integer, default=0)
+    read_count = db.Column(db.Integer, default=0)
+    confirmation_count = db.Column(db.Integer, default=0)
+    
     # Metadados
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -331,9 +599,33 @@ class InternalCommunication(db.Model):
     author = db.relationship('User', backref='communications')
     confirmations = db.relationship('CommunicationConfirmation', backref='communication', lazy=True)
 
+class CommunicationRecipient(db.Model):
+    """Destinatários de cada comunicado, gerados na publicação (caixa de entrada do colaborador)"""
+    __tablename__ = 'communication_recipients'
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'communication_id', name='uq_communication_recipients_employee'),
+        db.Index('ix_communication_recipients_inbox', 'employee_id', 'published_at', 'communication_id'),
+        db.Index('ix_communication_recipients_unread', 'employee_id', 'read_at'),
+        db.Index('ix_communication_recipients_communication', 'communication_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    communication_id = db.Column(db.Integer, db.ForeignKey('internal_communications.id'), nullable=False)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
+    
+    # Cópia das datas do comunicado para filtrar e ordenar só pelo índice
+    published_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime)
+    
+    read_at = db.Column(db.DateTime)
+    confirmed_at = db.Column(db.DateTime)
+
 class CommunicationConfirmation(db.Model):
     """Confirmações de leitura de comunicados"""
     __tablename__ = 'communication_confirmations'
+    __table_args__ = (
+        db.UniqueConstraint('communication_id', 'employee_id', name='uq_communication_confirmations_employee'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     communication_id = db.Column(db.Integer, db.ForeignKey('internal_communications.id'), nullable=False)
@@ -345,9 +637,13 @@ class CommunicationConfirmation(db.Model):
 class ESocialEvent(db.Model):
     """Eventos do eSocial"""
     __tablename__ = 'esocial_events'
+    __table_args__ = (
+        db.Index('ix_esocial_events_status', 'status', 'batch_id', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
+    batch_id = db.Column(db.Integer, db.ForeignKey('esocial_batches.id'))
     event_type = db.Column(db.String(10), nullable=False)  # S-2200, S-2300, etc.
     event_data = db.Column(db.Text, nullable=False)  # JSON com dados do evento
     receipt_number = db.Column(db.String(50))
@@ -361,13 +657,55 @@ class ESocialEvent(db.Model):
     # Relacionamentos
     employee_ref = db.relationship('Employee', backref='esocial_events')
 
+class ESocialBatch(db.Model):
+    """Lote de eventos do eSocial (até 50 eventos por envio)"""
+    __tablename__ = 'esocial_batches'
+    __table_args__ = (
+        db.Index('ix_esocial_batches_status', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_count = db.Column(db.Integer, default=0)
+    protocol_number = db.Column(db.String(50))
+    status = db.Column(db.String(20), default='pending')  # pending, sent, processed, failed
+    
+    # Tentativas de envio e consultas do protocolo
+    send_attempts = db.Column(db.Integer, default=0)
+    poll_count = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+    
+    # Relacionamentos
+    events = db.relationship('ESocialEvent', backref='batch', lazy=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'event_count': self.event_count,
+            'protocol_number': self.protocol_number,
+            'status': self.status,
+            'send_attempts': self.send_attempts,
+            'poll_count': self.poll_count,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
+
 class PaymentBatch(db.Model):
     """Lotes de pagamento"""
     __tablename__ = 'payment_batches'
     
     id = db.Column(db.Integer, primary_key=True)
     period_id = db.Column(db.Integer, db.ForeignKey('payroll_periods.id'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))  # empresa pagadora (header do arquivo)
     batch_number = db.Column(db.String(20), nullable=False)
+    file_sequence = db.Column(db.Integer)  # NSA do arquivo de remessa
     payment_method = db.Column(db.String(20), nullable=False)  # pix, ted, doc
     total_amount = db.Column(db.Float, nullable=False)
     employee_count = db.Column(db.Integer, nullable=False)
@@ -392,6 +730,10 @@ class PaymentBatch(db.Model):
 class Payment(db.Model):
     """Pagamentos individuais"""
     __tablename__ = 'payments'
+    __table_args__ = (
+        db.Index('ix_payments_batch_employee', 'batch_id', 'employee_id'),
+        db.Index('ix_payments_employee_status', 'employee_id', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     batch_id = db.Column(db.Integer, db.ForeignKey('payment_batches.id'), nullable=False)
@@ -0,0 +1,34 @@
+from src.models.user import db
+
+
+class SearchDocument(db.Model):
+    """Documentos do índice de busca (usado quando o FTS5 não está disponível)"""
+    __tablename__ = 'search_documents'
+
+    entity_code = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    entity_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    company_id = db.Column(db.Integer)
+    label = db.Column(db.String(255))
+    detail = db.Column(db.String(255))
+
+    def __repr__(self):
+        return f'<SearchDocument {self.entity_code}:{self.entity_id}>'
+
+
+class SearchTerm(db.Model):
+    """Termos normalizados do índice de busca, para consultas por prefixo"""
+    __tablename__ = 'search_terms'
+    __table_args__ = (
+        db.Index('ix_search_terms_lookup', 'entity_code', 'company_id', 'term'),
+        db.Index('ix_search_terms_document', 'entity_code', 'entity_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity_code = db.Column(db.Integer, nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    company_id = db.Column(db.Integer)
+    term = db.Column(db.String(60), nullable=False)
+    weight = db.Column(db.Integer, default=1)  # 2 = título, 1 = demais campos
+
+    def __repr__(self):
+        return f'<SearchTerm {self.term}>'
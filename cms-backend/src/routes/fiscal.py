@@ -1,13 +1,21 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, send_file, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, date
 from decimal import Decimal
+import os
 
 from src.models.user import db, User
+from src.models.accounting import Company
 from src.models.fiscal import (
     TaxType, TaxRate, Customer, Product, 
-    Invoice, InvoiceItem, InvoiceTax
+    Invoice, InvoiceItem, InvoiceTax, StockMovement
 )
+from src.services.danfe import danfe_cache_key, load_invoices, render_invoices
+from src.services.icms_report import icms_by_state, invalidate_rollup
+from src.services.search_index import rebuild_search_index, search as search_index, search_ids_subquery
+from src.services.sped import encode_chunks, generate_efd_icms_ipi
+from src.services.stock import low_stock_query, register_invoice_cancel, register_invoice_issue
+from src.services.zipstream import iter_zip
 
 fiscal_bp = Blueprint('fiscal', __name__)
 
@@ -20,16 +28,14 @@ def get_customers(company_id):
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
-        search = request.args.get('search', '')
+        search = request.args.get('search', '').strip()
         
         query = Customer.query.filter_by(company_id=company_id, is_active=True)
         
         if search:
-            query = query.filter(
-                (Customer.name.contains(search)) |
-                (Customer.document.contains(search)) |
-                (Customer.email.contains(search))
-            )
+            # Busca por prefixo no índice textual em vez de LIKE '%termo%'
+            matches = search_ids_subquery('customer', company_id, search)
+            query = query.filter(Customer.id.in_(db.select(matches.c.entity_id)))
         
         customers = query.order_by(Customer.name).paginate(
             page=page, per_page=per_page, error_out=False
@@ -134,17 +140,15 @@ def get_products(company_id):
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
-        search = request.args.get('search', '')
+        search = request.args.get('search', '').strip()
         product_type = request.args.get('type')
         
         query = Product.query.filter_by(company_id=company_id, is_active=True)
         
         if search:
-            query = query.filter(
-                (Product.name.contains(search)) |
-                (Product.code.contains(search)) |
-                (Product.description.contains(search))
-            )
+            # Busca por prefixo no índice textual em vez de LIKE '%termo%'
+            matches = search_ids_subquery('product', company_id, search)
+            query = query.filter(Product.id.in_(db.select(matches.c.entity_id)))
         
         if product_type:
             query = query.filter_by(type=product_type)
@@ -245,6 +249,50 @@ def update_product(product_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# ==================== ESTOQUE ====================
+
+@fiscal_bp.route('/companies/<int:company_id>/stock/low', methods=['GET'])
+@jwt_required()
+def get_low_stock_products(company_id):
+    """Listar produtos com estoque abaixo do mínimo"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        
+        products = low_stock_query(company_id).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        
+        return jsonify({
+            'products': [product.to_dict() for product in products.items],
+            'total': products.total,
+            'pages': products.pages,
+            'current_page': page
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@fiscal_bp.route('/products/<int:product_id>/stock-movements', methods=['GET'])
+@jwt_required()
+def get_stock_movements(product_id):
+    """Histórico de movimentações de estoque do produto"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 50, type=int)
+        
+        movements = StockMovement.query.filter_by(product_id=product_id).order_by(
+            StockMovement.created_at.desc(), StockMovement.id.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        
+        return jsonify({
+            'movements': [movement.to_dict() for movement in movements.items],
+            'total': movements.total,
+            'pages': movements.pages,
+            'current_page': page
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ==================== NOTAS FISCAIS ====================
 
 @fiscal_bp.route('/companies/<int:company_id>/invoices', methods=['GET'])
@@ -413,7 +461,14 @@ def issue_invoice(invoice_id):
     try:
         invoice = Invoice.query.get_or_404(invoice_id)
         
-        if invoice.status != 'draft':
+        # Troca de status condicional: duas emissões simultâneas não baixam o estoque duas vezes
+        claimed = db.session.execute(
+            db.update(Invoice)
+            .where(Invoice.id == invoice_id, Invoice.status == 'draft')
+            .values(status='issued')
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
             return jsonify({'error': 'Apenas notas em rascunho podem ser emitidas'}), 400
         
         # Aqui seria implementada a integração com SEFAZ
@@ -423,6 +478,10 @@ def issue_invoice(invoice_id):
         invoice.access_key = f"35{datetime.now().strftime('%y%m')}{invoice.company.cnpj.replace('.', '').replace('/', '').replace('-', '')}{invoice.model}{invoice.series.zfill(3)}{invoice.number:09d}{invoice.id:08d}1"
         invoice.authorization_protocol = f"135{datetime.now().strftime('%y%m%d%H%M%S')}{invoice.id:06d}"
         
+        # Baixa de estoque na mesma transação da emissão
+        register_invoice_issue(invoice, get_jwt_identity())
+        invalidate_rollup(invoice.company_id, invoice.issue_date)
+        
         db.session.commit()
         
         return jsonify({
@@ -442,7 +501,13 @@ def cancel_invoice(invoice_id):
         invoice = Invoice.query.get_or_404(invoice_id)
         data = request.get_json()
         
-        if invoice.status not in ['issued']:
+        claimed = db.session.execute(
+            db.update(Invoice)
+            .where(Invoice.id == invoice_id, Invoice.status == 'issued')
+            .values(status='cancelled')
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
             return jsonify({'error': 'Apenas notas emitidas podem ser canceladas'}), 400
         
         # Aqui seria implementada a integração com SEFAZ para cancelamento
@@ -451,6 +516,10 @@ def cancel_invoice(invoice_id):
         invoice.status = 'cancelled'
         invoice.internal_notes = f"{invoice.internal_notes or ''}\nCancelada em {datetime.now().strftime('%d/%m/%Y %H:%M')}. Motivo: {data.get('reason', 'Não informado')}"
         
+        # Estorno do estoque movimentado na emissão
+        register_invoice_cancel(invoice, get_jwt_identity())
+        invalidate_rollup(invoice.company_id, invoice.issue_date)
+        
         db.session.commit()
         
         return jsonify({'message': 'Nota fiscal cancelada com sucesso'}), 200
@@ -458,6 +527,150 @@ def cancel_invoice(invoice_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# ==================== DANFE ====================
+
+def _danfe_folder():
+    return current_app.config.get('DANFE_FOLDER') or os.path.join(current_app.root_path, 'database', 'danfe')
+
+@fiscal_bp.route('/invoices/<int:invoice_id>/danfe', methods=['GET'])
+@jwt_required()
+def get_invoice_danfe(invoice_id):
+    """Baixar o DANFE (PDF) da nota fiscal"""
+    try:
+        invoice = Invoice.query.get_or_404(invoice_id)
+        
+        if invoice.status not in ['issued', 'cancelled']:
+            return jsonify({'error': 'DANFE disponível apenas para notas emitidas'}), 400
+        
+        # Requisição condicional: se o cliente já tem a versão atual, não renderiza
+        key = danfe_cache_key(invoice.id, invoice.updated_at)
+        if request.if_none_match.contains(key):
+            response = Response(status=304)
+            response.set_etag(key)
+            return response
+        
+        results, _ = render_invoices(load_invoices([invoice.id]), _danfe_folder())
+        key, path = results[invoice.id]
+        
+        return send_file(
+            path,
+            mimetype='application/pdf',
+            download_name=f"danfe-{invoice.number:09d}-{invoice.series}.pdf",
+            etag=key,
+            last_modified=invoice.updated_at,
+            conditional=True,
+            max_age=0
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _requested_invoice_ids():
+    data = request.get_json(silent=True) or {}
+    ids = data.get('invoice_ids')
+    if ids is None:
+        ids = [value for value in request.args.get('ids', '').split(',') if value.strip()]
+    return [int(value) for value in ids]
+
+@fiscal_bp.route('/companies/<int:company_id>/invoices/danfe/render', methods=['POST'])
+@jwt_required()
+def render_invoices_danfe(company_id):
+    """Renderizar em lote os DANFEs das notas informadas"""
+    try:
+        invoice_ids = _requested_invoice_ids()
+        if not invoice_ids:
+            return jsonify({'error': 'Informe as notas fiscais'}), 400
+        
+        invoices = [
+            invoice for invoice in load_invoices(invoice_ids, company_id)
+            if invoice.status in ['issued', 'cancelled']
+        ]
+        results, rendered = render_invoices(
+            invoices, _danfe_folder(), current_app.config.get('DANFE_RENDER_WORKERS')
+        )
+        
+        return jsonify({
+            'message': 'DANFEs disponíveis',
+            'rendered': rendered,
+            'cached': len(results) - rendered,
+            'invoices': sorted(results.keys())
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@fiscal_bp.route('/companies/<int:company_id>/invoices/danfe.zip', methods=['GET', 'POST'])
+@jwt_required()
+def download_invoices_danfe(company_id):
+    """Baixar os DANFEs de várias notas em um arquivo ZIP"""
+    try:
+        invoice_ids = _requested_invoice_ids()
+        if not invoice_ids:
+            return jsonify({'error': 'Informe as notas fiscais'}), 400
+        
+        invoices = [
+            invoice for invoice in load_invoices(invoice_ids, company_id)
+            if invoice.status in ['issued', 'cancelled']
+        ]
+        if not invoices:
+            return jsonify({'error': 'Nenhuma nota emitida encontrada'}), 404
+        
+        results, _ = render_invoices(
+            invoices, _danfe_folder(), current_app.config.get('DANFE_RENDER_WORKERS')
+        )
+        
+        # O ZIP é gerado em streaming a partir dos arquivos em cache
+        entries = [
+            (f"danfe-{invoice.number:09d}-{invoice.series}.pdf", results[invoice.id][1])
+            for invoice in sorted(invoices, key=lambda i: (i.series, i.number))
+        ]
+        
+        return Response(
+            iter_zip(entries),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename=danfe-{company_id}.zip'}
+        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# ==================== BUSCA ====================
+
+FISCAL_SEARCH_TYPES = ['customer', 'product', 'invoice']
+
+@fiscal_bp.route('/companies/<int:company_id>/search', methods=['GET'])
+@jwt_required()
+def search_company(company_id):
+    """Busca unificada de clientes, produtos e notas fiscais"""
+    try:
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        types = [name for name in request.args.get('types', '').split(',') if name]
+        
+        invalid = [name for name in types if name not in FISCAL_SEARCH_TYPES]
+        if invalid:
+            return jsonify({'error': f"Tipo de busca inválido: {', '.join(invalid)}"}), 400
+        
+        results = search_index(company_id, query, types or FISCAL_SEARCH_TYPES, limit)
+        
+        return jsonify({
+            'query': query,
+            'results': results,
+            'total': len(results)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@fiscal_bp.route('/search/rebuild', methods=['POST'])
+@jwt_required()
+def rebuild_search():
+    """Reconstruir o índice de busca"""
+    try:
+        rebuild_search_index(FISCAL_SEARCH_TYPES)
+        return jsonify({'message': 'Índice de busca reconstruído com sucesso'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 # ==================== TIPOS DE IMPOSTOS ====================
 
 @fiscal_bp.route('/tax-types', methods=['GET'])
@@ -553,3 +766,51 @@ def get_fiscal_summary(company_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@fiscal_bp.route('/companies/<int:company_id>/icms-by-state', methods=['GET'])
+@jwt_required()
+def get_icms_by_state(company_id):
+    """Relatório de ICMS e DIFAL por UF de destino (padrão: acumulado do ano)"""
+    try:
+        today = date.today()
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else date(today.year, 1, 1)
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else today
+        
+        if start_date > end_date:
+            return jsonify({'error': 'Período inválido'}), 400
+        
+        if not Company.query.get(company_id):
+            return jsonify({'error': 'Empresa não encontrada'}), 404
+        
+        return jsonify(icms_by_state(company_id, start_date, end_date)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@fiscal_bp.route('/companies/<int:company_id>/sped/efd-icms-ipi', methods=['GET'])
+@jwt_required()
+def export_efd_icms_ipi(company_id):
+    """Exportar o arquivo SPED EFD ICMS/IPI do mês (gerado em streaming)"""
+    try:
+        year = request.args.get('year', type=int)
+        month = request.args.get('month', type=int)
+        
+        if not year or not month or not 1 <= month <= 12:
+            return jsonify({'error': 'Informe ano e mês válidos'}), 400
+        
+        company = Company.query.get(company_id)
+        if not company:
+            return jsonify({'error': 'Empresa não encontrada'}), 404
+        
+        lines = generate_efd_icms_ipi(company_id, year, month)
+        filename = f"efd-icms-ipi-{company_id}-{year}{month:02d}.txt"
+        
+        return Response(
+            stream_with_context(encode_chunks(lines)),
+            content_type='text/plain; charset=iso-8859-1',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,16 +1,45 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, send_file, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import db
 from src.models.hr_advanced import (
-    Employee, Dependent, PayrollPeriod, PayrollItem, TimeRecord,
+    Employee, Dependent, PayrollPeriod, TimeRecord,
     Benefit, EmployeeBenefit, Training, EmployeeTraining,
     PerformanceEvaluation, InternalCommunication, CommunicationConfirmation,
-    ESocialEvent, PaymentBatch, Payment
+    ESocialEvent, PaymentBatch, Payment, PayrollTaxTable, PayrollJob, TimeBankSummary,
+    ESocialBatch, Payslip
 )
-from datetime import datetime, date, timedelta
+from src.models.accounting import Company
+from src.models.departments import Department
+from datetime import datetime, date
 import json
 import calendar
 
+from src.services.benefits import employer_cost_report
+from src.services.communications import (
+    communication_stats, confirm_read, employee_inbox, mark_read, publish_communication, unread_count
+)
+from src.services.employee_import import import_employees
+from src.services.esocial import dispatch, is_dispatching
+from src.services.headcount import headcount_report
+from src.services.hr_analytics import yearly_analytics
+from src.services.hr_dashboard import dashboard_stats
+from src.services.payment_batches import create_batch, import_return, iter_remittance, remittance_filename
+from src.services.payroll import calculate_period
+from src.services.payroll_jobs import active_job, create_job, fail_stale_jobs, prepare_retry, run_job
+from src.services.payroll_posting import post_payroll_period
+from src.services.payroll_report import iter_report_csv, iter_report_xlsx, report_page, report_subtotals
+from src.services.payroll_simulation import MAX_SCENARIOS, simulate_period
+from src.services.payroll_tax import TAXES, create_tax_table
+from src.services.payslips import archive_path, payslip_filename, payslip_folder, render_period, render_period_payslips
+from src.services.provisions import department_balances, provision_month
+from src.services.search_index import autocomplete, rebuild_search_index, search_ids_subquery
+from src.services.sped import encode_chunks
+from src.services.time_bank import refresh_months, refresh_period
+from src.services.time_clock import import_afd, ingest_punches
+from src.services.worked_hours import compute_day, recompute_period
+from src.services.workers import run_in_background
+from src.services.zipstream import iter_zip
+
 hr_bp = Blueprint('hr_advanced', __name__)
 
 # ==================== GESTÃO DE COLABORADORES ====================
@@ -22,14 +51,16 @@ def get_employees():
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
-        search = request.args.get('search', '')
+        search = request.args.get('search', '').strip()
         department_id = request.args.get('department_id', type=int)
         status = request.args.get('status', 'active')
         
         query = Employee.query
         
         if search:
-            query = query.filter(Employee.full_name.contains(search))
+            # Nome, CPF, matrícula, PIS ou cargo por prefixo no índice textual
+            matches = search_ids_subquery('employee', None, search)
+            query = query.filter(Employee.id.in_(db.select(matches.c.entity_id)))
         if department_id:
             query = query.filter(Employee.department_id == department_id)
         if status:
@@ -49,6 +80,40 @@ def get_employees():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@hr_bp.route('/employees/search', methods=['GET'])
+@jwt_required()
+def search_employees():
+    """Autocompletar colaboradores por nome, CPF, matrícula, PIS ou cargo"""
+    try:
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        
+        results = autocomplete('employee', None, query, limit)
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'employees': [{
+                'id': result['id'],
+                'name': result['label'],
+                'detail': result['detail']
+            } for result in results],
+            'total': len(results)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/employees/search/rebuild', methods=['POST'])
+@jwt_required()
+def rebuild_employee_search():
+    """Reconstruir o índice de busca de colaboradores"""
+    try:
+        rebuild_search_index(['employee'])
+        return jsonify({'success': True, 'message': 'Índice de colaboradores reconstruído com sucesso'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @hr_bp.route('/employees', methods=['POST'])
 @jwt_required()
 def create_employee():
@@ -120,6 +185,39 @@ def create_employee():
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@hr_bp.route('/employees/import', methods=['POST'])
+@jwt_required()
+def import_employees_file():
+    """Admitir colaboradores e dependentes em lote a partir de CSV ou XLSX"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
+        
+        upload = request.files['file']
+        dry_run = (request.form.get('dry_run') or request.args.get('dry_run', 'false')).lower() == 'true'
+        try:
+            summary = import_employees(
+                upload.stream, upload.filename or '', created_by=int(get_jwt_identity()), dry_run=dry_run
+            )
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{summary['employees']} colaboradores {'validados' if dry_run else 'importados'}, "
+                       f"{len(summary['errors'])} linhas com erro",
+            **summary
+        }), 200 if dry_run or not summary['employees'] else 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @hr_bp.route('/employees/<int:employee_id>', methods=['PUT'])
 @jwt_required()
 def update_employee(employee_id):
@@ -276,88 +374,37 @@ def calculate_payroll(period_id):
         if period.status != 'open':
             return jsonify({'success': False, 'message': 'Período não está aberto para cálculo'}), 400
         
-        # Buscar colaboradores ativos
-        employees = Employee.query.filter_by(status='active').all()
+        if active_job(period_id):
+            return jsonify({'success': False, 'message': 'Já existe um cálculo em andamento para este período'}), 400
         
-        calculated_count = 0
-        
-        for employee in employees:
-            # Verificar se já existe cálculo para este funcionário no período
-            existing_item = PayrollItem.query.filter_by(
-                employee_id=employee.id,
-                period_id=period_id
-            ).first()
-            
-            if existing_item:
-                continue  # Pular se já calculado
-            
-            # Buscar registros de ponto do período
-            time_records = TimeRecord.query.filter(
-                TimeRecord.employee_id == employee.id,
-                TimeRecord.record_date >= period.start_date,
-                TimeRecord.record_date <= period.end_date
-            ).all()
-            
-            # Calcular horas trabalhadas e extras
-            total_worked_hours = sum(record.worked_hours or 0 for record in time_records)
-            total_overtime_hours = sum(record.overtime_hours or 0 for record in time_records)
-            
-            # Cálculos básicos
-            base_salary = employee.salary
-            overtime_value = (base_salary / 220) * 1.5 * total_overtime_hours  # 220 horas mensais, 50% adicional
-            
-            # Cálculo do INSS (simplificado)
-            gross_salary = base_salary + overtime_value
-            inss = min(gross_salary * 0.11, 713.10)  # Teto do INSS 2024
-            
-            # Cálculo do IRRF (simplificado)
-            irrf_base = gross_salary - inss
-            if irrf_base <= 1903.98:
-                irrf = 0
-            elif irrf_base <= 2826.65:
-                irrf = (irrf_base * 0.075) - 142.80
-            elif irrf_base <= 3751.05:
-                irrf = (irrf_base * 0.15) - 354.80
-            elif irrf_base <= 4664.68:
-                irrf = (irrf_base * 0.225) - 636.13
-            else:
-                irrf = (irrf_base * 0.275) - 869.36
-            
-            irrf = max(irrf, 0)
-            
-            # FGTS (8% sobre o salário bruto)
-            fgts = gross_salary * 0.08
-            
-            # Descontos de benefícios (exemplo: 6% vale transporte)
-            transport_voucher = base_salary * 0.06
-            
-            total_deductions = inss + irrf + transport_voucher
-            net_salary = gross_salary - total_deductions
-            
-            # Criar item da folha
-            payroll_item = PayrollItem(
-                employee_id=employee.id,
-                period_id=period_id,
-                base_salary=base_salary,
-                overtime_hours=total_overtime_hours,
-                overtime_value=overtime_value,
-                inss=inss,
-                irrf=irrf,
-                fgts=fgts,
-                transport_voucher=transport_voucher,
-                gross_salary=gross_salary,
-                total_deductions=total_deductions,
-                net_salary=net_salary,
-                calculated_at=datetime.utcnow()
+        # Modo paralelo: faixas calculadas no pool de processos, em segundo plano
+        data = request.get_json(silent=True) or {}
+        if (data.get('mode') or request.args.get('mode')) == 'parallel':
+            job = create_job(
+                period,
+                chunk_size=data.get('chunk_size') or request.args.get('chunk_size', type=int),
+                workers=data.get('workers') or request.args.get('workers', type=int),
+                user_id=get_jwt_identity()
             )
+            run_in_background(current_app._get_current_object(), run_job, job.id)
             
-            db.session.add(payroll_item)
-            calculated_count += 1
+            return jsonify({
+                'success': True,
+                'message': f'Cálculo iniciado para {job.total_employees} colaboradores',
+                'job': job.to_dict()
+            }), 202
+        
+        # Cálculo em lote: poucas consultas e inserção em massa dos itens
+        calculated_count = calculate_period(period)
         
         # Atualizar status do período
         period.status = 'calculated'
         db.session.commit()
         
+        # Holerites renderizados em segundo plano para o período calculado
+        if current_app.config.get('PAYSLIP_AUTO_RENDER', True):
+            run_in_background(current_app._get_current_object(), render_period_payslips, period.id)
+        
         return jsonify({
             'success': True,
             'message': f'Folha calculada para {calculated_count} colaboradores',
@@ -368,36 +415,372 @@ def calculate_payroll(period_id):
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@hr_bp.route('/payroll/items/<int:period_id>', methods=['GET'])
+@hr_bp.route('/payroll/simulate/<int:period_id>', methods=['POST'])
 @jwt_required()
-def get_payroll_items(period_id):
-    """Listar itens da folha de pagamento"""
+def simulate_payroll(period_id):
+    """Simular a folha do período em um ou mais cenários, sem gravar"""
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        data = request.get_json(silent=True) or {}
+        scenarios = data.get('scenarios') or [{'name': 'Atual'}]
+        
+        if not isinstance(scenarios, list) or len(scenarios) > MAX_SCENARIOS:
+            return jsonify({'success': False, 'message': f'Informe até {MAX_SCENARIOS} cenários'}), 400
+        
+        return jsonify({
+            'success': True,
+            'period_id': period.id,
+            'reference': period.reference,
+            'scenarios': simulate_period(period, scenarios)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_payroll_job(job_id):
+    """Acompanhar o cálculo paralelo da folha"""
+    try:
+        job = PayrollJob.query.get_or_404(job_id)
+        fail_stale_jobs(job.period_id)
+        return jsonify({
+            'success': True,
+            'job': job.to_dict(include_chunks=True)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/jobs/<int:job_id>/retry', methods=['POST'])
+@jwt_required()
+def retry_payroll_job(job_id):
+    """Reprocessar as faixas com erro de um cálculo paralelo"""
+    try:
+        job = PayrollJob.query.get_or_404(job_id)
+        fail_stale_jobs(job.period_id)
+        
+        if job.status != 'failed':
+            return jsonify({'success': False, 'message': 'Apenas cálculos com erro podem ser reprocessados'}), 400
+        
+        retried = prepare_retry(job)
+        run_in_background(current_app._get_current_object(), run_job, job.id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Reprocessamento iniciado para {retried} faixa(s)',
+            'job': job.to_dict()
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/tax-tables', methods=['GET'])
+@jwt_required()
+def get_payroll_tax_tables():
+    """Listar tabelas de INSS e IRRF"""
+    try:
+        tax = request.args.get('tax')
+        
+        query = PayrollTaxTable.query
+        if tax:
+            query = query.filter_by(tax=tax)
+        
+        tables = query.order_by(PayrollTaxTable.tax, PayrollTaxTable.effective_date.desc()).all()
+        
+        return jsonify({
+            'success': True,
+            'tables': [table.to_dict() for table in tables]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/tax-tables', methods=['POST'])
+@jwt_required()
+def create_payroll_tax_table():
+    """Cadastrar nova vigência de tabela de INSS ou IRRF"""
+    try:
+        data = request.get_json()
+        tax = data.get('tax')
+        
+        if tax not in TAXES:
+            return jsonify({'success': False, 'message': 'Tributo deve ser inss ou irrf'}), 400
+        if not data.get('effective_date') or not data.get('brackets'):
+            return jsonify({'success': False, 'message': 'Vigência e faixas são obrigatórias'}), 400
+        
+        effective_date = datetime.strptime(data.get('effective_date'), '%Y-%m-%d').date()
+        existing = PayrollTaxTable.query.filter_by(tax=tax, effective_date=effective_date).first()
+        if existing:
+            return jsonify({'success': False, 'message': 'Já existe tabela com esta vigência'}), 400
+        
+        table = create_tax_table(
+            tax, effective_date,
+            [(bracket.get('upper_limit'), float(bracket.get('rate')), float(bracket.get('deduction') or 0))
+             for bracket in data.get('brackets')],
+            description=data.get('description'),
+            base_ceiling=data.get('base_ceiling'),
+            dependent_deduction=float(data.get('dependent_deduction') or 0),
+            simplified_deduction=float(data.get('simplified_deduction') or 0)
+        )
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Tabela cadastrada com sucesso',
+            'table': table.to_dict()
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/periods/<int:period_id>/accounting', methods=['POST'])
+@jwt_required()
+def post_payroll_accounting(period_id):
+    """Contabilizar a folha do período (lançamentos por departamento gravados em lote)"""
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        data = request.get_json(silent=True) or {}
+        
+        if period.status == 'open':
+            return jsonify({'success': False, 'message': 'Folha do período ainda não foi calculada'}), 400
+        
+        status = data.get('status', 'posted')
+        if status not in ('draft', 'posted'):
+            return jsonify({'success': False, 'message': 'Status inválido (use draft ou posted)'}), 400
+        
+        company = Company.query.get(data['company_id']) if data.get('company_id') else \
+            Company.query.filter_by(is_active=True).order_by(Company.id).first()
+        if not company:
+            return jsonify({'success': False, 'message': 'Empresa não encontrada'}), 404
+        
+        try:
+            summary = post_payroll_period(period, company.id, int(get_jwt_identity()), status=status)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': str(e)}), 400
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Folha contabilizada com sucesso' if status == 'posted' else 'Rascunho da contabilização gerado',
+            **summary
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/provisions', methods=['POST'])
+@jwt_required()
+def create_provisions():
+    """Calcular as provisões de férias e 13º do mês e contabilizar as variações"""
+    try:
+        data = request.get_json(silent=True) or {}
+        today = date.today()
+        year = int(data.get('year') or today.year)
+        month = int(data.get('month') or today.month)
+        if not 1 <= month <= 12:
+            return jsonify({'success': False, 'message': 'Mês inválido'}), 400
+        
+        status = data.get('status', 'posted')
+        if status not in ('draft', 'posted'):
+            return jsonify({'success': False, 'message': 'Status inválido (use draft ou posted)'}), 400
+        
+        company = Company.query.get(data['company_id']) if data.get('company_id') else \
+            Company.query.filter_by(is_active=True).order_by(Company.id).first()
+        if not company:
+            return jsonify({'success': False, 'message': 'Empresa não encontrada'}), 404
+        
+        try:
+            summary = provision_month(year, month, company.id, int(get_jwt_identity()), status=status)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': str(e)}), 400
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Provisões do mês sem alteração' if summary['unchanged'] else 'Provisões calculadas com sucesso',
+            **summary
+        }), 200 if summary['unchanged'] else 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/provisions', methods=['GET'])
+@jwt_required()
+def get_provisions():
+    """Saldos de provisão de férias e 13º do mês por departamento"""
     try:
-        items = db.session.query(PayrollItem, Employee).join(
-            Employee, PayrollItem.employee_id == Employee.id
-        ).filter(PayrollItem.period_id == period_id).all()
+        today = date.today()
+        year = request.args.get('year', today.year, type=int)
+        month = request.args.get('month', today.month, type=int)
+        
+        balances = department_balances([(year, month)])[(year, month)]
+        names = dict(db.session.query(Department.id, Department.name).all())
+        departments = [{
+            'department_id': department_id,
+            'department': names.get(department_id),
+            'employees': count,
+            'vacation_provision': float(vacation),
+            'thirteenth_provision': float(thirteenth),
+        } for department_id, (count, vacation, thirteenth) in balances.items()]
+        departments.sort(key=lambda item: item['department'] or '')
         
         return jsonify({
             'success': True,
-            'items': [{
-                'employee_id': item.PayrollItem.employee_id,
-                'employee_name': item.Employee.full_name,
-                'employee_code': item.Employee.employee_code,
-                'position': item.Employee.position,
-                'base_salary': item.PayrollItem.base_salary,
-                'overtime_hours': item.PayrollItem.overtime_hours,
-                'overtime_value': item.PayrollItem.overtime_value,
-                'gross_salary': item.PayrollItem.gross_salary,
-                'inss': item.PayrollItem.inss,
-                'irrf': item.PayrollItem.irrf,
-                'transport_voucher': item.PayrollItem.transport_voucher,
-                'total_deductions': item.PayrollItem.total_deductions,
-                'net_salary': item.PayrollItem.net_salary
-            } for item in items]
+            'year': year,
+            'month': month,
+            'departments': departments,
+            'employees': sum(item['employees'] for item in departments),
+            'vacation_provision': round(sum(item['vacation_provision'] for item in departments), 2),
+            'thirteenth_provision': round(sum(item['thirteenth_provision'] for item in departments), 2),
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@hr_bp.route('/payroll/periods/<int:period_id>/payslips/render', methods=['POST'])
+@jwt_required()
+def render_payslips(period_id):
+    """Renderizar em segundo plano os holerites do período"""
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        
+        if period.status == 'open':
+            return jsonify({'success': False, 'message': 'Folha do período ainda não foi calculada'}), 400
+        
+        run_in_background(current_app._get_current_object(), render_period_payslips, period.id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Renderização dos holerites iniciada',
+            'rendered': Payslip.query.filter_by(period_id=period.id).count()
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/periods/<int:period_id>/payslips/<int:employee_id>', methods=['GET'])
+@jwt_required()
+def get_payslip(period_id, employee_id):
+    """Baixar o holerite (PDF) do colaborador no período"""
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        
+        # Renderiza só se os dados da folha mudaram desde o último holerite (source_hash)
+        folder = payslip_folder()
+        render_period(period, folder, employee_ids=[employee_id], max_workers=1)
+        payslip = Payslip.query.filter_by(period_id=period_id, employee_id=employee_id).first()
+        if not payslip:
+            return jsonify({'success': False, 'message': 'Holerite não encontrado'}), 404
+        
+        # O hash do conteúdo é a ETag: o arquivo de um hash nunca muda
+        if request.if_none_match.contains(payslip.content_hash):
+            response = Response(status=304)
+            response.set_etag(payslip.content_hash)
+            return response
+        
+        response = send_file(
+            archive_path(folder, payslip.content_hash),
+            mimetype='application/pdf',
+            download_name=payslip_filename(period, employee_id),
+            etag=payslip.content_hash,
+            last_modified=payslip.rendered_at,
+            conditional=True,
+            max_age=current_app.config.get('PAYSLIP_CACHE_MAX_AGE', 86400)
+        )
+        # Documento pessoal: apenas o navegador do usuário pode guardar em cache
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/periods/<int:period_id>/payslips.zip', methods=['GET'])
+@jwt_required()
+def download_payslips_zip(period_id):
+    """Baixar os holerites do período (opcionalmente de um departamento) em um ZIP"""
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        department_id = request.args.get('department_id', type=int)
+        
+        if period.status == 'open':
+            return jsonify({'success': False, 'message': 'Folha do período ainda não foi calculada'}), 400
+        
+        # Garante os holerites ausentes; os já renderizados não são refeitos
+        folder = payslip_folder()
+        render_period(period, folder, department_id=department_id,
+                      max_workers=current_app.config.get('PAYSLIP_RENDER_WORKERS'))
+        
+        query = db.session.query(Payslip.employee_id, Payslip.content_hash).filter(Payslip.period_id == period_id)
+        if department_id:
+            query = query.filter(Payslip.department_id == department_id)
+        payslips = query.order_by(Payslip.employee_id).all()
+        if not payslips:
+            return jsonify({'success': False, 'message': 'Nenhum holerite encontrado'}), 404
+        
+        # O ZIP é gerado em streaming a partir dos arquivos do acervo
+        entries = [
+            (payslip_filename(period, employee_id), archive_path(folder, content_hash))
+            for employee_id, content_hash in payslips
+        ]
+        suffix = f'-departamento-{department_id}' if department_id else ''
+        
+        return Response(
+            iter_zip(entries),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename=holerites-{period.year}{period.month:02d}{suffix}.zip'}
+        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payroll/items/<int:period_id>', methods=['GET'])
+@jwt_required()
+def get_payroll_items(period_id):
+    """Relatório da folha: itens paginados por cursor e, na primeira página, subtotais por departamento e da empresa
+
+    Com format=csv ou format=xlsx devolve o relatório completo em streaming.
+    """
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        department_id = request.args.get('department_id', type=int)
+        export_format = request.args.get('format', '').lower()
+        
+        if export_format in ('csv', 'xlsx'):
+            filename = f'folha-{period.year}{period.month:02d}.{export_format}'
+            if export_format == 'csv':
+                body = (chunk.encode('utf-8') for chunk in iter_report_csv(period.id, department_id))
+                content_type = 'text/csv; charset=utf-8'
+            else:
+                body = iter_report_xlsx(period.id, department_id, sheet_name=f'Folha {period.month:02d}-{period.year}')
+                content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            return Response(
+                stream_with_context(body),
+                content_type=content_type,
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
+        if export_format:
+            return jsonify({'success': False, 'message': 'Formato inválido (use csv ou xlsx)'}), 400
+        
+        try:
+            items, next_cursor = report_page(
+                period.id,
+                cursor=request.args.get('cursor'),
+                limit=request.args.get('limit', 100, type=int),
+                department_id=department_id
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        response = {'success': True, 'items': items, 'next_cursor': next_cursor}
+        # Subtotais só na primeira página: não mudam entre as páginas do mesmo relatório
+        if not request.args.get('cursor'):
+            departments, company = report_subtotals(period.id, department_id)
+            response['subtotals'] = {'departments': departments, 'company': company}
+        
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # ==================== CONTROLE DE PONTO ====================
 
 @hr_bp.route('/timerecords', methods=['POST'])
@@ -436,27 +819,15 @@ def record_time():
         else:
             return jsonify({'success': False, 'message': 'Todos os horários já foram registrados hoje'}), 400
         
-        # Calcular horas trabalhadas se tiver saída final
-        if time_record.exit_time_2:
-            morning_hours = 0
-            afternoon_hours = 0
-            
-            if time_record.entry_time_1 and time_record.exit_time_1:
-                morning_delta = datetime.combine(date.today(), time_record.exit_time_1) - \
-                               datetime.combine(date.today(), time_record.entry_time_1)
-                morning_hours = morning_delta.total_seconds() / 3600
-            
-            if time_record.entry_time_2 and time_record.exit_time_2:
-                afternoon_delta = datetime.combine(date.today(), time_record.exit_time_2) - \
-                                 datetime.combine(date.today(), time_record.entry_time_2)
-                afternoon_hours = afternoon_delta.total_seconds() / 3600
-            
-            total_hours = morning_hours + afternoon_hours
-            time_record.worked_hours = total_hours
-            
-            # Calcular horas extras (acima de 8h/dia)
-            if total_hours > 8:
-                time_record.overtime_hours = total_hours - 8
+        # Horas trabalhadas, extras e noturnas (considera jornadas que passam da meia-noite)
+        hours = compute_day(
+            time_record.record_date,
+            [time_record.entry_time_1, time_record.exit_time_1, time_record.entry_time_2, time_record.exit_time_2],
+            time_record.status or 'normal'
+        )
+        time_record.worked_hours = hours.worked
+        time_record.overtime_hours = hours.overtime
+        time_record.night_shift_hours = hours.night
         
         # Salvar localização se fornecida
         if data.get('latitude') and data.get('longitude'):
@@ -465,6 +836,8 @@ def record_time():
             time_record.location_address = data.get('address')
         
         time_record.updated_at = datetime.utcnow()
+        db.session.flush()
+        refresh_months([(time_record.employee_id, time_record.record_date)])
         db.session.commit()
         
         return jsonify({
@@ -479,6 +852,101 @@ def record_time():
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def _parse_punch(punch):
+    if punch.get('datetime'):
+        return datetime.fromisoformat(punch['datetime'])
+    return datetime.strptime(f"{punch.get('date')} {punch.get('time')}", '%Y-%m-%d %H:%M')
+
+@hr_bp.route('/timerecords/batch', methods=['POST'])
+@jwt_required()
+def record_time_batch():
+    """Registrar marcações de ponto em lote (relógios de ponto)"""
+    try:
+        data = request.get_json()
+        punches = data.get('punches') or []
+        
+        parsed, invalid = [], []
+        for index, punch in enumerate(punches):
+            try:
+                parsed.append((int(punch['employee_id']), _parse_punch(punch)))
+            except (KeyError, TypeError, ValueError):
+                invalid.append({'index': index, 'reason': 'Colaborador, data ou hora inválidos'})
+        
+        known_ids = set(db.session.execute(
+            db.select(Employee.id).where(Employee.id.in_({employee_id for employee_id, _ in parsed}))
+        ).scalars())
+        for employee_id, moment in parsed:
+            if employee_id not in known_ids:
+                invalid.append({'employee_id': employee_id, 'datetime': moment.isoformat(), 'reason': 'Colaborador não encontrado'})
+        
+        summary = ingest_punches([punch for punch in parsed if punch[0] in known_ids])
+        db.session.commit()
+        
+        summary['rejected'] = invalid + summary['rejected']
+        return jsonify({
+            'success': True,
+            'message': f"{summary['inserted']} marcações registradas",
+            **summary
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/timerecords/afd', methods=['POST'])
+@jwt_required()
+def import_time_records_afd():
+    """Importar arquivo AFD do relógio de ponto (REP)"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
+        
+        summary = import_afd(request.files['file'].stream)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{summary['inserted']} marcações importadas",
+            **summary
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/timerecords/recompute', methods=['POST'])
+@jwt_required()
+def recompute_time_records():
+    """Recalcular as horas dos registros de ponto de um período"""
+    try:
+        data = request.get_json()
+        
+        if not data.get('start_date') or not data.get('end_date'):
+            return jsonify({'success': False, 'message': 'Período obrigatório'}), 400
+        
+        start_date = datetime.strptime(data.get('start_date'), '%Y-%m-%d').date()
+        end_date = datetime.strptime(data.get('end_date'), '%Y-%m-%d').date()
+        result = recompute_period(
+            start_date,
+            end_date,
+            employee_id=data.get('employee_id'),
+            daily_hours=float(data.get('daily_hours') or 8)
+        )
+        
+        # Resumo mensal (banco de horas) dos meses recalculados
+        result['months_refreshed'] = refresh_period(start_date, end_date, data.get('employee_id'))
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{result['updated']} registros atualizados",
+            **result
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @hr_bp.route('/timerecords/<int:employee_id>', methods=['GET'])
 @jwt_required()
 def get_employee_timerecords(employee_id):
@@ -486,15 +954,29 @@ def get_employee_timerecords(employee_id):
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 31, type=int), 366)
         
         query = TimeRecord.query.filter_by(employee_id=employee_id)
+        summaries = TimeBankSummary.query.filter_by(employee_id=employee_id)
         
+        # Filtros por intervalo direto na coluna (usa o índice por colaborador e data)
         if start_date:
-            query = query.filter(TimeRecord.record_date >= datetime.strptime(start_date, '%Y-%m-%d').date())
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            query = query.filter(TimeRecord.record_date >= start_date)
+            summaries = summaries.filter(
+                TimeBankSummary.year * 100 + TimeBankSummary.month >= start_date.year * 100 + start_date.month
+            )
         if end_date:
-            query = query.filter(TimeRecord.record_date <= datetime.strptime(end_date, '%Y-%m-%d').date())
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            query = query.filter(TimeRecord.record_date <= end_date)
+            summaries = summaries.filter(
+                TimeBankSummary.year * 100 + TimeBankSummary.month <= end_date.year * 100 + end_date.month
+            )
         
-        records = query.order_by(TimeRecord.record_date.desc()).all()
+        records = query.order_by(TimeRecord.record_date.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
         
         return jsonify({
             'success': True,
@@ -507,9 +989,18 @@ def get_employee_timerecords(employee_id):
                 'exit_time_2': record.exit_time_2.strftime('%H:%M') if record.exit_time_2 else None,
                 'worked_hours': record.worked_hours,
                 'overtime_hours': record.overtime_hours,
+                'night_shift_hours': record.night_shift_hours,
                 'status': record.status,
                 'observations': record.observations
-            } for record in records]
+            } for record in records.items],
+            'monthly_summary': [
+                summary.to_dict() for summary in summaries.order_by(
+                    TimeBankSummary.year.desc(), TimeBankSummary.month.desc()
+                ).all()
+            ],
+            'total': records.total,
+            'pages': records.pages,
+            'current_page': page
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -563,6 +1054,22 @@ def get_employee_benefits(employee_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@hr_bp.route('/benefits/costs/<int:period_id>', methods=['GET'])
+@jwt_required()
+def get_benefit_costs(period_id):
+    """Custo dos benefícios no período por benefício e departamento (empresa x colaborador)"""
+    try:
+        period = PayrollPeriod.query.get_or_404(period_id)
+        report = employer_cost_report(period)
+        return jsonify({
+            'success': True,
+            'period_id': period.id,
+            'reference': period.reference,
+            **report
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # ==================== TREINAMENTOS ====================
 
 @hr_bp.route('/trainings', methods=['GET'])
@@ -615,11 +1122,24 @@ def get_employee_trainings(employee_id):
 @hr_bp.route('/communications', methods=['GET'])
 @jwt_required()
 def get_communications():
-    """Listar comunicações internas"""
+    """Listar comunicações internas com os contadores de leitura e confirmação"""
     try:
-        communications = InternalCommunication.query.filter_by(
-            status='published'
-        ).order_by(InternalCommunication.published_at.desc()).all()
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        status = request.args.get('status', 'published')
+        include_expired = request.args.get('include_expired', 'false').lower() == 'true'
+
+        query = InternalCommunication.query
+        if status:
+            query = query.filter(InternalCommunication.status == status)
+        if not include_expired:
+            query = query.filter(db.or_(
+                InternalCommunication.expires_at.is_(None),
+                InternalCommunication.expires_at > datetime.utcnow()
+            ))
+        communications = query.order_by(
+            InternalCommunication.published_at.desc(), InternalCommunication.id.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
         
         return jsonify({
             'success': True,
@@ -629,10 +1149,17 @@ def get_communications():
                 'content': comm.content,
                 'type': comm.type,
                 'priority': comm.priority,
+                'status': comm.status,
                 'published_at': comm.published_at.isoformat() if comm.published_at else None,
                 'expires_at': comm.expires_at.isoformat() if comm.expires_at else None,
-                'requires_confirmation': comm.requires_confirmation
-            } for comm in communications]
+                'requires_confirmation': comm.requires_confirmation,
+                'recipient_count': comm.recipient_count or 0,
+                'read_count': comm.read_count or 0,
+                'confirmation_count': comm.confirmation_count or 0
+            } for comm in communications.items],
+            'total': communications.total,
+            'pages': communications.pages,
+            'current_page': page
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -640,7 +1167,7 @@ def get_communications():
 @hr_bp.route('/communications', methods=['POST'])
 @jwt_required()
 def create_communication():
-    """Criar comunicação interna"""
+    """Criar comunicação interna (publicada, exceto se status='draft')"""
     try:
         data = request.get_json()
         
@@ -655,25 +1182,139 @@ def create_communication():
             requires_confirmation=data.get('requires_confirmation', False),
             send_email=data.get('send_email', True),
             send_push=data.get('send_push', True),
-            status='published',
-            published_at=datetime.utcnow(),
+            status='draft',
             expires_at=datetime.strptime(data.get('expires_at'), '%Y-%m-%d %H:%M:%S') if data.get('expires_at') else None,
             created_by=get_jwt_identity()
         )
         
         db.session.add(communication)
+        recipients = 0
+        if data.get('status', 'published') != 'draft':
+            recipients = publish_communication(communication)
         db.session.commit()
         
         return jsonify({
             'success': True,
             'message': 'Comunicação criada com sucesso',
-            'communication_id': communication.id
+            'communication_id': communication.id,
+            'status': communication.status,
+            'recipient_count': recipients
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@hr_bp.route('/communications/<int:communication_id>/publish', methods=['POST'])
+@jwt_required()
+def publish_draft_communication(communication_id):
+    """Publicar um rascunho e gerar as caixas de entrada dos destinatários"""
+    try:
+        communication = InternalCommunication.query.get_or_404(communication_id)
+        if communication.status == 'archived':
+            return jsonify({'success': False, 'message': 'Comunicação arquivada não pode ser publicada'}), 400
+        
+        recipients = publish_communication(communication)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Comunicação publicada com sucesso',
+            'recipient_count': recipients
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/communications/<int:communication_id>/stats', methods=['GET'])
+@jwt_required()
+def get_communication_stats(communication_id):
+    """Alcance, leituras e confirmações de uma comunicação"""
+    try:
+        communication = InternalCommunication.query.get_or_404(communication_id)
+        return jsonify({
+            'success': True,
+            'communication_id': communication.id,
+            'stats': communication_stats(communication)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/employees/<int:employee_id>/inbox', methods=['GET'])
+@jwt_required()
+def get_employee_inbox(employee_id):
+    """Caixa de entrada do colaborador (paginação por cursor)"""
+    try:
+        Employee.query.get_or_404(employee_id)
+        try:
+            items, next_cursor = employee_inbox(
+                employee_id,
+                cursor=request.args.get('cursor'),
+                limit=request.args.get('limit', 20, type=int),
+                unread_only=request.args.get('unread_only', 'false').lower() == 'true'
+            )
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Cursor inválido'}), 400
+        
+        return jsonify({
+            'success': True,
+            'communications': items,
+            'next_cursor': next_cursor,
+            'unread_count': unread_count(employee_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/communications/<int:communication_id>/read', methods=['POST'])
+@jwt_required()
+def read_communication(communication_id):
+    """Marcar comunicação como lida pelo colaborador"""
+    try:
+        data = request.get_json() or {}
+        employee_id = data.get('employee_id')
+        if not employee_id:
+            return jsonify({'success': False, 'message': 'employee_id é obrigatório'}), 400
+        
+        if not mark_read(communication_id, int(employee_id)):
+            return jsonify({'success': False, 'message': 'Colaborador não é destinatário da comunicação'}), 404
+        db.session.commit()
+        
+        return jsonify({'success': True, 'unread_count': unread_count(int(employee_id))})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/communications/<int:communication_id>/confirm', methods=['POST'])
+@jwt_required()
+def confirm_communication(communication_id):
+    """Registrar a confirmação de leitura do colaborador"""
+    try:
+        data = request.get_json() or {}
+        employee_id = data.get('employee_id')
+        if not employee_id:
+            return jsonify({'success': False, 'message': 'employee_id é obrigatório'}), 400
+        
+        confirmed = confirm_read(
+            communication_id, int(employee_id),
+            ip_address=request.remote_addr,
+            user_agent=request.headers.get('User-Agent')
+        )
+        if confirmed is None:
+            return jsonify({'success': False, 'message': 'Colaborador não é destinatário da comunicação'}), 404
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Leitura confirmada' if confirmed else 'Leitura já havia sido confirmada',
+            'already_confirmed': not confirmed
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # ==================== DASHBOARDS E RELATÓRIOS ====================
 
 @hr_bp.route('/dashboard/stats', methods=['GET'])
@@ -681,57 +1322,11 @@ def create_communication():
 def get_hr_dashboard_stats():
     """Estatísticas para o dashboard de RH"""
     try:
-        # Contadores básicos
-        total_employees = Employee.query.filter_by(status='active').count()
-        total_departments = db.session.query(Employee.department_id).distinct().count()
-        
-        # Funcionários por departamento
-        dept_stats = db.session.query(
-            Employee.department_id,
-            db.func.count(Employee.id).label('count')
-        ).filter_by(status='active').group_by(Employee.department_id).all()
-        
-        # Aniversariantes do mês
-        current_month = datetime.now().month
-        birthdays = Employee.query.filter(
-            db.extract('month', Employee.birth_date) == current_month,
-            Employee.status == 'active'
-        ).count()
-        
-        # Admissões recentes (últimos 30 dias)
-        thirty_days_ago = datetime.now().date() - timedelta(days=30)
-        recent_admissions = Employee.query.filter(
-            Employee.admission_date >= thirty_days_ago,
-            Employee.status == 'active'
-        ).count()
-        
-        # Folha de pagamento do mês atual
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-        current_period = PayrollPeriod.query.filter_by(
-            year=current_year,
-            month=current_month
-        ).first()
-        
-        payroll_total = 0
-        if current_period:
-            payroll_total = db.session.query(
-                db.func.sum(PayrollItem.net_salary)
-            ).filter_by(period_id=current_period.id).scalar() or 0
-        
+        stats, cached = dashboard_stats()
         return jsonify({
             'success': True,
-            'stats': {
-                'total_employees': total_employees,
-                'total_departments': total_departments,
-                'birthdays_this_month': birthdays,
-                'recent_admissions': recent_admissions,
-                'payroll_total': payroll_total,
-                'employees_by_department': [
-                    {'department_id': stat[0], 'count': stat[1]} 
-                    for stat in dept_stats
-                ]
-            }
+            'cached': cached,
+            'stats': stats
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -743,28 +1338,79 @@ def get_turnover_report():
     try:
         year = request.args.get('year', datetime.now().year, type=int)
         
-        # Admissões por mês
-        admissions = db.session.query(
-            db.extract('month', Employee.admission_date).label('month'),
-            db.func.count(Employee.id).label('count')
-        ).filter(
-            db.extract('year', Employee.admission_date) == year
-        ).group_by(db.extract('month', Employee.admission_date)).all()
-        
-        # Demissões por mês
-        dismissals = db.session.query(
-            db.extract('month', Employee.dismissal_date).label('month'),
-            db.func.count(Employee.id).label('count')
-        ).filter(
-            db.extract('year', Employee.dismissal_date) == year,
-            Employee.dismissal_date.isnot(None)
-        ).group_by(db.extract('month', Employee.dismissal_date)).all()
+        report = headcount_report(year, 1, year, 12)
+        db.session.commit()
         
         return jsonify({
             'success': True,
             'year': year,
-            'admissions': [{'month': int(item[0]), 'count': item[1]} for item in admissions],
-            'dismissals': [{'month': int(item[0]), 'count': item[1]} for item in dismissals]
+            'admissions': [
+                {'month': item['month'], 'count': item['admissions']}
+                for item in report['months'] if item['admissions']
+            ],
+            'dismissals': [
+                {'month': item['month'], 'count': item['dismissals']}
+                for item in report['months'] if item['dismissals']
+            ],
+            'turnover_rate': report['totals']['turnover_rate']
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/reports/headcount', methods=['GET'])
+@jwt_required()
+def get_headcount_report():
+    """Quadro de pessoal e turnover mensal em um intervalo de meses (AAAA-MM)"""
+    try:
+        today = date.today()
+        start = datetime.strptime(request.args.get('start', f'{today.year}-01'), '%Y-%m')
+        end = datetime.strptime(request.args.get('end', today.strftime('%Y-%m')), '%Y-%m')
+        
+        report = headcount_report(
+            start.year, start.month, end.year, end.month,
+            department_id=request.args.get('department_id', type=int),
+            by_department=request.args.get('by_department', 'false').lower() == 'true'
+        )
+        db.session.commit()
+        
+        if report.get('by_department'):
+            names = dict(db.session.query(Department.id, Department.name).all())
+            for item in report['by_department']:
+                item['department'] = names.get(item['department_id'])
+        
+        return jsonify({
+            'success': True,
+            'start': start.strftime('%Y-%m'),
+            'end': end.strftime('%Y-%m'),
+            **report
+        })
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/reports/trainings-evaluations', methods=['GET'])
+@jwt_required()
+def get_trainings_evaluations_report():
+    """Treinamentos e avaliações do ano por departamento (matrizes por mês, categoria e trimestre)"""
+    try:
+        year = request.args.get('year', datetime.now().year, type=int)
+        department_id = request.args.get('department_id', type=int)
+        
+        report, cached = yearly_analytics(year)
+        if department_id:
+            report = {
+                **report,
+                'departments': [item for item in report['departments'] if item['department_id'] == department_id]
+            }
+        
+        return jsonify({
+            'success': True,
+            'cached': cached,
+            **report
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -776,12 +1422,24 @@ def get_turnover_report():
 def get_esocial_events():
     """Listar eventos do eSocial"""
     try:
-        events = ESocialEvent.query.order_by(ESocialEvent.created_at.desc()).limit(100).all()
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 100, type=int), 500)
+        status = request.args.get('status')
+        event_type = request.args.get('event_type')
+        
+        query = ESocialEvent.query
+        if status:
+            query = query.filter(ESocialEvent.status == status)
+        if event_type:
+            query = query.filter(ESocialEvent.event_type == event_type)
+        
+        events = query.order_by(ESocialEvent.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
         return jsonify({
             'success': True,
             'events': [{
                 'id': event.id,
                 'employee_id': event.employee_id,
+                'batch_id': event.batch_id,
                 'event_type': event.event_type,
                 'status': event.status,
                 'receipt_number': event.receipt_number,
@@ -789,7 +1447,55 @@ def get_esocial_events():
                 'sent_at': event.sent_at.isoformat() if event.sent_at else None,
                 'error_message': event.error_message,
                 'created_at': event.created_at.isoformat()
-            } for event in events]
+            } for event in events.items],
+            'total': events.total,
+            'pages': events.pages,
+            'current_page': page
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/esocial/dispatch', methods=['POST'])
+@jwt_required()
+def dispatch_esocial_events():
+    """Iniciar o envio dos eventos pendentes em segundo plano"""
+    try:
+        pending = ESocialEvent.query.filter_by(status='pending').count()
+        
+        if is_dispatching():
+            return jsonify({'success': False, 'message': 'Envio ao eSocial já em andamento', 'pending_events': pending}), 409
+        
+        run_in_background(current_app._get_current_object(), dispatch)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Envio ao eSocial iniciado',
+            'pending_events': pending
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/esocial/batches', methods=['GET'])
+@jwt_required()
+def get_esocial_batches():
+    """Listar lotes de eventos do eSocial"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 50, type=int), 200)
+        status = request.args.get('status')
+        
+        query = ESocialBatch.query
+        if status:
+            query = query.filter(ESocialBatch.status == status)
+        
+        batches = query.order_by(ESocialBatch.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        return jsonify({
+            'success': True,
+            'dispatching': is_dispatching(),
+            'batches': [batch.to_dict() for batch in batches.items],
+            'total': batches.total,
+            'pages': batches.pages,
+            'current_page': page
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -799,11 +1505,20 @@ def get_esocial_events():
 def get_payment_batches():
     """Listar lotes de pagamento"""
     try:
-        batches = PaymentBatch.query.order_by(PaymentBatch.created_at.desc()).all()
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        period_id = request.args.get('period_id', type=int)
+        
+        query = PaymentBatch.query
+        if period_id:
+            query = query.filter(PaymentBatch.period_id == period_id)
+        
+        batches = query.order_by(PaymentBatch.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
         return jsonify({
             'success': True,
             'batches': [{
                 'id': batch.id,
+                'period_id': batch.period_id,
                 'batch_number': batch.batch_number,
                 'payment_method': batch.payment_method,
                 'total_amount': batch.total_amount,
@@ -811,8 +1526,94 @@ def get_payment_batches():
                 'status': batch.status,
                 'created_at': batch.created_at.isoformat(),
                 'processed_at': batch.processed_at.isoformat() if batch.processed_at else None
-            } for batch in batches]
+            } for batch in batches.items],
+            'total': batches.total,
+            'pages': batches.pages,
+            'current_page': page
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@hr_bp.route('/payments/batches', methods=['POST'])
+@jwt_required()
+def create_payment_batch():
+    """Gerar lote de pagamento a partir da folha calculada"""
+    try:
+        data = request.get_json()
+        
+        period = PayrollPeriod.query.get(data.get('period_id'))
+        if not period:
+            return jsonify({'success': False, 'message': 'Período não encontrado'}), 404
+        
+        for field in ('payment_method', 'bank_code', 'agency', 'account'):
+            if not data.get(field):
+                return jsonify({'success': False, 'message': f'Campo {field} é obrigatório'}), 400
+        
+        batch = create_batch(
+            period,
+            data['payment_method'],
+            data['bank_code'],
+            data['agency'],
+            data['account'],
+            bank_name=data.get('bank_name'),
+            company_id=data.get('company_id')
+        )
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Lote {batch.batch_number} gerado com {batch.employee_count} pagamentos',
+            'batch_id': batch.id,
+            'batch_number': batch.batch_number,
+            'employee_count': batch.employee_count,
+            'total_amount': batch.total_amount
+        }), 201
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payments/batches/<int:batch_id>/remittance', methods=['GET'])
+@jwt_required()
+def download_payment_remittance(batch_id):
+    """Baixar o arquivo de remessa CNAB 240 do lote (gerado em streaming)"""
+    try:
+        batch = PaymentBatch.query.get_or_404(batch_id)
+        company = Company.query.get(batch.company_id) if batch.company_id else \
+            Company.query.filter_by(is_active=True).order_by(Company.id).first()
+        if not company:
+            return jsonify({'success': False, 'message': 'Empresa pagadora não encontrada'}), 404
+        
+        return Response(
+            stream_with_context(encode_chunks(iter_remittance(batch, company))),
+            content_type='text/plain; charset=iso-8859-1',
+            headers={'Content-Disposition': f'attachment; filename={remittance_filename(batch)}'}
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@hr_bp.route('/payments/batches/<int:batch_id>/return', methods=['POST'])
+@jwt_required()
+def import_payment_return(batch_id):
+    """Importar arquivo de retorno CNAB 240 e atualizar os pagamentos do lote"""
+    try:
+        batch = PaymentBatch.query.get_or_404(batch_id)
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'}), 400
+        
+        summary = import_return(batch, request.files['file'].stream)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{summary['updated']} pagamentos atualizados",
+            'batch_status': batch.status,
+            **summary
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
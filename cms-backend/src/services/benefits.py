@@ -0,0 +1,154 @@
+"""Benefícios e dependentes na folha, carregados uma vez por período
+
+load_benefits e load_dependents fazem uma consulta cada e devolvem
+dicionários por colaborador com tipos simples, para serem anexados às
+entradas da folha (PayrollInput) e usados em compute_lines, inclusive no pool
+de processos. split_benefit define quanto de cada benefício é custo da
+empresa e quanto é descontado do colaborador:
+
+- o valor do vínculo é o custo mensal (ou % do salário, se o benefício for
+  do tipo percentage); vínculos sem valor usam o valor padrão do benefício;
+- benefícios tributáveis são concedidos em utilidade: entram nas bases de
+  INSS, IRRF e FGTS sem aumentar o líquido (taxable_benefits no item);
+- nos demais, a participação do colaborador segue a categoria
+  (EMPLOYEE_SHARES; BENEFIT_EMPLOYEE_SHARES na configuração substitui).
+"""
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from src.models.user import db
+from src.models.departments import Department
+from src.models.hr_advanced import Benefit, Dependent, Employee, EmployeeBenefit
+
+# Categoria: (rubrica de desconto, base da participação, taxa); a rubrica deve estar em DEDUCTION_FIELDS
+EMPLOYEE_SHARES = {
+    'transport': ('transport_voucher', 'salary', 0.06),  # até 6% do salário-base, limitado ao custo
+    'meal': ('meal_voucher', 'cost', 0.20),              # até 20% do custo (PAT)
+    'food': ('meal_voucher', 'cost', 0.20),
+    'health': ('health_insurance', 'cost', 0.0),
+    'dental': ('dental_insurance', 'cost', 0.0),
+    'life': ('life_insurance', 'cost', 0.0),
+}
+DEDUCTION_FIELDS = ('transport_voucher', 'meal_voucher', 'health_insurance', 'dental_insurance', 'life_insurance')
+
+BenefitGrant = namedtuple('BenefitGrant', 'benefit_id category value_type value is_taxable')
+
+
+def employee_shares(app=None):
+    """EMPLOYEE_SHARES com as categorias sobrescritas em BENEFIT_EMPLOYEE_SHARES"""
+    app = app or current_app
+    return {**EMPLOYEE_SHARES, **app.config.get('BENEFIT_EMPLOYEE_SHARES', {})}
+
+
+def load_benefits(period):
+    """{employee_id: (BenefitGrant, ...)} dos vínculos ativos em algum dia do período"""
+    rows = db.session.execute(
+        select(
+            EmployeeBenefit.employee_id, Benefit.id, Benefit.category, Benefit.value_type,
+            func.coalesce(func.nullif(EmployeeBenefit.value, 0), Benefit.default_value, 0), Benefit.is_taxable
+        )
+        .join(Benefit, Benefit.id == EmployeeBenefit.benefit_id)
+        .where(
+            EmployeeBenefit.is_active == True,
+            Benefit.is_active == True,
+            EmployeeBenefit.start_date <= period.end_date,
+            or_(EmployeeBenefit.end_date.is_(None), EmployeeBenefit.end_date >= period.start_date)
+        )
+        .order_by(EmployeeBenefit.employee_id, Benefit.id)
+    )
+    benefits = {}
+    for employee_id, benefit_id, category, value_type, value, is_taxable in rows:
+        benefits.setdefault(employee_id, []).append(
+            BenefitGrant(benefit_id, category or '', value_type or 'fixed', float(value or 0), bool(is_taxable))
+        )
+    return {employee_id: tuple(grants) for employee_id, grants in benefits.items()}
+
+
+def load_dependents(period):
+    """{employee_id: dependentes para o IRRF} (os nascidos até o fim do período)"""
+    return dict(db.session.execute(
+        select(Dependent.employee_id, func.count(Dependent.id))
+        .where(
+            Dependent.is_ir_dependent == True,
+            or_(Dependent.birth_date.is_(None), Dependent.birth_date <= period.end_date)
+        )
+        .group_by(Dependent.employee_id)
+    ).all())
+
+
+def split_benefit(grant, salary, shares=EMPLOYEE_SHARES):
+    """(custo, rubrica de desconto, participação do colaborador, valor tributável em utilidade)"""
+    cost = round(salary * grant.value / 100 if grant.value_type == 'percentage' else grant.value, 2)
+    if grant.is_taxable:
+        return cost, None, 0.0, cost
+    rule = shares.get(grant.category)
+    if rule is None:
+        return cost, None, 0.0, 0.0
+    field, base, rate = rule
+    share = min(round((salary if base == 'salary' else cost) * rate, 2), cost)
+    return cost, field, share, 0.0
+
+
+def employer_cost_report(period, shares=None):
+    """Custo dos benefícios no período por benefício e departamento
+
+    Usa as mesmas regras da folha (split_benefit) sobre os dicionários do
+    período: uma consulta de vínculos, uma de colaboradores e uma de nomes.
+    """
+    shares = shares or employee_shares()
+    benefits = load_benefits(period)
+    employees = {
+        row[0]: (row[1], float(row[2] or 0)) for row in db.session.execute(
+            select(Employee.id, Employee.department_id, Employee.salary)
+            .where(Employee.status == 'active', Employee.id.in_(select(EmployeeBenefit.employee_id)))
+        )
+    }
+    benefit_names = dict(db.session.execute(select(Benefit.id, Benefit.name)).all())
+    department_names = dict(db.session.execute(select(Department.id, Department.name)).all())
+
+    groups = OrderedDict()
+    for employee_id, grants in benefits.items():
+        if employee_id not in employees:
+            continue
+        department_id, salary = employees[employee_id]
+        for grant in grants:
+            cost, _, share, _ = split_benefit(grant, salary, shares)
+            group = groups.get((grant.benefit_id, department_id))
+            if group is None:
+                group = groups[(grant.benefit_id, department_id)] = {
+                    'benefit_id': grant.benefit_id,
+                    'benefit': benefit_names.get(grant.benefit_id),
+                    'category': grant.category,
+                    'department_id': department_id,
+                    'department': department_names.get(department_id),
+                    'employees': 0,
+                    'total_cost': 0.0,
+                    'employee_share': 0.0,
+                }
+            group['employees'] += 1
+            group['total_cost'] += cost
+            group['employee_share'] += share
+
+    by_benefit, by_department = OrderedDict(), OrderedDict()
+    rows = []
+    for group in sorted(groups.values(), key=lambda item: (item['benefit'] or '', item['department'] or '')):
+        group['total_cost'] = round(group['total_cost'], 2)
+        group['employee_share'] = round(group['employee_share'], 2)
+        group['employer_cost'] = round(group['total_cost'] - group['employee_share'], 2)
+        rows.append(group)
+        for totals, key, label in ((by_benefit, group['benefit_id'], 'benefit'),
+                                   (by_department, group['department_id'], 'department')):
+            entry = totals.setdefault(key, {f'{label}_id': key, label: group[label],
+                                            'total_cost': 0.0, 'employee_share': 0.0, 'employer_cost': 0.0})
+            for field in ('total_cost', 'employee_share', 'employer_cost'):
+                entry[field] = round(entry[field] + group[field], 2)
+
+    return {
+        'items': rows,
+        'by_benefit': list(by_benefit.values()),
+        'by_department': sorted(by_department.values(), key=lambda item: item['department'] or ''),
+        'totals': {field: round(sum(group[field] for group in rows), 2)
+                   for field in ('total_cost', 'employee_share', 'employer_cost')},
+    }
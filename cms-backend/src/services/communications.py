@@ -0,0 +1,250 @@
+"""Distribuição dos comunicados internos (fan-out na publicação)
+
+Ao publicar, os destinatários (todos, departamentos ou colaboradores
+específicos) são gravados em communication_recipients com um único
+INSERT ... SELECT. A caixa de entrada passa a ser uma leitura por índice
+(colaborador, data de publicação) com paginação por cursor, e os totais de
+leitura e confirmação ficam em contadores no próprio comunicado.
+
+Comunicados publicados antes da caixa de entrada (contadores nulos) recebem
+os destinatários uma única vez em backfill_recipients, chamada na
+inicialização.
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, func, insert, literal, or_, select, tuple_, update
+
+from src.models.user import db
+from src.models.hr_advanced import (
+    CommunicationConfirmation, CommunicationRecipient, Employee, InternalCommunication
+)
+
+DEFAULT_INBOX_LIMIT = 20
+MAX_INBOX_LIMIT = 100
+
+
+def _ids(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    return [int(item) for item in value]
+
+
+def recipients_query(communication):
+    """Colaboradores ativos alcançados pelo comunicado"""
+    query = select(Employee.id).where(Employee.status == 'active')
+    if communication.target_type == 'department':
+        query = query.where(Employee.department_id.in_(_ids(communication.target_departments)))
+    elif communication.target_type == 'specific':
+        query = query.where(Employee.id.in_(_ids(communication.target_employees)))
+    return query
+
+
+def publish_communication(communication, published_at=None):
+    """Publica o comunicado e grava os destinatários. Não faz commit."""
+    if communication.status == 'published' and communication.recipient_count:
+        return communication.recipient_count
+
+    communication.status = 'published'
+    communication.published_at = published_at or communication.published_at or datetime.utcnow()
+    db.session.flush()
+
+    employee_ids = recipients_query(communication).subquery()
+    db.session.execute(insert(CommunicationRecipient).from_select(
+        ['communication_id', 'employee_id', 'published_at', 'expires_at'],
+        select(
+            literal(communication.id), employee_ids.c.id,
+            literal(communication.published_at, CommunicationRecipient.published_at.type),
+            literal(communication.expires_at, CommunicationRecipient.expires_at.type),
+        )
+    ))
+    communication.recipient_count = db.session.execute(
+        select(func.count(CommunicationRecipient.id))
+        .where(CommunicationRecipient.communication_id == communication.id)
+    ).scalar()
+    return communication.recipient_count
+
+
+def backfill_recipients():
+    """Distribui os comunicados ainda sem contadores e semeia leituras e confirmações. Não faz commit.
+
+    Os publicados recebem os destinatários pelas regras atuais (colaboradores
+    ativos); quem já havia confirmado fica com a leitura e a confirmação
+    marcadas na caixa de entrada.
+    """
+    pending = InternalCommunication.query.filter(InternalCommunication.recipient_count.is_(None)).all()
+    for communication in pending:
+        if communication.status == 'published':
+            publish_communication(communication)
+            confirmed_at = select(CommunicationConfirmation.confirmed_at).where(
+                CommunicationConfirmation.communication_id == CommunicationRecipient.communication_id,
+                CommunicationConfirmation.employee_id == CommunicationRecipient.employee_id
+            ).scalar_subquery()
+            db.session.execute(
+                update(CommunicationRecipient)
+                .where(CommunicationRecipient.communication_id == communication.id, confirmed_at.is_not(None))
+                .values(read_at=confirmed_at, confirmed_at=confirmed_at)
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            communication.recipient_count = 0
+        confirmations = db.session.execute(
+            select(func.count(CommunicationConfirmation.id))
+            .where(CommunicationConfirmation.communication_id == communication.id)
+        ).scalar()
+        communication.read_count = confirmations
+        communication.confirmation_count = confirmations
+    return len(pending)
+
+
+def _visible(now):
+    return and_(
+        or_(CommunicationRecipient.expires_at.is_(None), CommunicationRecipient.expires_at > now),
+        CommunicationRecipient.published_at <= now
+    )
+
+
+def encode_cursor(published_at, communication_id):
+    return f'{published_at.isoformat()}_{communication_id}'
+
+
+def decode_cursor(cursor):
+    published_at, communication_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(published_at), int(communication_id)
+
+
+def employee_inbox(employee_id, cursor=None, limit=DEFAULT_INBOX_LIMIT, unread_only=False, now=None):
+    """Comunicados do colaborador, do mais recente para o mais antigo, a partir do cursor"""
+    now = now or datetime.utcnow()
+    limit = max(1, min(int(limit or DEFAULT_INBOX_LIMIT), MAX_INBOX_LIMIT))
+    query = (
+        select(
+            CommunicationRecipient.communication_id, CommunicationRecipient.published_at,
+            CommunicationRecipient.expires_at, CommunicationRecipient.read_at, CommunicationRecipient.confirmed_at,
+            InternalCommunication.title, InternalCommunication.content, InternalCommunication.type,
+            InternalCommunication.priority, InternalCommunication.requires_confirmation,
+        )
+        .join(InternalCommunication, InternalCommunication.id == CommunicationRecipient.communication_id)
+        .where(
+            CommunicationRecipient.employee_id == employee_id,
+            InternalCommunication.status == 'published',
+            _visible(now)
+        )
+        .order_by(CommunicationRecipient.published_at.desc(), CommunicationRecipient.communication_id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(
+            tuple_(CommunicationRecipient.published_at, CommunicationRecipient.communication_id) < decode_cursor(cursor)
+        )
+    if unread_only:
+        query = query.where(CommunicationRecipient.read_at.is_(None))
+
+    rows = db.session.execute(query).all()
+    items = [{
+        'id': row.communication_id,
+        'title': row.title,
+        'content': row.content,
+        'type': row.type,
+        'priority': row.priority,
+        'requires_confirmation': row.requires_confirmation,
+        'published_at': row.published_at.isoformat(),
+        'expires_at': row.expires_at.isoformat() if row.expires_at else None,
+        'read_at': row.read_at.isoformat() if row.read_at else None,
+        'confirmed_at': row.confirmed_at.isoformat() if row.confirmed_at else None,
+    } for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1].published_at, rows[limit - 1].communication_id) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def unread_count(employee_id, now=None):
+    now = now or datetime.utcnow()
+    return db.session.execute(
+        select(func.count(CommunicationRecipient.id))
+        .join(InternalCommunication, InternalCommunication.id == CommunicationRecipient.communication_id)
+        .where(
+            CommunicationRecipient.employee_id == employee_id,
+            CommunicationRecipient.read_at.is_(None),
+            InternalCommunication.status == 'published',
+            _visible(now)
+        )
+    ).scalar()
+
+
+def _recipient_update(communication_id, employee_id, **values):
+    return update(CommunicationRecipient).where(
+        CommunicationRecipient.communication_id == communication_id,
+        CommunicationRecipient.employee_id == employee_id
+    ).values(**values).execution_options(synchronize_session=False)
+
+
+def _increment(communication_id, **counters):
+    db.session.execute(
+        update(InternalCommunication)
+        .where(InternalCommunication.id == communication_id)
+        .values(**{name: func.coalesce(getattr(InternalCommunication, name), 0) + amount for name, amount in counters.items()})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def mark_read(communication_id, employee_id, now=None):
+    """Marca como lido; retorna False se o colaborador não é destinatário. Não faz commit."""
+    now = now or datetime.utcnow()
+    result = db.session.execute(
+        _recipient_update(communication_id, employee_id, read_at=now)
+        .where(CommunicationRecipient.read_at.is_(None))
+    )
+    if result.rowcount:
+        _increment(communication_id, read_count=1)
+        return True
+    return db.session.execute(
+        select(CommunicationRecipient.id).where(
+            CommunicationRecipient.communication_id == communication_id,
+            CommunicationRecipient.employee_id == employee_id
+        )
+    ).first() is not None
+
+
+def confirm_read(communication_id, employee_id, ip_address=None, user_agent=None, now=None):
+    """Registra a confirmação de leitura (uma por colaborador). Não faz commit.
+
+    Retorna None se o colaborador não é destinatário, False se já havia
+    confirmado e True quando a confirmação foi registrada.
+    """
+    now = now or datetime.utcnow()
+    if not mark_read(communication_id, employee_id, now):
+        return None
+    result = db.session.execute(
+        _recipient_update(communication_id, employee_id, confirmed_at=now)
+        .where(CommunicationRecipient.confirmed_at.is_(None))
+    )
+    if not result.rowcount:
+        return False
+    db.session.add(CommunicationConfirmation(
+        communication_id=communication_id,
+        employee_id=employee_id,
+        confirmed_at=now,
+        ip_address=ip_address,
+        user_agent=(user_agent or '')[:500] or None
+    ))
+    _increment(communication_id, confirmation_count=1)
+    return True
+
+
+def communication_stats(communication):
+    recipients = communication.recipient_count or 0
+
+    def rate(value):
+        return round((value or 0) / recipients * 100, 2) if recipients else 0.0
+
+    return {
+        'recipient_count': recipients,
+        'read_count': communication.read_count or 0,
+        'confirmation_count': communication.confirmation_count or 0,
+        'read_rate': rate(communication.read_count),
+        'confirmation_rate': rate(communication.confirmation_count),
+        'pending_confirmations': max(recipients - (communication.confirmation_count or 0), 0)
+        if communication.requires_confirmation else 0,
+    }
@@ -0,0 +1,245 @@
+"""Renderização do DANFE (Documento Auxiliar da NF-e) com cache em disco"""
+import glob
+import os
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from src.models.user import db
+from src.models.fiscal import Invoice, InvoiceItem
+from src.services.pdf import PdfPage, MARGIN, pages_to_pdf, format_money, format_number
+from src.services.workers import map_in_pool
+
+ITEMS_FIRST_PAGE = 28
+ITEMS_PER_PAGE = 52
+
+
+def danfe_cache_key(invoice_id, updated_at):
+    """Chave do cache: muda sempre que a nota é alterada"""
+    version = updated_at.strftime('%Y%m%d%H%M%S%f') if updated_at else '0'
+    return f"{invoice_id}-{version}"
+
+
+def danfe_path(folder, key):
+    return os.path.join(folder, f"danfe-{key}.pdf")
+
+
+def invoice_snapshot(invoice):
+    """Dados da nota em tipos simples, para renderização em outro processo"""
+    company = invoice.company
+    customer = invoice.customer
+    return {
+        'key': danfe_cache_key(invoice.id, invoice.updated_at),
+        'number': invoice.number,
+        'series': invoice.series,
+        'model': invoice.model,
+        'status': invoice.status,
+        'issue_date': invoice.issue_date.strftime('%d/%m/%Y %H:%M') if invoice.issue_date else '',
+        'access_key': invoice.access_key or '',
+        'authorization_protocol': invoice.authorization_protocol or '',
+        'company': {
+            'name': company.name if company else '',
+            'cnpj': company.cnpj if company else '',
+            'address': company.address if company else '',
+            'city': company.city if company else '',
+            'state': company.state if company else '',
+        },
+        'customer': {
+            'name': customer.name if customer else '',
+            'document': customer.document if customer else '',
+            'address': ' '.join(filter(None, [customer.address, customer.number])) if customer else '',
+            'city': customer.city if customer else '',
+            'state': customer.state if customer else '',
+        },
+        'items': [
+            (
+                item.product.code if item.product else '',
+                item.product.name if item.product else '',
+                item.ncm or '', item.cfop, item.product.unit if item.product else '',
+                float(item.quantity or 0), float(item.unit_price or 0), float(item.total_value or 0),
+                float(item.icms_base or 0), float(item.icms_value or 0),
+                float(item.icms_rate or 0), float(item.ipi_value or 0),
+            )
+            for item in sorted(invoice.items, key=lambda i: i.sequence)
+        ],
+        'totals': {
+            'icms_base': float(invoice.icms_base or 0),
+            'icms_value': float(invoice.icms_value or 0),
+            'products_value': float(invoice.products_value or 0),
+            'freight_value': float(invoice.freight_value or 0),
+            'insurance_value': float(invoice.insurance_value or 0),
+            'discount_value': float(invoice.discount_value or 0),
+            'other_expenses': float(invoice.other_expenses or 0),
+            'ipi_value': float(invoice.ipi_value or 0),
+            'total_value': float(invoice.total_value or 0),
+        },
+        'additional_info': invoice.additional_info or '',
+    }
+
+
+def _draw_header(page, data, page_number, page_count):
+    x1, x2 = MARGIN, page.width - MARGIN
+    y = MARGIN
+    page.box(x1, y, x2, y + 150)
+    page.text(x1 + 15, y + 15, data['company']['name'], size=26)
+    page.text(x1 + 15, y + 55, data['company']['address'], size=16)
+    page.text(x1 + 15, y + 80, f"{data['company']['city']} - {data['company']['state']}", size=16)
+    page.text(x1 + 15, y + 105, f"CNPJ: {data['company']['cnpj']}", size=16)
+    page.text(760, y + 15, 'DANFE', size=30)
+    page.text(760, y + 55, 'Documento Auxiliar da Nota Fiscal Eletrônica', size=13)
+    page.text(760, y + 80, f"Nº {data['number']:09d}  Série {data['series']}", size=18)
+    page.text(760, y + 108, f"Folha {page_number}/{page_count}", size=14)
+    y += 160
+    page.box(x1, y, x2, y + 60)
+    page.label(x1 + 15, y + 10, 'Chave de acesso', data['access_key'], size=18)
+    page.label(760, y + 10, 'Protocolo de autorização', data['authorization_protocol'], size=16)
+    if data['status'] == 'cancelled':
+        page.text(page.width // 2, page.height // 2, 'NF-e CANCELADA', size=90, anchor='mm')
+    return y + 70
+
+
+def _draw_recipient(page, data, y):
+    x1, x2 = MARGIN, page.width - MARGIN
+    page.text(x1, y, 'DESTINATÁRIO / REMETENTE', size=14)
+    y += 20
+    page.box(x1, y, x2, y + 110)
+    customer = data['customer']
+    page.label(x1 + 15, y + 10, 'Nome / Razão social', customer['name'])
+    page.label(760, y + 10, 'CNPJ / CPF', customer['document'])
+    page.label(x1 + 15, y + 60, 'Endereço', customer['address'])
+    page.label(760, y + 60, 'Município / UF', f"{customer['city']} - {customer['state']}")
+    page.label(1020, y + 10, 'Emissão', data['issue_date'], size=14)
+    y += 120
+    page.text(x1, y, 'CÁLCULO DO IMPOSTO', size=14)
+    y += 20
+    page.box(x1, y, x2, y + 110)
+    totals = data['totals']
+    columns = [
+        ('Base ICMS', totals['icms_base']), ('Valor ICMS', totals['icms_value']),
+        ('Valor IPI', totals['ipi_value']), ('Produtos', totals['products_value']),
+        ('Frete', totals['freight_value']), ('Seguro', totals['insurance_value']),
+        ('Desconto', totals['discount_value']), ('Outras despesas', totals['other_expenses']),
+    ]
+    for index, (caption, value) in enumerate(columns):
+        column_x = x1 + 15 + (index % 4) * 280
+        row_y = y + 10 + (index // 4) * 50
+        page.label(column_x, row_y, caption, format_money(value), size=16)
+    y += 120
+    page.box(x1, y, x2, y + 45)
+    page.text(x1 + 15, y + 12, 'VALOR TOTAL DA NOTA', size=16)
+    page.text(x2 - 15, y + 12, format_money(totals['total_value']), size=20, anchor='ra')
+    return y + 60
+
+
+ITEM_COLUMNS = [
+    ('Código', 60), ('Descrição', 180), ('NCM', 520), ('CFOP', 620), ('UN', 690),
+    ('Qtd', 810), ('V. Unit', 920), ('V. Total', 1040), ('ICMS', 1180),
+]
+
+
+def _draw_items(page, items, y):
+    x1, x2 = MARGIN, page.width - MARGIN
+    page.text(x1, y, 'DADOS DOS PRODUTOS / SERVIÇOS', size=14)
+    y += 20
+    page.line(x1, y, x2, y, width=2)
+    for caption, column_x in ITEM_COLUMNS:
+        page.text(column_x, y + 6, caption.upper(), size=12, anchor='ra' if column_x >= 810 else 'la')
+    y += 26
+    page.line(x1, y, x2, y)
+    for code, name, ncm, cfop, unit, quantity, unit_price, total, _, icms_value, _, _ in items:
+        values = [
+            code[:12], name[:38], ncm, cfop, unit, format_number(quantity, 3),
+            format_money(unit_price), format_money(total), format_money(icms_value),
+        ]
+        for (_, column_x), value in zip(ITEM_COLUMNS, values):
+            page.text(column_x, y + 6, value, size=14, anchor='ra' if column_x >= 810 else 'la')
+        y += 26
+        page.line(x1, y, x2, y)
+    return y + 10
+
+
+def render_danfe(data):
+    """Renderiza o DANFE de uma nota (snapshot) e devolve os bytes do PDF"""
+    items = data['items']
+    chunks = [items[:ITEMS_FIRST_PAGE]]
+    remaining = items[ITEMS_FIRST_PAGE:]
+    while remaining:
+        chunks.append(remaining[:ITEMS_PER_PAGE])
+        remaining = remaining[ITEMS_PER_PAGE:]
+
+    pages = []
+    for index, chunk in enumerate(chunks, start=1):
+        page = PdfPage()
+        y = _draw_header(page, data, index, len(chunks))
+        if index == 1:
+            y = _draw_recipient(page, data, y)
+        y = _draw_items(page, chunk, y)
+        if index == len(chunks) and data['additional_info']:
+            page.text(MARGIN, y + 10, 'DADOS ADICIONAIS', size=14)
+            page.text(MARGIN, y + 32, data['additional_info'][:150], size=14)
+        pages.append(page)
+    return pages_to_pdf(pages)
+
+
+def _render_to_file(job):
+    """Executado no pool: renderiza e grava o PDF de forma atômica"""
+    data, path = job
+    content = render_danfe(data)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as handle:
+        handle.write(content)
+    os.replace(temp_path, path)
+    return path
+
+
+def _remove_stale(folder, invoice_id, current_path):
+    for path in glob.glob(os.path.join(folder, f"danfe-{invoice_id}-*.pdf")):
+        if path != current_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def load_invoices(invoice_ids, company_id=None):
+    """Carrega as notas com itens, produtos, cliente e empresa em poucas consultas"""
+    query = Invoice.query.options(
+        selectinload(Invoice.items).joinedload(InvoiceItem.product),
+        joinedload(Invoice.customer),
+        joinedload(Invoice.company),
+    ).filter(Invoice.id.in_(invoice_ids))
+    if company_id is not None:
+        query = query.filter(Invoice.company_id == company_id)
+    return query.all()
+
+
+def render_invoices(invoices, folder, max_workers=None):
+    """Garante o PDF de cada nota no cache; renderiza em lote apenas as ausentes
+
+    Retorna um dicionário {invoice_id: (chave, caminho)} e a quantidade renderizada.
+    """
+    os.makedirs(folder, exist_ok=True)
+    results = {}
+    pending = []
+    for invoice in invoices:
+        key = danfe_cache_key(invoice.id, invoice.updated_at)
+        path = danfe_path(folder, key)
+        results[invoice.id] = (key, path)
+        if not os.path.exists(path):
+            pending.append((invoice, path))
+
+    if pending:
+        jobs = [(invoice_snapshot(invoice), path) for invoice, path in pending]
+        map_in_pool(_render_to_file, jobs, max_workers=max_workers)
+
+        invoices_table = Invoice.__table__
+        for invoice, path in pending:
+            _remove_stale(folder, invoice.id, path)
+            # Atualização direta para não alterar updated_at (que invalidaria o cache)
+            db.session.execute(
+                invoices_table.update()
+                .where(invoices_table.c.id == invoice.id)
+                .values(pdf_file=os.path.basename(path), updated_at=invoices_table.c.updated_at)
+            )
+        db.session.commit()
+
+    return results, len(pending)
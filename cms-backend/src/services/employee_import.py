@@ -0,0 +1,442 @@
+"""Admissão em lote de colaboradores a partir de CSV ou XLSX
+
+O arquivo é lido linha a linha (a primeira linha é o cabeçalho). Cada linha
+é um colaborador ou, com tipo "dependente", um dependente do colaborador
+indicado em cpf_titular no mesmo arquivo. As validações (dígitos de CPF e PIS,
+CPF e matrícula únicos, departamento, datas e salário) usam conjuntos
+carregados uma única vez do banco, sem consulta por linha.
+
+As linhas válidas são gravadas com INSERT em lote (colaboradores com
+RETURNING dos ids, depois os dependentes) e, na mesma transação, são
+enfileirados os eventos do eSocial: S-2200 para CLT e temporários, S-2300 para
+estagiários. Como a inserção em lote não passa pelo flush da sessão, o índice
+de busca e as fotografias de quadro de pessoal são atualizados aqui.
+"""
+import csv
+import io
+import itertools
+import json
+import re
+import unicodedata
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from sqlalchemy import func, insert, select
+
+from src.models.user import db
+from src.models.departments import Department
+from src.models.hr_advanced import Dependent, ESocialEvent, Employee
+from src.services.headcount import invalidate_snapshots
+from src.services.search_index import index_entities, only_digits
+from src.services.xlsx import excel_date, iter_xlsx_rows
+
+MAX_ROWS = 5000
+INSERT_BATCH_SIZE = 1000
+
+CONTRACT_TYPES = ('clt', 'pj', 'intern', 'temporary')
+SALARY_TYPES = ('monthly', 'hourly', 'commission')
+# Evento do eSocial de início do vínculo por tipo de contrato (PJ não gera evento)
+ESOCIAL_EVENTS = {'clt': 'S-2200', 'temporary': 'S-2200', 'intern': 'S-2300'}
+
+# Cabeçalhos aceitos além dos nomes dos campos (já sem acentos e em minúsculas)
+HEADER_ALIASES = {
+    'tipo': 'record_type',
+    'nome': 'full_name',
+    'nome_completo': 'full_name',
+    'nascimento': 'birth_date',
+    'data_nascimento': 'birth_date',
+    'sexo': 'gender',
+    'estado_civil': 'marital_status',
+    'telefone': 'phone',
+    'celular': 'mobile',
+    'endereco': 'address',
+    'numero': 'address_number',
+    'complemento': 'complement',
+    'bairro': 'neighborhood',
+    'cidade': 'city',
+    'uf': 'state',
+    'cep': 'zip_code',
+    'matricula': 'employee_code',
+    'ctps': 'ctps_number',
+    'serie_ctps': 'ctps_series',
+    'pis': 'pis_pasep',
+    'admissao': 'admission_date',
+    'data_admissao': 'admission_date',
+    'departamento': 'department_code',
+    'cargo': 'position',
+    'salario': 'salary',
+    'tipo_salario': 'salary_type',
+    'carga_horaria': 'workload',
+    'contrato': 'contract_type',
+    'banco': 'bank_code',
+    'agencia': 'agency',
+    'conta': 'account',
+    'chave_pix': 'pix_key',
+    'cpf_titular': 'employee_cpf',
+    'parentesco': 'relationship',
+    'dependente_ir': 'is_ir_dependent',
+    'dependente_sf': 'is_sf_dependent',
+}
+
+# Campos de texto copiados como vieram (limitados ao tamanho da coluna)
+TEXT_FIELDS = (
+    'rg', 'gender', 'marital_status', 'email', 'phone', 'mobile', 'emergency_contact', 'emergency_phone',
+    'address', 'address_number', 'complement', 'neighborhood', 'city', 'state', 'zip_code',
+    'ctps_number', 'ctps_series', 'bank_code', 'bank_name', 'agency', 'account', 'account_type',
+    'pix_key', 'pix_type',
+)
+DEPENDENT_RECORD_TYPES = ('dependent', 'dependente')
+TRUE_VALUES = ('1', 's', 'sim', 'y', 'yes', 'true', 'verdadeiro', 'x')
+
+
+# ==================== DOCUMENTOS ====================
+
+def valid_cpf(value):
+    """Confere os dígitos verificadores do CPF (com ou sem máscara)"""
+    digits = only_digits(value)
+    if len(digits) != 11 or digits == digits[0] * 11:
+        return False
+    for size in (9, 10):
+        total = sum(int(digit) * weight for digit, weight in zip(digits[:size], range(size + 1, 1, -1)))
+        if (total * 10) % 11 % 10 != int(digits[size]):
+            return False
+    return True
+
+
+def valid_pis(value):
+    """Confere o dígito verificador do PIS/PASEP/NIT"""
+    digits = only_digits(value)
+    if len(digits) != 11 or digits == digits[0] * 11:
+        return False
+    total = sum(int(digit) * weight for digit, weight in zip(digits[:10], (3, 2, 9, 8, 7, 6, 5, 4, 3, 2)))
+    check = 11 - total % 11
+    return (0 if check >= 10 else check) == int(digits[10])
+
+
+def format_cpf(value):
+    digits = only_digits(value)
+    return f'{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}'
+
+
+# ==================== LEITURA DO ARQUIVO ====================
+
+def _header_key(value):
+    text = unicodedata.normalize('NFKD', str(value or '')).encode('ascii', 'ignore').decode('ascii')
+    key = re.sub(r'[^a-z0-9]+', '_', text.strip().lower()).strip('_')
+    return HEADER_ALIASES.get(key, key)
+
+
+def _csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    first = text.readline()
+    delimiter = ';' if first.count(';') >= first.count(',') else ','
+    return csv.reader(itertools.chain([first], text), delimiter=delimiter)
+
+
+def iter_records(stream, filename=''):
+    """(número da linha, {campo: valor}) de cada linha não vazia após o cabeçalho"""
+    rows = iter_xlsx_rows(stream) if filename.lower().endswith('.xlsx') else _csv_rows(stream)
+    header = next(rows, None)
+    if not header or not any(header):
+        raise ValueError('Arquivo vazio ou sem cabeçalho')
+    keys = [_header_key(value) for value in header]
+    for number, values in enumerate(rows, start=2):
+        record = {
+            key: value for key, value in zip(keys, values)
+            if key and value is not None and str(value).strip() != ''
+        }
+        if record:
+            yield number, record
+
+
+# ==================== CONVERSÕES ====================
+
+def _text(record, field, size=None):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value[:size] if size else value
+
+
+def _document(record, field):
+    """CPF/PIS; números vindos da planilha recuperam os zeros à esquerda"""
+    value = record.get(field)
+    if isinstance(value, (int, float)):
+        return str(int(value)).zfill(11)
+    return _text(record, field)
+
+
+def _date(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, (int, float)):
+        return excel_date(value)
+    for pattern in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(str(value).strip()[:10], pattern).date()
+        except ValueError:
+            continue
+    raise ValueError(f'{field}: data inválida ({value})')
+
+
+def _number(record, field):
+    value = record.get(field)
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = str(value).strip().replace('R$', '').replace(' ', '')
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f'{field}: número inválido ({value})') from None
+
+
+def _flag(record, field, default):
+    value = record.get(field)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+# ==================== VALIDAÇÃO ====================
+
+def _load_references():
+    """Conjuntos usados na validação, carregados uma única vez"""
+    cpfs, codes = set(), set()
+    for cpf, code in db.session.execute(select(Employee.cpf, Employee.employee_code)):
+        cpfs.add(only_digits(cpf))
+        if code:
+            codes.add(code.upper())
+    departments = {}
+    for department_id, code in db.session.execute(select(Department.id, Department.code)):
+        departments[str(department_id)] = department_id
+        if code:
+            departments[code.upper()] = department_id
+    return cpfs, codes, departments
+
+
+def _employee_row(record, cpfs, codes, departments, errors):
+    cpf = _document(record, 'cpf')
+    if not record.get('full_name'):
+        errors.append('Nome obrigatório')
+    if not cpf:
+        errors.append('CPF obrigatório')
+    elif not valid_cpf(cpf):
+        errors.append(f'CPF inválido ({cpf})')
+    elif only_digits(cpf) in cpfs:
+        errors.append(f'CPF já cadastrado ({format_cpf(cpf)})')
+
+    pis = _document(record, 'pis_pasep')
+    if pis and not valid_pis(pis):
+        errors.append(f'PIS inválido ({pis})')
+
+    code = _text(record, 'employee_code', 20)
+    if code and code.upper() in codes:
+        errors.append(f'Matrícula já cadastrada ({code})')
+
+    department_id = None
+    department = _text(record, 'department_code') or _text(record, 'department_id')
+    if department:
+        department_id = departments.get(department.upper())
+        if department_id is None:
+            errors.append(f'Departamento não encontrado ({department})')
+
+    contract_type = (_text(record, 'contract_type') or 'clt').lower()
+    if contract_type not in CONTRACT_TYPES:
+        errors.append(f'Tipo de contrato inválido ({contract_type})')
+    salary_type = (_text(record, 'salary_type') or 'monthly').lower()
+    if salary_type not in SALARY_TYPES:
+        errors.append(f'Tipo de salário inválido ({salary_type})')
+    if not record.get('position'):
+        errors.append('Cargo obrigatório')
+
+    row = {field: _text(record, field, Employee.__table__.c[field].type.length) for field in TEXT_FIELDS}
+    for field, convert in (('birth_date', _date), ('admission_date', _date), ('salary', _number),
+                           ('workload', _number)):
+        try:
+            row[field] = convert(record, field)
+        except ValueError as e:
+            errors.append(str(e))
+            row[field] = None
+    if record.get('admission_date') is None:
+        errors.append('Data de admissão obrigatória')
+    if record.get('salary') is None:
+        errors.append('Salário obrigatório')
+    elif row['salary'] is not None and row['salary'] <= 0:
+        errors.append('Salário deve ser maior que zero')
+
+    row.update(
+        full_name=_text(record, 'full_name', 200),
+        cpf=format_cpf(cpf) if cpf and valid_cpf(cpf) else cpf,
+        pis_pasep=pis[:20] if pis else None,
+        employee_code=code,
+        department_id=department_id,
+        position=_text(record, 'position', 100),
+        salary_type=salary_type,
+        workload=int(row['workload'] or 44),
+        contract_type=contract_type,
+        status='active',
+    )
+    return row
+
+
+def _dependent_row(record, errors):
+    cpf = _document(record, 'cpf')
+    if not record.get('full_name'):
+        errors.append('Nome do dependente obrigatório')
+    if cpf and not valid_cpf(cpf):
+        errors.append(f'CPF do dependente inválido ({cpf})')
+    holder = _document(record, 'employee_cpf')
+    if not holder:
+        errors.append('CPF do titular obrigatório (cpf_titular)')
+    try:
+        birth_date = _date(record, 'birth_date')
+    except ValueError as e:
+        errors.append(str(e))
+        birth_date = None
+    return only_digits(holder), {
+        'name': _text(record, 'full_name', 200),
+        'cpf': format_cpf(cpf) if cpf and valid_cpf(cpf) else None,
+        'birth_date': birth_date,
+        'relationship': _text(record, 'relationship', 50),
+        'is_ir_dependent': _flag(record, 'is_ir_dependent', True),
+        'is_sf_dependent': _flag(record, 'is_sf_dependent', True),
+    }
+
+
+# ==================== EVENTOS DO ESOCIAL ====================
+
+def admission_event_data(employee, dependents):
+    """Dados do evento de admissão (S-2200/S-2300) no leiaute simplificado usado na fila"""
+    return json.dumps({
+        'cpfTrab': only_digits(employee['cpf']),
+        'nmTrab': employee['full_name'],
+        'sexo': employee.get('gender'),
+        'dtNascto': employee['birth_date'].isoformat() if employee.get('birth_date') else None,
+        'nisTrab': only_digits(employee.get('pis_pasep')) or None,
+        'matricula': employee['employee_code'],
+        'dtAdm': employee['admission_date'].isoformat(),
+        'tpContr': employee['contract_type'],
+        'cargo': employee['position'],
+        'vrSalFx': employee['salary'],
+        'undSalFixo': {'monthly': 5, 'hourly': 1}.get(employee['salary_type'], 7),
+        'qtdHrsSem': employee['workload'],
+        'dependente': [{
+            'nmDep': dependent['name'],
+            'cpfDep': only_digits(dependent['cpf']) or None,
+            'dtNascto': dependent['birth_date'].isoformat() if dependent['birth_date'] else None,
+            'parentesco': dependent['relationship'],
+            'depIRRF': 'S' if dependent['is_ir_dependent'] else 'N',
+            'depSF': 'S' if dependent['is_sf_dependent'] else 'N',
+        } for dependent in dependents],
+    }, ensure_ascii=False)
+
+
+# ==================== IMPORTAÇÃO ====================
+
+def import_employees(stream, filename='', created_by=None, dry_run=False):
+    """Valida e grava colaboradores e dependentes do arquivo em lote. Não faz commit.
+
+    Linhas com erro são ignoradas e listadas em errors ({'line', 'reason'});
+    dependentes de um titular com erro também. Com dry_run nada é gravado.
+    Levanta ValueError se o arquivo não puder ser lido ou exceder MAX_ROWS.
+    """
+    cpfs, codes, departments = _load_references()
+    employees, dependents, errors = {}, [], []
+    rows_read = 0
+
+    for number, record in iter_records(stream, filename):
+        rows_read += 1
+        if rows_read > MAX_ROWS:
+            raise ValueError(f'Arquivo excede o limite de {MAX_ROWS} linhas')
+        row_errors = []
+        if (_text(record, 'record_type') or '').lower() in DEPENDENT_RECORD_TYPES:
+            holder, row = _dependent_row(record, row_errors)
+            if not row_errors:
+                dependents.append((number, holder, row))
+        else:
+            row = _employee_row(record, cpfs, codes, departments, row_errors)
+            if not row_errors:
+                # O próprio arquivo também não pode repetir CPF ou matrícula
+                cpfs.add(only_digits(row['cpf']))
+                if row['employee_code']:
+                    codes.add(row['employee_code'].upper())
+                employees[only_digits(row['cpf'])] = (number, row, [])
+        if row_errors:
+            errors.append({'line': number, 'reason': '; '.join(row_errors)})
+
+    for number, holder, row in dependents:
+        if holder in employees:
+            employees[holder][2].append(row)
+        else:
+            errors.append({'line': number, 'reason': 'Titular não encontrado entre os colaboradores válidos do arquivo'})
+
+    summary = {
+        'rows': rows_read,
+        'employees': len(employees),
+        'dependents': sum(len(items) for _, _, items in employees.values()),
+        'errors': sorted(errors, key=lambda error: error['line']),
+        'esocial_events': 0,
+        'dry_run': dry_run,
+    }
+    if dry_run or not employees:
+        return summary
+
+    summary['esocial_events'] = _persist(list(employees.values()), codes, created_by)
+    return summary
+
+
+def _persist(valid, codes, created_by):
+    """Grava colaboradores, dependentes e eventos do eSocial; retorna o número de eventos"""
+    now = datetime.utcnow()
+    next_id = (db.session.execute(select(func.max(Employee.id))).scalar() or 0) + 1
+    for _, row, _ in valid:
+        if not row['employee_code']:
+            # Mesmo formato da criação individual, pulando matrículas já usadas
+            while f'EMP{next_id:04d}' in codes:
+                next_id += 1
+            row['employee_code'] = f'EMP{next_id:04d}'
+            codes.add(row['employee_code'])
+            next_id += 1
+        row.update(created_by=created_by, created_at=now, updated_at=now)
+
+    employee_ids = []
+    for start in range(0, len(valid), INSERT_BATCH_SIZE):
+        employee_ids += db.session.execute(
+            insert(Employee).returning(Employee.id, sort_by_parameter_order=True),
+            [row for _, row, _ in valid[start:start + INSERT_BATCH_SIZE]]
+        ).scalars().all()
+
+    dependent_rows, events = [], []
+    for employee_id, (_, row, items) in zip(employee_ids, valid):
+        dependent_rows += [dict(item, employee_id=employee_id, created_at=now) for item in items]
+        event_type = ESOCIAL_EVENTS.get(row['contract_type'])
+        if event_type:
+            events.append({
+                'employee_id': employee_id,
+                'event_type': event_type,
+                'event_data': admission_event_data(row, items),
+                'status': 'pending',
+                'created_at': now,
+            })
+    for model, rows in ((Dependent, dependent_rows), (ESocialEvent, events)):
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(insert(model), rows[start:start + INSERT_BATCH_SIZE])
+
+    # A inserção em lote não passa pelo after_flush: índice de busca e quadro de pessoal
+    index_entities(db.session.connection(), 'employee', [
+        SimpleNamespace(id=employee_id, **row) for employee_id, (_, row, _) in zip(employee_ids, valid)
+    ])
+    invalidate_snapshots(min(row['admission_date'] for _, row, _ in valid))
+    return len(events)
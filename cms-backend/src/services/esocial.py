@@ -0,0 +1,328 @@
+"""Envio assíncrono dos eventos do eSocial em lotes
+
+Os eventos pendentes são agrupados em lotes de até 50 (limite do envio ao
+governo). Os lotes são transmitidos em paralelo pelo transporte configurado e
+os protocolos são consultados com intervalo crescente até o retorno do
+processamento. Todas as alterações de status são gravadas em lote.
+
+O transporte é plugável: register_transport(nome, fábrica) e a configuração
+ESOCIAL_TRANSPORT escolhem a implementação (o padrão é o stub local);
+ESOCIAL_POLL_BACKOFF altera os intervalos de consulta.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, func, insert, select, update
+
+from src.models.user import db
+from src.models.hr_advanced import ESocialBatch, ESocialEvent
+
+BATCH_SIZE = 50
+SEND_WORKERS = 4
+MAX_SEND_ATTEMPTS = 3
+MAX_POLLS = 12
+POLL_BACKOFF = (2, 4, 8, 16, 30, 60)  # segundos entre consultas do mesmo protocolo
+MAX_DISPATCH_SECONDS = 1800
+
+_dispatch_lock = threading.Lock()
+
+
+# ==================== TRANSPORTES ====================
+
+class StubTransport:
+    """Transporte local: gera protocolos e recibos sem acessar o webservice
+
+    O processamento fica pronto após processing_polls consultas. Eventos com
+    event_data que não é JSON válido são rejeitados. Os protocolos ficam no
+    processo, então um novo despacho continua consultando os já enviados.
+    """
+    _polls = defaultdict(int)
+    _batches = {}
+    _lock = threading.Lock()
+
+    def __init__(self, processing_polls=1, latency=0):
+        self.processing_polls = processing_polls
+        self.latency = latency
+
+    def send_batch(self, events):
+        """events: [(id, tipo, json)]; retorna o número do protocolo"""
+        time.sleep(self.latency)
+        protocol = f'1.{uuid.uuid4().hex[:18]}'
+        with self._lock:
+            self._batches[protocol] = list(events)
+        return protocol
+
+    def query_batch(self, protocol):
+        """Retorna None enquanto o lote está em processamento, senão o resultado de cada evento"""
+        time.sleep(self.latency)
+        with self._lock:
+            self._polls[protocol] += 1
+            if self._polls[protocol] < self.processing_polls:
+                return None
+            events = self._batches.pop(protocol, [])
+
+        results = []
+        for event_id, event_type, event_data in events:
+            try:
+                json.loads(event_data)
+            except (TypeError, ValueError):
+                results.append({'id': event_id, 'status': 'rejected', 'error_message': 'Leiaute do evento inválido'})
+                continue
+            results.append({'id': event_id, 'status': 'accepted', 'receipt_number': f'1.1.{event_id:019d}'})
+        return results
+
+
+TRANSPORTS = {'stub': lambda app: StubTransport(**app.config.get('ESOCIAL_STUB_OPTIONS', {}))}
+
+
+def register_transport(name, factory):
+    """Registra um transporte; factory(app) devolve um objeto com send_batch e query_batch"""
+    TRANSPORTS[name] = factory
+
+
+def get_transport(app=None):
+    app = app or current_app
+    return TRANSPORTS[app.config.get('ESOCIAL_TRANSPORT', 'stub')](app)
+
+
+# ==================== LOTES ====================
+
+def create_batches(batch_size=BATCH_SIZE):
+    """Agrupa os eventos pendentes ainda sem lote. Não faz commit."""
+    event_ids = db.session.execute(
+        select(ESocialEvent.id)
+        .where(ESocialEvent.status == 'pending', ESocialEvent.batch_id.is_(None))
+        .order_by(ESocialEvent.id)
+    ).scalars().all()
+    if not event_ids:
+        return 0
+
+    groups = [event_ids[start:start + batch_size] for start in range(0, len(event_ids), batch_size)]
+    now = datetime.utcnow()
+    batch_ids = db.session.execute(
+        insert(ESocialBatch).returning(ESocialBatch.id, sort_by_parameter_order=True),
+        [{'event_count': len(group), 'status': 'pending', 'next_attempt_at': now, 'created_at': now} for group in groups]
+    ).scalars().all()
+
+    table = ESocialEvent.__table__
+    db.session.execute(
+        table.update().where(table.c.id == bindparam('b_id')).values(batch_id=bindparam('b_batch')),
+        [{'b_id': event_id, 'b_batch': batch_id} for batch_id, group in zip(batch_ids, groups) for event_id in group]
+    )
+    return len(groups)
+
+
+def _backoff(count, backoff):
+    return timedelta(seconds=backoff[min(count, len(backoff) - 1)])
+
+
+def _call(func, argument):
+    try:
+        return func(argument), None
+    except Exception as e:
+        return None, str(e)
+
+
+def send_batches(transport, executor, backoff=POLL_BACKOFF, now=None):
+    """Transmite em paralelo os lotes pendentes cujo horário de envio chegou. Não faz commit.
+
+    Um lote que falha na transmissão MAX_SEND_ATTEMPTS vezes é marcado como
+    falho e seus eventos voltam a pendentes, sem lote; rejected fica reservado
+    aos eventos recusados no retorno do processamento.
+    """
+    now = now or datetime.utcnow()
+    batches = db.session.execute(
+        select(ESocialBatch.id, ESocialBatch.send_attempts)
+        .where(ESocialBatch.status == 'pending', ESocialBatch.next_attempt_at <= now)
+        .order_by(ESocialBatch.id)
+    ).all()
+    if not batches:
+        return 0
+
+    payloads = defaultdict(list)
+    for row in db.session.execute(
+        select(ESocialEvent.batch_id, ESocialEvent.id, ESocialEvent.event_type, ESocialEvent.event_data)
+        .where(ESocialEvent.batch_id.in_([batch.id for batch in batches]))
+        .order_by(ESocialEvent.id)
+    ):
+        payloads[row[0]].append(tuple(row[1:]))
+
+    results = executor.map(lambda batch: _call(transport.send_batch, payloads[batch.id]), batches)
+
+    sent, retries = [], []
+    for batch, (protocol, error) in zip(batches, results):
+        attempts = (batch.send_attempts or 0) + 1
+        if error is None:
+            sent.append({'b_id': batch.id, 'b_protocol': protocol, 'b_attempts': attempts,
+                         'b_next': now + _backoff(0, backoff)})
+        else:
+            retries.append({'b_id': batch.id, 'b_attempts': attempts, 'b_error': error,
+                            'b_status': 'failed' if attempts >= MAX_SEND_ATTEMPTS else 'pending',
+                            'b_next': now + _backoff(attempts, backoff)})
+
+    batch_table = ESocialBatch.__table__
+    event_table = ESocialEvent.__table__
+    if sent:
+        db.session.execute(
+            batch_table.update().where(batch_table.c.id == bindparam('b_id')).values(
+                status='sent', protocol_number=bindparam('b_protocol'), send_attempts=bindparam('b_attempts'),
+                next_attempt_at=bindparam('b_next'), sent_at=now, error_message=None
+            ),
+            sent
+        )
+        db.session.execute(
+            event_table.update().where(event_table.c.batch_id == bindparam('b_id')).values(
+                status='sent', protocol_number=bindparam('b_protocol'), sent_at=now
+            ),
+            [{'b_id': item['b_id'], 'b_protocol': item['b_protocol']} for item in sent]
+        )
+    if retries:
+        db.session.execute(
+            batch_table.update().where(batch_table.c.id == bindparam('b_id')).values(
+                status=bindparam('b_status'), send_attempts=bindparam('b_attempts'),
+                next_attempt_at=bindparam('b_next'), error_message=bindparam('b_error')
+            ),
+            retries
+        )
+        if any(item['b_status'] == 'failed' for item in retries):
+            requeue_failed_events()
+    return len(batches)
+
+
+def poll_receipts(transport, executor, backoff=POLL_BACKOFF, now=None):
+    """Consulta em paralelo os protocolos cujo horário chegou e grava os retornos. Não faz commit.
+
+    Um lote sem retorno após MAX_POLLS consultas é marcado como falho e seus
+    eventos voltam a pendentes, sem lote, para serem reenviados num novo lote.
+    """
+    now = now or datetime.utcnow()
+    batches = db.session.execute(
+        select(ESocialBatch.id, ESocialBatch.protocol_number, ESocialBatch.poll_count)
+        .where(ESocialBatch.status == 'sent', ESocialBatch.next_attempt_at <= now)
+        .order_by(ESocialBatch.id)
+    ).all()
+    if not batches:
+        return 0
+
+    results = executor.map(lambda batch: _call(transport.query_batch, batch.protocol_number), batches)
+
+    processed, waiting, events = [], [], []
+    for batch, (result, error) in zip(batches, results):
+        polls = (batch.poll_count or 0) + 1
+        if result is not None:
+            processed.append({'b_id': batch.id, 'b_polls': polls, 'b_status': 'processed', 'b_error': None})
+            events.extend({
+                'b_id': item['id'],
+                'b_status': item['status'],
+                'b_receipt': item.get('receipt_number'),
+                'b_error': item.get('error_message'),
+            } for item in result)
+        elif polls >= MAX_POLLS:
+            processed.append({'b_id': batch.id, 'b_polls': polls, 'b_status': 'failed',
+                              'b_error': error or 'Protocolo sem retorno após o limite de consultas'})
+        else:
+            waiting.append({'b_id': batch.id, 'b_polls': polls, 'b_next': now + _backoff(polls, backoff),
+                            'b_error': error})
+
+    batch_table = ESocialBatch.__table__
+    if processed:
+        db.session.execute(
+            batch_table.update().where(batch_table.c.id == bindparam('b_id')).values(
+                status=bindparam('b_status'), poll_count=bindparam('b_polls'),
+                error_message=bindparam('b_error'), processed_at=now, next_attempt_at=None
+            ),
+            processed
+        )
+    if waiting:
+        db.session.execute(
+            batch_table.update().where(batch_table.c.id == bindparam('b_id')).values(
+                poll_count=bindparam('b_polls'), next_attempt_at=bindparam('b_next'),
+                error_message=bindparam('b_error')
+            ),
+            waiting
+        )
+    if any(item['b_status'] == 'failed' for item in processed):
+        requeue_failed_events()
+    if events:
+        event_table = ESocialEvent.__table__
+        db.session.execute(
+            event_table.update().where(event_table.c.id == bindparam('b_id')).values(
+                status=bindparam('b_status'), receipt_number=bindparam('b_receipt'),
+                error_message=bindparam('b_error'), processed_at=now
+            ),
+            events
+        )
+    return len(batches)
+
+
+def requeue_failed_events():
+    """Devolve a pendentes (sem lote) os eventos de lotes que falharam no envio ou na consulta. Não faz commit."""
+    batch_error = select(ESocialBatch.error_message).where(ESocialBatch.id == ESocialEvent.batch_id).scalar_subquery()
+    return db.session.execute(
+        update(ESocialEvent)
+        .where(
+            ESocialEvent.status.in_(('pending', 'sent')),
+            ESocialEvent.batch_id.in_(select(ESocialBatch.id).where(ESocialBatch.status == 'failed'))
+        )
+        .values(status='pending', batch_id=None, error_message=batch_error)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _next_attempt():
+    unbatched = db.session.execute(
+        select(ESocialEvent.id).where(ESocialEvent.status == 'pending', ESocialEvent.batch_id.is_(None)).limit(1)
+    ).first()
+    if unbatched is not None:
+        return datetime.utcnow()
+    return db.session.execute(
+        select(func.min(ESocialBatch.next_attempt_at)).where(ESocialBatch.status.in_(('pending', 'sent')))
+    ).scalar()
+
+
+def dispatch(transport=None, backoff=None, max_seconds=MAX_DISPATCH_SECONDS):
+    """Agrupa, envia e acompanha os lotes até não haver pendências (ou até max_seconds)
+
+    Cada etapa é confirmada em sua própria transação. Apenas um despacho roda
+    por vez no processo; uma segunda chamada retorna None imediatamente.
+    """
+    if not _dispatch_lock.acquire(blocking=False):
+        return None
+    summary = {'batches_created': 0, 'sends': 0, 'polls': 0}
+    try:
+        transport = transport or get_transport()
+        backoff = backoff or tuple(current_app.config.get('ESOCIAL_POLL_BACKOFF', POLL_BACKOFF))
+        deadline = time.monotonic() + max_seconds
+        requeue_failed_events()
+        with ThreadPoolExecutor(max_workers=SEND_WORKERS, thread_name_prefix='esocial') as executor:
+            while time.monotonic() < deadline:
+                summary['batches_created'] += create_batches()
+                db.session.commit()
+                summary['sends'] += send_batches(transport, executor, backoff)
+                db.session.commit()
+                summary['polls'] += poll_receipts(transport, executor, backoff)
+                db.session.commit()
+
+                next_attempt = _next_attempt()
+                if next_attempt is None:
+                    break
+                wait = (next_attempt - datetime.utcnow()).total_seconds()
+                if wait > 0:
+                    time.sleep(min(wait, max(deadline - time.monotonic(), 0)))
+        return summary
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        _dispatch_lock.release()
+        db.session.remove()
+
+
+def is_dispatching():
+    return _dispatch_lock.locked()
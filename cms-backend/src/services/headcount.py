@@ -0,0 +1,215 @@
+"""Quadro de pessoal e turnover mensal por departamento
+
+O quadro de abertura do primeiro mês é contado com predicados de intervalo
+sobre as datas de admissão e desligamento (índices ix_employees_*); admissões e
+desligamentos do intervalo vêm de duas agregações e os meses seguintes são
+calculados em memória. Meses encerrados ficam gravados em headcount_snapshots e
+só são recalculados quando uma admissão ou desligamento retroativo os altera.
+Transferências entre departamentos não reescrevem as fotografias já gravadas.
+"""
+from datetime import date
+
+from sqlalchemy import delete, event, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from src.models.user import db
+from src.models.hr_advanced import Employee, HeadcountSnapshot
+
+MAX_MONTHS = 240
+SNAPSHOT_FIELDS = ('opening_headcount', 'admissions', 'dismissals', 'closing_headcount')
+
+
+def month_index(year, month):
+    return year * 12 + month - 1
+
+
+def month_start(index):
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _moves(column, start, end):
+    year = func.extract('year', column)
+    month = func.extract('month', column)
+    rows = db.session.execute(
+        select(Employee.department_id, year, month, func.count(Employee.id))
+        .where(column >= start, column < end)
+        .group_by(Employee.department_id, year, month)
+    )
+    return {(department_id, month_index(int(y), int(m))): count for department_id, y, m, count in rows}
+
+
+def _compute(first, last):
+    """Linhas {(departamento, mês): (abertura, admissões, desligamentos, fechamento)} do intervalo"""
+    start, end = month_start(first), month_start(last + 1)
+    opening = dict(db.session.execute(
+        select(Employee.department_id, func.count(Employee.id))
+        .where(
+            Employee.admission_date < start,
+            or_(Employee.dismissal_date.is_(None), Employee.dismissal_date >= start)
+        )
+        .group_by(Employee.department_id)
+    ).all())
+    admissions = _moves(Employee.admission_date, start, end)
+    dismissals = _moves(Employee.dismissal_date, start, end)
+
+    departments = set(opening) | {key[0] for key in admissions} | {key[0] for key in dismissals}
+    rows = {}
+    for department_id in departments:
+        current = opening.get(department_id, 0)
+        for index in range(first, last + 1):
+            admitted = admissions.get((department_id, index), 0)
+            dismissed = dismissals.get((department_id, index), 0)
+            closing = current + admitted - dismissed
+            rows[(department_id, index)] = (current, admitted, dismissed, closing)
+            current = closing
+    return rows
+
+
+def _load_snapshots(first, last):
+    index = HeadcountSnapshot.year * 12 + HeadcountSnapshot.month - 1
+    rows = db.session.execute(
+        select(HeadcountSnapshot.department_id, HeadcountSnapshot.year, HeadcountSnapshot.month,
+               *[getattr(HeadcountSnapshot, field) for field in SNAPSHOT_FIELDS])
+        .where(index >= first, index <= last)
+    )
+    return {(row[0], month_index(row[1], row[2])): tuple(row[3:]) for row in rows}
+
+
+def _store_snapshots(rows, months):
+    """Grava as fotografias dos meses; mês sem ninguém recebe uma linha zerada"""
+    values = []
+    for index in months:
+        month_rows = [(key[0], data) for key, data in rows.items() if key[1] == index]
+        for department_id, data in month_rows or [(None, (0, 0, 0, 0))]:
+            year, month = divmod(index, 12)
+            values.append(dict(zip(SNAPSHOT_FIELDS, data), year=year, month=month + 1, department_id=department_id))
+    if values:
+        db.session.execute(insert(HeadcountSnapshot), values)
+
+
+def monthly_rows(first, last, today=None):
+    """Linhas por departamento e mês; meses encerrados vêm das fotografias quando existirem. Não faz commit."""
+    today = today or date.today()
+    closed_last = min(last, month_index(today.year, today.month) - 1)
+
+    rows = _load_snapshots(first, closed_last) if closed_last >= first else {}
+    covered = {index for _, index in rows}
+    missing = [index for index in range(first, closed_last + 1) if index not in covered]
+    compute_from = missing[0] if missing else max(closed_last + 1, first)
+
+    if compute_from <= last:
+        computed = _compute(compute_from, last)
+        rows = {key: data for key, data in rows.items() if key[1] < compute_from}
+        rows.update(computed)
+        _store_snapshots(computed, missing)
+    return rows, len(missing)
+
+
+def turnover_rate(admissions, dismissals, average_headcount):
+    """Taxa de rotatividade: média de admissões e desligamentos sobre o quadro médio (%)"""
+    if not average_headcount:
+        return 0.0
+    return round((admissions + dismissals) / 2 / average_headcount * 100, 2)
+
+
+def _month_totals(rows, department_id=None):
+    """{mês: [abertura, admissões, desligamentos, fechamento]} somados numa única passada pelas linhas"""
+    totals = {}
+    for (row_department, index), data in rows.items():
+        if department_id is None or row_department == department_id:
+            current = totals.setdefault(index, [0, 0, 0, 0])
+            for position, value in enumerate(data):
+                current[position] += value
+    return totals
+
+
+def _series(month_totals, first, last):
+    """Série mensal e totais do intervalo a partir de {mês: (abertura, admissões, desligamentos, fechamento)}"""
+    empty = (0, 0, 0, 0)
+    months = []
+    for index in range(first, last + 1):
+        opening, admitted, dismissed, closing = month_totals.get(index, empty)
+        months.append({
+            'year': index // 12,
+            'month': index % 12 + 1,
+            'opening_headcount': opening,
+            'admissions': admitted,
+            'dismissals': dismissed,
+            'closing_headcount': closing,
+            'turnover_rate': turnover_rate(admitted, dismissed, (opening + closing) / 2),
+        })
+
+    admitted = sum(month['admissions'] for month in months)
+    dismissed = sum(month['dismissals'] for month in months)
+    average = sum((month['opening_headcount'] + month['closing_headcount']) / 2 for month in months) / len(months)
+    return {
+        'months': months,
+        'totals': {
+            'opening_headcount': months[0]['opening_headcount'],
+            'closing_headcount': months[-1]['closing_headcount'],
+            'admissions': admitted,
+            'dismissals': dismissed,
+            'average_headcount': round(average, 2),
+            'turnover_rate': turnover_rate(admitted, dismissed, average),
+        },
+    }
+
+
+def headcount_report(start_year, start_month, end_year, end_month, department_id=None, by_department=False):
+    """Série mensal de quadro e turnover (geral ou de um departamento), opcionalmente por departamento"""
+    first, last = month_index(start_year, start_month), month_index(end_year, end_month)
+    if last < first:
+        raise ValueError('Período final anterior ao inicial')
+    if last - first + 1 > MAX_MONTHS:
+        raise ValueError(f'Intervalo máximo de {MAX_MONTHS} meses')
+
+    rows, computed_months = monthly_rows(first, last)
+    report = _series(_month_totals(rows, department_id), first, last)
+    report['snapshots_created'] = computed_months
+    if by_department:
+        departments = {}
+        for (row_department, index), data in rows.items():
+            departments.setdefault(row_department, {})[index] = data
+        report['by_department'] = [
+            {'department_id': department, **_series(departments[department], first, last)}
+            for department in sorted(
+                (key for key, months in departments.items() if any(any(data) for data in months.values())),
+                key=lambda value: (value is None, value)
+            )
+        ]
+    return report
+
+
+# ==================== INVALIDAÇÃO DAS FOTOGRAFIAS ====================
+
+def _affected_month(session):
+    dates = []
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Employee):
+            dates += [obj.admission_date, obj.dismissal_date]
+    for obj in session.dirty:
+        if isinstance(obj, Employee):
+            for field in ('admission_date', 'dismissal_date'):
+                history = db.inspect(obj).attrs[field].history
+                if history.has_changes():
+                    dates += list(history.added) + list(history.deleted)
+    dates = [value for value in dates if isinstance(value, date)]
+    return min(dates) if dates else None
+
+
+def invalidate_snapshots(from_date):
+    """Descarta as fotografias a partir do mês informado (admissões/desligamentos retroativos)"""
+    db.session.execute(delete(HeadcountSnapshot).where(
+        HeadcountSnapshot.year * 12 + HeadcountSnapshot.month - 1 >= month_index(from_date.year, from_date.month)
+    ))
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_on_flush(session, flush_context):
+    affected = _affected_month(session)
+    if affected is None:
+        return
+    table = HeadcountSnapshot.__table__
+    session.connection().execute(delete(table).where(
+        table.c.year * 12 + table.c.month - 1 >= month_index(affected.year, affected.month)
+    ))
@@ -0,0 +1,254 @@
+"""Indicadores anuais de treinamentos e avaliações de desempenho por departamento
+
+Cada indicador sai de uma agregação agrupada por departamento e mês (e
+categoria, no caso dos treinamentos); as matrizes por mês, trimestre e
+categoria e os totais são montados em memória a partir dessas somas. O
+resultado do ano fica em cache até a próxima gravação de treinamentos,
+avaliações, colaboradores ou departamentos (confirmada via ORM ou inserção em
+lote na sessão) ou até expirar o TTL do cache.
+
+Um treinamento entra no mês de conclusão ou, se ainda não concluído, no mês
+de início; uma avaliação entra no mês de fim do período avaliado.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import case, func, select
+
+from src.models.user import db
+from src.models.departments import Department
+from src.models.hr_advanced import Employee, EmployeeTraining, PerformanceEvaluation, Training
+from src.services.write_cache import WriteCache
+
+CRITERIA = ('productivity', 'quality', 'teamwork', 'communication', 'leadership', 'innovation', 'punctuality')
+EVALUATED_STATUSES = ('completed', 'approved')
+NO_CATEGORY = 'Sem categoria'
+
+_cache = WriteCache((Employee, EmployeeTraining, PerformanceEvaluation, Training, Department))
+
+
+def invalidate_analytics():
+    _cache.invalidate()
+
+
+def _ratio(part, whole, scale=1):
+    return round(part / whole * scale, 2) if whole else None
+
+
+# ==================== TREINAMENTOS ====================
+
+def _training_rows(year):
+    """(departamento, mês, categoria, inscrições, concluídos, reprovados, soma e qtd. de notas, horas)"""
+    reference = func.coalesce(EmployeeTraining.completion_date, EmployeeTraining.start_date)
+    completed = EmployeeTraining.status == 'completed'
+    return db.session.execute(
+        select(
+            Employee.department_id,
+            func.extract('month', reference),
+            Training.category,
+            func.count(EmployeeTraining.id),
+            func.sum(case((completed, 1), else_=0)),
+            func.sum(case((EmployeeTraining.status == 'failed', 1), else_=0)),
+            func.sum(case((completed, EmployeeTraining.score), else_=None)),
+            func.count(case((completed, EmployeeTraining.score), else_=None)),
+            func.sum(case((completed, Training.duration_hours), else_=0)),
+        )
+        .join(Employee, Employee.id == EmployeeTraining.employee_id)
+        .join(Training, Training.id == EmployeeTraining.training_id)
+        .where(reference >= date(year, 1, 1), reference <= date(year, 12, 31))
+        .group_by(Employee.department_id, func.extract('month', reference), Training.category)
+    ).all()
+
+
+def _new_training_totals():
+    return {'enrollments': 0, 'completed': 0, 'failed': 0, 'score_sum': 0.0, 'score_count': 0, 'hours': 0}
+
+
+def _training_cell(totals):
+    return {
+        'enrollments': totals['enrollments'],
+        'completed': totals['completed'],
+        'failed': totals['failed'],
+        'completion_rate': _ratio(totals['completed'], totals['enrollments'], 100),
+        'average_score': _ratio(totals['score_sum'], totals['score_count']),
+        'training_hours': totals['hours'],
+    }
+
+
+def _add_training(totals, row):
+    enrollments, completed, failed, score_sum, score_count, hours = row
+    totals['enrollments'] += enrollments
+    totals['completed'] += int(completed or 0)
+    totals['failed'] += int(failed or 0)
+    totals['score_sum'] += float(score_sum or 0)
+    totals['score_count'] += score_count
+    totals['hours'] += int(hours or 0)
+
+
+def training_rollup(year):
+    """Matrizes departamento x mês e departamento x categoria, com totais por departamento"""
+    by_month, by_category, by_department = {}, {}, {}
+    categories = set()
+    trained = dict(db.session.execute(
+        select(Employee.department_id, func.count(func.distinct(EmployeeTraining.employee_id)))
+        .join(Employee, Employee.id == EmployeeTraining.employee_id)
+        .where(
+            EmployeeTraining.status == 'completed',
+            EmployeeTraining.completion_date >= date(year, 1, 1),
+            EmployeeTraining.completion_date <= date(year, 12, 31)
+        )
+        .group_by(Employee.department_id)
+    ).all())
+
+    for department_id, month, category, *values in _training_rows(year):
+        category = category or NO_CATEGORY
+        categories.add(category)
+        for matrix, key in ((by_month, int(month)), (by_category, category)):
+            cells = matrix.setdefault(department_id, {})
+            _add_training(cells.setdefault(key, _new_training_totals()), values)
+        _add_training(by_department.setdefault(department_id, _new_training_totals()), values)
+
+    return {
+        'categories': sorted(categories),
+        'by_month': by_month,
+        'by_category': by_category,
+        'by_department': by_department,
+        'trained_employees': trained,
+    }
+
+
+# ==================== AVALIAÇÕES ====================
+
+def evaluation_rollup(year):
+    """Somas das avaliações concluídas por departamento e mês de fim do período avaliado"""
+    scored = [PerformanceEvaluation.overall_score] + [getattr(PerformanceEvaluation, field) for field in CRITERIA]
+    rows = db.session.execute(
+        select(
+            Employee.department_id,
+            func.extract('month', PerformanceEvaluation.period_end),
+            func.count(PerformanceEvaluation.id),
+            *[expression for column in scored for expression in (func.sum(column), func.count(column))]
+        )
+        .join(Employee, Employee.id == PerformanceEvaluation.employee_id)
+        .where(
+            PerformanceEvaluation.status.in_(EVALUATED_STATUSES),
+            PerformanceEvaluation.period_end >= date(year, 1, 1),
+            PerformanceEvaluation.period_end <= date(year, 12, 31)
+        )
+        .group_by(Employee.department_id, func.extract('month', PerformanceEvaluation.period_end))
+    ).all()
+
+    fields = ('overall_score',) + CRITERIA
+    by_quarter, by_department = {}, {}
+    for department_id, month, count, *sums in rows:
+        quarter = (int(month) - 1) // 3 + 1
+        for totals in (by_quarter.setdefault(department_id, {}).setdefault(quarter, {}),
+                       by_department.setdefault(department_id, {})):
+            totals['evaluations'] = totals.get('evaluations', 0) + count
+            for index, field in enumerate(fields):
+                value_sum, value_count = totals.get(field, (0.0, 0))
+                totals[field] = (value_sum + float(sums[2 * index] or 0), value_count + sums[2 * index + 1])
+    return {'by_quarter': by_quarter, 'by_department': by_department}
+
+
+def _evaluation_cell(totals):
+    cell = {'evaluations': totals.get('evaluations', 0)}
+    for field in ('overall_score',) + CRITERIA:
+        cell[f'average_{field}'] = _ratio(*totals.get(field, (0.0, 0)))
+    return cell
+
+
+# ==================== MATRIZES ====================
+
+def _build(year):
+    trainings = training_rollup(year)
+    evaluations = evaluation_rollup(year)
+    headcount = dict(db.session.execute(
+        select(Employee.department_id, func.count(Employee.id))
+        .where(Employee.status == 'active')
+        .group_by(Employee.department_id)
+    ).all())
+    names = dict(db.session.execute(select(Department.id, Department.name)).all())
+
+    department_ids = (set(trainings['by_department']) | set(evaluations['by_department'])) - {None}
+    ordered = sorted(department_ids, key=lambda value: (names.get(value) or '', value))
+    if None in trainings['by_department'] or None in evaluations['by_department']:
+        ordered.append(None)
+
+    months = list(range(1, 13))
+    quarters = [1, 2, 3, 4]
+    empty_training = _training_cell(_new_training_totals())
+    empty_evaluation = _evaluation_cell({})
+
+    departments = []
+    for department_id in ordered:
+        training_totals = trainings['by_department'].get(department_id, _new_training_totals())
+        month_cells = trainings['by_month'].get(department_id, {})
+        category_cells = trainings['by_category'].get(department_id, {})
+        quarter_cells = evaluations['by_quarter'].get(department_id, {})
+        departments.append({
+            'department_id': department_id,
+            'department': names.get(department_id),
+            'headcount': headcount.get(department_id, 0),
+            'trained_employees': trainings['trained_employees'].get(department_id, 0),
+            'training_coverage': _ratio(trainings['trained_employees'].get(department_id, 0),
+                                        headcount.get(department_id, 0), 100),
+            'trainings': _training_cell(training_totals),
+            'trainings_by_month': [
+                _training_cell(month_cells[month]) if month in month_cells else empty_training for month in months
+            ],
+            'trainings_by_category': [
+                _training_cell(category_cells[category]) if category in category_cells else empty_training
+                for category in trainings['categories']
+            ],
+            'evaluations': _evaluation_cell(evaluations['by_department'].get(department_id, {})),
+            'evaluations_by_quarter': [
+                _evaluation_cell(quarter_cells[quarter]) if quarter in quarter_cells else empty_evaluation
+                for quarter in quarters
+            ],
+        })
+
+    company_trainings = _new_training_totals()
+    for totals in trainings['by_department'].values():
+        for key, value in totals.items():
+            company_trainings[key] += value
+    company_evaluations = {}
+    for totals in evaluations['by_department'].values():
+        for key, value in totals.items():
+            if key == 'evaluations':
+                company_evaluations[key] = company_evaluations.get(key, 0) + value
+            else:
+                current = company_evaluations.get(key, (0.0, 0))
+                company_evaluations[key] = (current[0] + value[0], current[1] + value[1])
+    trained = sum(trainings['trained_employees'].values())
+    active = sum(headcount.values())
+
+    return {
+        'year': year,
+        'months': months,
+        'quarters': quarters,
+        'categories': trainings['categories'],
+        'criteria': list(CRITERIA),
+        'departments': departments,
+        'totals': {
+            'headcount': active,
+            'trained_employees': trained,
+            'training_coverage': _ratio(trained, active, 100),
+            'trainings': _training_cell(company_trainings),
+            'evaluations': _evaluation_cell(company_evaluations),
+        },
+        'generated_at': datetime.utcnow().isoformat(),
+    }
+
+
+def yearly_analytics(year):
+    """Indicadores do ano, do cache quando ainda válidos; retorna (resultado, veio_do_cache)"""
+    cached = _cache.get(year)
+    if cached is not None:
+        return cached, True
+
+    # Só guarda se nenhuma gravação foi confirmada durante o cálculo
+    started = _cache.begin()
+    result = _build(year)
+    _cache.store(year, result, started)
+    return result, False
+
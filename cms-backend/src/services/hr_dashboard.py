@@ -0,0 +1,68 @@
+"""Estatísticas do dashboard de RH com cache em memória
+
+Os contadores saem de uma única agregação condicional por departamento e o
+total da folha de uma soma sobre o período do mês. O resultado fica em cache
+até o fim do dia ou até a próxima gravação de colaboradores ou da folha
+(confirmada via ORM ou inserção em lote na sessão).
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, func, select
+
+from src.models.user import db
+from src.models.hr_advanced import Employee, PayrollItem, PayrollPeriod
+from src.services.write_cache import WriteCache
+
+RECENT_ADMISSION_DAYS = 30
+
+_cache = WriteCache((Employee, PayrollItem, PayrollPeriod))
+
+
+def invalidate_dashboard():
+    _cache.invalidate()
+
+
+def _compute(today):
+    admission_cutoff = today - timedelta(days=RECENT_ADMISSION_DAYS)
+
+    # Ativos, aniversariantes e admissões recentes por departamento em uma única leitura
+    departments = db.session.execute(
+        select(
+            Employee.department_id,
+            func.count(Employee.id),
+            func.sum(case((func.extract('month', Employee.birth_date) == today.month, 1), else_=0)),
+            func.sum(case((Employee.admission_date >= admission_cutoff, 1), else_=0)),
+        ).where(Employee.status == 'active').group_by(Employee.department_id)
+    ).all()
+
+    payroll_total = db.session.execute(
+        select(func.coalesce(func.sum(PayrollItem.net_salary), 0))
+        .join(PayrollPeriod, PayrollPeriod.id == PayrollItem.period_id)
+        .where(PayrollPeriod.year == today.year, PayrollPeriod.month == today.month)
+    ).scalar()
+
+    return {
+        'total_employees': sum(row[1] for row in departments),
+        'total_departments': sum(1 for row in departments if row[0] is not None),
+        'birthdays_this_month': sum(int(row[2] or 0) for row in departments),
+        'recent_admissions': sum(int(row[3] or 0) for row in departments),
+        'payroll_total': round(float(payroll_total or 0), 2),
+        'employees_by_department': [
+            {'department_id': row[0], 'count': row[1]} for row in departments
+        ],
+        'generated_at': datetime.utcnow().isoformat(),
+    }
+
+
+def dashboard_stats():
+    """Estatísticas do dashboard, do cache quando ainda válidas"""
+    today = date.today()
+    cached = _cache.get(today)
+    if cached is not None:
+        return cached, True
+
+    started = _cache.begin()
+    stats = _compute(today)
+    _cache.store(today, stats, started, replace=True)
+    return stats, False
+
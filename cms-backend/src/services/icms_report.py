@@ -0,0 +1,248 @@
+"""Relatório de ICMS e DIFAL por UF de destino
+
+A agregação é feita no banco (GROUP BY UF, CFOP, CST e alíquota). Meses já
+encerrados ficam consolidados em icms_monthly_rollups, então o relatório do
+ano é a soma de poucas linhas por mês mais a consulta do mês corrente.
+"""
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import func, insert, or_
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+from src.models.accounting import Company
+from src.models.fiscal import (
+    TaxType, TaxRate, Customer, Invoice, InvoiceItem,
+    IcmsMonthlyRollup, IcmsMonthlyRollupLine
+)
+
+# CFOPs de venda interestadual a não contribuinte (sujeitas ao DIFAL, EC 87/2015)
+DIFAL_CFOPS = ('6107', '6108')
+
+# Alíquotas internas modais, usadas quando não há alíquota de ICMS cadastrada para a UF
+INTERNAL_ICMS_RATES = {
+    'AC': Decimal('19'), 'AL': Decimal('19'), 'AM': Decimal('20'), 'AP': Decimal('18'),
+    'BA': Decimal('20.5'), 'CE': Decimal('20'), 'DF': Decimal('20'), 'ES': Decimal('17'),
+    'GO': Decimal('19'), 'MA': Decimal('23'), 'MG': Decimal('18'), 'MS': Decimal('17'),
+    'MT': Decimal('17'), 'PA': Decimal('19'), 'PB': Decimal('20'), 'PE': Decimal('20.5'),
+    'PI': Decimal('22.5'), 'PR': Decimal('19.5'), 'RJ': Decimal('22'), 'RN': Decimal('20'),
+    'RO': Decimal('19.5'), 'RR': Decimal('20'), 'RS': Decimal('17'), 'SC': Decimal('17'),
+    'SE': Decimal('20'), 'SP': Decimal('18'), 'TO': Decimal('20'),
+}
+
+VALUE_FIELDS = ('item_count', 'operation_value', 'icms_base', 'icms_value')
+
+
+def _empty_totals():
+    totals = dict.fromkeys(VALUE_FIELDS + ('difal_value',), Decimal(0))
+    totals['item_count'] = 0
+    return totals
+
+
+def _month_start(year, month):
+    return date(year, month, 1)
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _aggregate(company_id, start, end):
+    """Soma os itens das notas emitidas em [start, end) por UF, CFOP, CST e alíquota"""
+    cst = func.coalesce(InvoiceItem.icms_origin, '0') + func.coalesce(InvoiceItem.icms_cst, '')
+    rows = db.session.query(
+        Customer.state,
+        InvoiceItem.cfop,
+        cst.label('cst'),
+        InvoiceItem.icms_rate,
+        func.count(InvoiceItem.id),
+        func.sum(InvoiceItem.total_value),
+        func.sum(InvoiceItem.icms_base),
+        func.sum(InvoiceItem.icms_value),
+    ).join(
+        Invoice, Invoice.id == InvoiceItem.invoice_id
+    ).join(
+        Customer, Customer.id == Invoice.customer_id
+    ).filter(
+        Invoice.company_id == company_id,
+        Invoice.status == 'issued',
+        Invoice.issue_date >= datetime.combine(start, datetime.min.time()),
+        Invoice.issue_date < datetime.combine(end, datetime.min.time()),
+    ).group_by(
+        Customer.state, InvoiceItem.cfop, cst, InvoiceItem.icms_rate
+    ).all()
+
+    return [
+        ((state, cfop, cst_code, Decimal(rate or 0)),
+         (count, Decimal(operation or 0), Decimal(base or 0), Decimal(icms or 0)))
+        for state, cfop, cst_code, rate, count, operation, base, icms in rows
+    ]
+
+
+def _store_rollup(company_id, year, month, rows):
+    # Savepoint: se outra requisição consolidou o mesmo mês ao mesmo tempo, mantém a dela
+    try:
+        with db.session.begin_nested():
+            _insert_rollup(company_id, year, month, rows)
+    except IntegrityError:
+        pass
+
+
+def _insert_rollup(company_id, year, month, rows):
+    rollup = IcmsMonthlyRollup(company_id=company_id, year=year, month=month)
+    db.session.add(rollup)
+    db.session.flush()
+    if rows:
+        db.session.execute(insert(IcmsMonthlyRollupLine), [{
+            'rollup_id': rollup.id,
+            'state': state,
+            'cfop': cfop,
+            'cst': cst,
+            'rate': rate,
+            'item_count': count,
+            'operation_value': operation,
+            'icms_base': base,
+            'icms_value': icms,
+        } for (state, cfop, cst, rate), (count, operation, base, icms) in rows])
+
+
+def _monthly_rows(company_id, year, month, today):
+    """Linhas do mês: do cache quando o mês já encerrou, senão agregadas na hora"""
+    start = _month_start(year, month)
+    end = _month_start(*_next_month(year, month))
+    if end > today:
+        return _aggregate(company_id, start, end), False
+
+    rollup = IcmsMonthlyRollup.query.filter_by(company_id=company_id, year=year, month=month).first()
+    if rollup is None:
+        rows = _aggregate(company_id, start, end)
+        _store_rollup(company_id, year, month, rows)
+        return rows, False
+
+    lines = db.session.query(
+        IcmsMonthlyRollupLine.state, IcmsMonthlyRollupLine.cfop, IcmsMonthlyRollupLine.cst,
+        IcmsMonthlyRollupLine.rate, IcmsMonthlyRollupLine.item_count,
+        IcmsMonthlyRollupLine.operation_value, IcmsMonthlyRollupLine.icms_base,
+        IcmsMonthlyRollupLine.icms_value
+    ).filter(IcmsMonthlyRollupLine.rollup_id == rollup.id).all()
+    return [
+        ((state, cfop, cst, Decimal(rate or 0)),
+         (count, Decimal(operation or 0), Decimal(base or 0), Decimal(icms or 0)))
+        for state, cfop, cst, rate, count, operation, base, icms in lines
+    ], True
+
+
+def invalidate_rollup(company_id, issue_date):
+    """Descarta a consolidação do mês da nota (chamado na emissão e no cancelamento)"""
+    if issue_date is None:
+        return 0
+    rollup_ids = db.session.query(IcmsMonthlyRollup.id).filter_by(
+        company_id=company_id, year=issue_date.year, month=issue_date.month
+    )
+    db.session.query(IcmsMonthlyRollupLine).filter(
+        IcmsMonthlyRollupLine.rollup_id.in_(rollup_ids.scalar_subquery())
+    ).delete(synchronize_session=False)
+    return db.session.query(IcmsMonthlyRollup).filter_by(
+        company_id=company_id, year=issue_date.year, month=issue_date.month
+    ).delete(synchronize_session=False)
+
+
+def internal_rates(reference_date):
+    """Alíquota interna de ICMS por UF vigente na data (cadastro com padrão modal)"""
+    rates = dict(INTERNAL_ICMS_RATES)
+    rows = db.session.query(TaxRate.state, TaxRate.rate).join(
+        TaxType, TaxType.id == TaxRate.tax_type_id
+    ).filter(
+        TaxType.code == 'ICMS',
+        TaxRate.is_active == True,
+        TaxRate.state.isnot(None),
+        TaxRate.start_date <= reference_date,
+        or_(TaxRate.end_date.is_(None), TaxRate.end_date >= reference_date)
+    ).order_by(TaxRate.start_date).all()
+    for state, rate in rows:
+        rates[state] = Decimal(rate)
+    return rates
+
+
+def icms_by_state(company_id, start_date, end_date):
+    """Totais de ICMS e DIFAL por UF de destino no período [start_date, end_date]
+
+    Meses inteiros no intervalo vêm da consolidação mensal; meses parciais nas
+    pontas são agregados diretamente das notas.
+    """
+    company = Company.query.get(company_id)
+    today = date.today()
+    end = date.fromordinal(end_date.toordinal() + 1)
+
+    merged = {}
+    cached_months = 0
+    computed_months = 0
+
+    def merge(rows):
+        for key, values in rows:
+            current = merged.get(key)
+            merged[key] = values if current is None else tuple(a + b for a, b in zip(current, values))
+
+    cursor = start_date
+    while cursor < end:
+        year, month = cursor.year, cursor.month
+        month_start = _month_start(year, month)
+        month_end = _month_start(*_next_month(year, month))
+        if cursor == month_start and month_end <= end:
+            rows, cached = _monthly_rows(company_id, year, month, today)
+            cached_months += int(cached)
+            computed_months += int(not cached)
+            merge(rows)
+        else:
+            merge(_aggregate(company_id, cursor, min(month_end, end)))
+        cursor = month_end
+    db.session.commit()
+
+    rates = internal_rates(end_date)
+    origin_state = company.state if company else None
+    states = OrderedDict()
+    totals = _empty_totals()
+
+    for (state, cfop, cst, rate), values in sorted(merged.items(), key=lambda item: tuple(str(k) for k in item[0])):
+        line = dict(zip(VALUE_FIELDS, values))
+        difal = Decimal(0)
+        internal_rate = rates.get(state)
+        if cfop in DIFAL_CFOPS and state != origin_state and internal_rate is not None and internal_rate > rate:
+            difal = (line['icms_base'] * (internal_rate - rate) / 100).quantize(Decimal('0.01'))
+        line['difal_value'] = difal
+
+        entry = states.setdefault(state, {
+            'state': state,
+            'interstate': state != origin_state,
+            'internal_rate': float(internal_rate) if internal_rate is not None else None,
+            'totals': _empty_totals(),
+            'lines': [],
+        })
+        for field, value in line.items():
+            entry['totals'][field] += value
+            totals[field] += value
+        entry['lines'].append({
+            'cfop': cfop,
+            'cst': cst,
+            'rate': float(rate),
+            **{field: _json_value(value) for field, value in line.items()},
+        })
+
+    for entry in states.values():
+        entry['totals'] = {field: _json_value(value) for field, value in entry['totals'].items()}
+
+    return {
+        'company_id': company_id,
+        'origin_state': origin_state,
+        'period': {'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()},
+        'states': list(states.values()),
+        'totals': {field: _json_value(value) for field, value in totals.items()},
+        'months_from_cache': cached_months,
+        'months_computed': computed_months,
+    }
+
+
+def _json_value(value):
+    return value if isinstance(value, int) else float(value)
@@ -0,0 +1,156 @@
+"""Gravação de lançamentos contábeis gerados pelo sistema (folha, provisões)
+
+Os lançamentos são montados em memória como dicionários simples, validados
+(débitos = créditos) e gravados com dois INSERTs em lote: um para os
+cabeçalhos (com RETURNING dos ids) e outro para todas as linhas. A referência
+identifica a origem, o que permite substituir os rascunhos numa nova geração.
+"""
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import delete, func, insert, select
+
+from src.models.user import db
+from src.models.accounting import Account, Company, CostCenter, JournalEntry, JournalEntryLine
+from src.models.departments import Department
+
+CENT = Decimal('0.01')
+
+
+def money(value):
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def load_accounts(company_id, codes):
+    """{código: id} das contas analíticas ativas; levanta ValueError se faltar alguma"""
+    found = dict(db.session.execute(
+        select(Account.code, Account.id).where(
+            Account.company_id == company_id,
+            Account.code.in_(set(codes)),
+            Account.is_active.is_(True)
+        )
+    ).all())
+    missing = sorted(set(codes) - set(found))
+    if missing:
+        raise ValueError(f"Contas contábeis não cadastradas: {', '.join(missing)}")
+    return found
+
+
+def seed_accounts(names):
+    """Cria nas empresas ativas as contas padrão que faltam no plano; names: {código: nome}
+
+    Tipo, nível e conta-mãe seguem a primeira conta irmã já cadastrada (mesmo
+    código sem o último segmento); sem conta irmã, a conta não é criada. Faz
+    commit e retorna o número de contas criadas.
+    """
+    existing = set(db.session.execute(
+        select(Account.company_id, Account.code).where(Account.code.in_(list(names)))
+    ).all())
+    siblings = {}
+    for prefix in {code.rsplit('.', 1)[0] for code in names}:
+        for company_id, account_type_id, level, parent_id in db.session.execute(
+            select(Account.company_id, Account.account_type_id, Account.level, Account.parent_id)
+            .where(Account.code.like(f'{prefix}.%'), Account.code.notin_(list(names)))
+            .order_by(Account.company_id, Account.code)
+        ):
+            siblings.setdefault((company_id, prefix), (account_type_id, level, parent_id))
+
+    rows = []
+    for company_id in db.session.execute(select(Company.id).where(Company.is_active.is_(True))).scalars():
+        for code, name in sorted(names.items()):
+            sibling = siblings.get((company_id, code.rsplit('.', 1)[0]))
+            if (company_id, code) in existing or sibling is None:
+                continue
+            account_type_id, level, parent_id = sibling
+            rows.append({
+                'company_id': company_id, 'code': code, 'name': name, 'account_type_id': account_type_id,
+                'level': level, 'parent_id': parent_id, 'is_analytical': True, 'is_active': True,
+                'created_at': datetime.utcnow(),
+            })
+    if rows:
+        db.session.execute(insert(Account), rows)
+        db.session.commit()
+    return len(rows)
+
+
+def cost_centers_by_department(company_id):
+    """{department_id: cost_center_id}, casando o código do centro de custo com o do departamento"""
+    return dict(db.session.execute(
+        select(Department.id, CostCenter.id)
+        .join(CostCenter, CostCenter.code == Department.code)
+        .where(CostCenter.company_id == company_id, CostCenter.is_active.is_(True))
+    ).all())
+
+
+def existing_entries(company_id, reference):
+    """[(id, status)] dos lançamentos já gerados para a referência"""
+    return db.session.execute(
+        select(JournalEntry.id, JournalEntry.status)
+        .where(JournalEntry.company_id == company_id, JournalEntry.reference == reference)
+    ).all()
+
+
+def delete_entries(entry_ids):
+    """Remove lançamentos (e suas linhas) em duas instruções. Não faz commit."""
+    if not entry_ids:
+        return
+    db.session.execute(delete(JournalEntryLine).where(JournalEntryLine.journal_entry_id.in_(entry_ids)))
+    db.session.execute(delete(JournalEntry).where(JournalEntry.id.in_(entry_ids)))
+
+
+def balance_lines(lines):
+    """Soma de débitos e créditos das linhas já arredondadas"""
+    debit = sum((line.get('debit_amount') or Decimal('0') for line in lines), Decimal('0'))
+    credit = sum((line.get('credit_amount') or Decimal('0') for line in lines), Decimal('0'))
+    return debit, credit
+
+
+def insert_entries(company_id, entries, created_by, status='draft', now=None):
+    """Grava os lançamentos em lote. Não faz commit.
+
+    entries: dicionários com date, description, reference e lines; cada linha
+    tem account_id, cost_center_id, description e debit_amount ou
+    credit_amount (Decimal). Lançamentos desbalanceados levantam ValueError.
+    Retorna os ids na ordem de entries.
+    """
+    if not entries:
+        return []
+    now = now or datetime.utcnow()
+    headers = []
+    for entry in entries:
+        debit, credit = balance_lines(entry['lines'])
+        if debit != credit:
+            raise ValueError(f"Lançamento desbalanceado: {entry['description']} (D {debit} / C {credit})")
+        headers.append({
+            'company_id': company_id,
+            'date': entry['date'],
+            'description': entry['description'],
+            'reference': entry['reference'],
+            'total_amount': debit,
+            'status': status,
+            'created_by': created_by,
+            'created_at': now,
+            'posted_at': now if status == 'posted' else None,
+        })
+
+    # Mesma numeração da tela de lançamentos: LC + próximo id da empresa
+    last_id = db.session.execute(
+        select(func.max(JournalEntry.id)).where(JournalEntry.company_id == company_id)
+    ).scalar() or 0
+    for offset, header in enumerate(headers, start=1):
+        header['entry_number'] = f'LC{last_id + offset:06d}'
+
+    entry_ids = db.session.execute(
+        insert(JournalEntry).returning(JournalEntry.id, sort_by_parameter_order=True), headers
+    ).scalars().all()
+
+    line_rows = [{
+        'journal_entry_id': entry_id,
+        'account_id': line['account_id'],
+        'cost_center_id': line.get('cost_center_id'),
+        'description': line.get('description'),
+        'debit_amount': line.get('debit_amount') or Decimal('0'),
+        'credit_amount': line.get('credit_amount') or Decimal('0'),
+    } for entry_id, entry in zip(entry_ids, entries) for line in entry['lines']]
+    db.session.execute(insert(JournalEntryLine), line_rows)
+    return entry_ids
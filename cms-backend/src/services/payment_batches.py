@@ -0,0 +1,326 @@
+"""Lotes de pagamento da folha e arquivos CNAB 240 (remessa e retorno)
+
+O lote é criado a partir dos itens calculados do período com um único
+INSERT ... SELECT (líquido e dados bancários/PIX do colaborador). O arquivo de
+remessa segue o leiaute FEBRABAN 240 posições: TED/crédito em conta usam os
+segmentos A e B; PIX usa o segmento A com forma de lançamento 45 e o segmento B
+com a chave. As quantidades e o total dos trailers são acumulados enquanto as
+linhas são geradas, então o arquivo sai em streaming sem uma segunda leitura.
+"""
+import re
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, exists, func, insert, literal, select
+
+from src.models.user import db
+from src.models.hr_advanced import Employee, Payment, PaymentBatch, PayrollItem
+
+FETCH_SIZE = 1000
+LINE_LENGTH = 240
+LINE_END = '\r\n'
+FILE_LAYOUT = '089'
+BATCH_LAYOUT = '045'
+SERVICE_SALARY = '30'  # tipo de serviço: pagamento de salários
+
+# Forma de lançamento e câmara de compensação por meio de pagamento
+PAYMENT_METHODS = {
+    'pix': ('45', '009'),
+    'ted': ('41', '018'),
+    'credit': ('01', '000'),  # crédito em conta no mesmo banco
+}
+PAYABLE_STATUSES = ('calculated', 'paid', 'closed')
+
+# Forma de iniciação do PIX (segmento B) por tipo de chave do colaborador
+PIX_KEY_TYPES = {'phone': '01', 'email': '02', 'cpf': '03', 'cnpj': '03', 'random': '04'}
+
+# Ocorrências do retorno: 00 = crédito efetuado, BD = pagamento agendado
+RETURN_PAID = '00'
+RETURN_SCHEDULED = 'BD'
+
+
+def _digits(value):
+    return re.sub(r'\D', '', str(value or ''))
+
+
+def _num(value, size):
+    return _digits(value)[-size:].rjust(size, '0') if value not in (None, '') else '0' * size
+
+
+def _alpha(value, size):
+    text = unicodedata.normalize('NFKD', str(value or ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^A-Za-z0-9 @._/-]', ' ', text).upper()
+    return text[:size].ljust(size)
+
+
+def _cents(value, size):
+    return str(int(round((value or 0) * 100))).rjust(size, '0')
+
+
+def _split_dv(value):
+    """'1234-5' -> ('1234', '5'); sem hífen o último dígito não é separado"""
+    value = str(value or '')
+    if '-' in value:
+        number, dv = value.rsplit('-', 1)
+        return _digits(number), _alpha(dv, 1).strip()
+    return _digits(value), ''
+
+
+def _line(*fields):
+    line = ''.join(fields)
+    if len(line) != LINE_LENGTH:
+        raise ValueError(f'Registro CNAB com {len(line)} posições')
+    return line + LINE_END
+
+
+# ==================== CRIAÇÃO DO LOTE ====================
+
+def create_batch(period, payment_method, bank_code, agency, account, bank_name=None, company_id=None):
+    """Cria o lote e os pagamentos do período em um único INSERT ... SELECT. Não faz commit.
+
+    Entram os colaboradores com líquido positivo e dados para o meio de
+    pagamento (chave PIX ou conta) que ainda não têm pagamento válido em outro
+    lote do mesmo período.
+    """
+    if period.status not in PAYABLE_STATUSES:
+        raise ValueError('Folha do período ainda não foi calculada')
+    if payment_method not in PAYMENT_METHODS:
+        raise ValueError(f'Meio de pagamento inválido: {payment_method}')
+
+    sequence = db.session.query(func.count(PaymentBatch.id)).filter_by(period_id=period.id).scalar() + 1
+    batch = PaymentBatch(
+        period_id=period.id,
+        company_id=company_id,
+        batch_number=f'{period.year}{period.month:02d}-{sequence:03d}',
+        file_sequence=(db.session.query(func.max(PaymentBatch.file_sequence)).scalar() or 0) + 1,
+        payment_method=payment_method,
+        total_amount=0,
+        employee_count=0,
+        bank_code=bank_code,
+        bank_name=bank_name,
+        agency=agency,
+        account=account
+    )
+    db.session.add(batch)
+    db.session.flush()
+
+    if payment_method == 'pix':
+        eligible = Employee.pix_key.isnot(None) & (Employee.pix_key != '')
+    else:
+        eligible = Employee.account.isnot(None) & (Employee.account != '')
+        if payment_method == 'credit':
+            eligible = eligible & (Employee.bank_code == bank_code)
+
+    other_payment = (
+        select(Payment.id)
+        .join(PaymentBatch, PaymentBatch.id == Payment.batch_id)
+        .where(
+            PaymentBatch.period_id == period.id,
+            Payment.employee_id == PayrollItem.employee_id,
+            Payment.status != 'failed'
+        )
+    )
+    now = datetime.utcnow()
+    source = (
+        select(
+            literal(batch.id), PayrollItem.employee_id, PayrollItem.net_salary, literal(payment_method),
+            Employee.pix_key, Employee.bank_code, Employee.agency, Employee.account,
+            literal('pending'), literal(now)
+        )
+        .join(Employee, Employee.id == PayrollItem.employee_id)
+        .where(PayrollItem.period_id == period.id, PayrollItem.net_salary > 0, eligible, ~exists(other_payment))
+        .order_by(PayrollItem.employee_id)
+    )
+    db.session.execute(insert(Payment).from_select(
+        ['batch_id', 'employee_id', 'amount', 'payment_method', 'pix_key', 'bank_code',
+         'agency', 'account', 'status', 'created_at'],
+        source
+    ))
+
+    count, total = db.session.execute(
+        select(func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0)).where(Payment.batch_id == batch.id)
+    ).one()
+    if not count:
+        raise ValueError('Nenhum colaborador elegível para o lote')
+    batch.employee_count = count
+    batch.total_amount = round(float(total), 2)
+    return batch
+
+
+# ==================== REMESSA ====================
+
+def _file_header(batch, company, moment):
+    agency, agency_dv = _split_dv(batch.agency)
+    account, account_dv = _split_dv(batch.account)
+    return _line(
+        _num(batch.bank_code, 3), '0000', '0', ' ' * 9,
+        '2', _num(company.cnpj, 14), ' ' * 20,
+        _num(agency, 5), _alpha(agency_dv, 1), _num(account, 12), _alpha(account_dv, 1), ' ',
+        _alpha(company.name, 30), _alpha(batch.bank_name, 30), ' ' * 10,
+        '1', moment.strftime('%d%m%Y'), moment.strftime('%H%M%S'), _num(batch.file_sequence, 6),
+        FILE_LAYOUT, '01600', ' ' * 20, _alpha(batch.batch_number, 20), ' ' * 29,
+    )
+
+
+def _batch_header(batch, company):
+    agency, agency_dv = _split_dv(batch.agency)
+    account, account_dv = _split_dv(batch.account)
+    zip_code = _num(company.zip_code, 8)
+    return _line(
+        _num(batch.bank_code, 3), '0001', '1', 'C', SERVICE_SALARY, PAYMENT_METHODS[batch.payment_method][0],
+        BATCH_LAYOUT, ' ', '2', _num(company.cnpj, 14), ' ' * 20,
+        _num(agency, 5), _alpha(agency_dv, 1), _num(account, 12), _alpha(account_dv, 1), ' ',
+        _alpha(company.name, 30), ' ' * 40, _alpha(company.address, 30), '0' * 5, ' ' * 15,
+        _alpha(company.city, 20), zip_code[:5], zip_code[5:], _alpha(company.state, 2),
+        ' ' * 2, ' ' * 6, ' ' * 10,
+    )
+
+
+def _segment_a(batch, sequence, row, payment_date):
+    agency, agency_dv = _split_dv(row.agency)
+    account, account_dv = _split_dv(row.account)
+    return _line(
+        _num(batch.bank_code, 3), '0001', '3', _num(sequence, 5), 'A', '0', '00',
+        PAYMENT_METHODS[batch.payment_method][1], _num(row.bank_code, 3),
+        _num(agency, 5), _alpha(agency_dv, 1), _num(account, 12), _alpha(account_dv, 1), ' ',
+        _alpha(row.full_name, 30), _num(row.id, 20), payment_date.strftime('%d%m%Y'), 'BRL', '0' * 15,
+        _cents(row.amount, 15), ' ' * 20, '0' * 8, '0' * 15, ' ' * 40,
+        ' ' * 2, ' ' * 5, ' ' * 2, ' ' * 3, '0', ' ' * 10,
+    )
+
+
+def _segment_b(batch, sequence, row):
+    header = (_num(batch.bank_code, 3), '0001', '3', _num(sequence, 5), 'B')
+    if batch.payment_method == 'pix':
+        return _line(
+            *header, _alpha(PIX_KEY_TYPES.get(row.pix_type, '04'), 3), '1', _num(row.cpf, 14),
+            ' ' * 35, ' ' * 60, str(row.pix_key or '').strip()[:99].ljust(99),  # chave sem alterar maiúsculas
+            ' ' * 6, '0' * 8,
+        )
+    zip_code = _num(row.zip_code, 8)
+    return _line(
+        *header, ' ' * 3, '1', _num(row.cpf, 14),
+        _alpha(row.address, 30), _num(row.address_number, 5), _alpha(row.complement, 15),
+        _alpha(row.neighborhood, 15), _alpha(row.city, 20), zip_code[:5], zip_code[5:], _alpha(row.state, 2),
+        '0' * 8, '0' * 15 * 5, ' ' * 15, '0', ' ' * 6, '0' * 8,
+    )
+
+
+def iter_remittance(batch, company, payment_date=None, moment=None):
+    """Linhas do arquivo de remessa CNAB 240, lidas do banco em blocos
+
+    Os pagamentos são lidos uma única vez; a quantidade de registros e o valor
+    total dos trailers são somados enquanto os segmentos são gerados.
+    """
+    moment = moment or datetime.now()
+    payment_date = payment_date or batch.period.payment_date or moment.date()
+    yield _file_header(batch, company, moment)
+    yield _batch_header(batch, company)
+
+    rows = db.session.execute(
+        select(
+            Payment.id, Payment.amount, Payment.pix_key, Payment.bank_code, Payment.agency, Payment.account,
+            Employee.full_name, Employee.cpf, Employee.pix_type, Employee.address, Employee.address_number,
+            Employee.complement, Employee.neighborhood, Employee.city, Employee.zip_code, Employee.state,
+        )
+        .join(Employee, Employee.id == Payment.employee_id)
+        .where(Payment.batch_id == batch.id, Payment.status != 'failed')
+        .order_by(Payment.id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+
+    sequence = 0
+    total_cents = 0
+    for row in rows:
+        sequence += 1
+        yield _segment_a(batch, sequence, row, payment_date)
+        sequence += 1
+        yield _segment_b(batch, sequence, row)
+        total_cents += int(round((row.amount or 0) * 100))
+
+    batch_records = sequence + 2
+    yield _line(
+        _num(batch.bank_code, 3), '0001', '5', ' ' * 9, _num(batch_records, 6),
+        str(total_cents).rjust(18, '0'), '0' * 18, '0' * 6, ' ' * 165, ' ' * 10,
+    )
+    yield _line(
+        _num(batch.bank_code, 3), '9999', '9', ' ' * 9, '000001', _num(batch_records + 2, 6), '0' * 6, ' ' * 205,
+    )
+
+
+def remittance_filename(batch):
+    return f'CNAB240_{batch.batch_number}_{batch.file_sequence or 0:06d}.rem'
+
+
+# ==================== RETORNO ====================
+
+def parse_return(lines):
+    """Segmentos A do arquivo de retorno: (linha, id do pagamento, ocorrências, nosso número, data real)"""
+    results, errors = [], []
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('latin-1')
+        line = line.rstrip('\r\n')
+        if len(line) < LINE_LENGTH or line[7] != '3' or line[13] != 'A':
+            continue
+        payment_id = _digits(line[73:93])
+        if not payment_id:
+            errors.append({'line': number, 'reason': 'Segmento A sem número do documento'})
+            continue
+        occurrences = [line[position:position + 2] for position in range(230, 240, 2) if line[position:position + 2].strip()]
+        results.append((number, int(payment_id), occurrences, line[134:154].strip(), line[154:162]))
+    return results, errors
+
+
+def import_return(batch, lines):
+    """Atualiza os pagamentos do lote a partir do arquivo de retorno, em lote. Não faz commit."""
+    parsed, errors = parse_return(lines)
+    payment_ids = set(db.session.execute(
+        select(Payment.id).where(Payment.batch_id == batch.id)
+    ).scalars())
+
+    now = datetime.utcnow()
+    updates = []
+    for number, payment_id, occurrences, bank_reference, _ in parsed:
+        if payment_id not in payment_ids:
+            errors.append({'line': number, 'reason': f'Pagamento {payment_id} não pertence ao lote'})
+            continue
+        if RETURN_PAID in occurrences:
+            status, message = 'completed', None
+        elif RETURN_SCHEDULED in occurrences:
+            status, message = 'sent', None
+        else:
+            status, message = 'failed', 'Ocorrências: ' + (', '.join(occurrences) or 'sem código')
+        updates.append({
+            'b_id': payment_id, 'b_status': status, 'b_error': message,
+            'b_transaction': bank_reference or None, 'b_processed': now if status != 'sent' else None,
+        })
+
+    if updates:
+        table = Payment.__table__
+        db.session.execute(
+            table.update().where(and_(table.c.id == bindparam('b_id'), table.c.batch_id == batch.id)).values(
+                status=bindparam('b_status'), error_message=bindparam('b_error'),
+                transaction_id=bindparam('b_transaction'), processed_at=bindparam('b_processed')
+            ),
+            updates
+        )
+
+    counts = dict(db.session.execute(
+        select(Payment.status, func.count(Payment.id)).where(Payment.batch_id == batch.id).group_by(Payment.status)
+    ).all())
+    if counts.get('completed', 0) == batch.employee_count:
+        batch.status = 'completed'
+    elif counts.get('completed') or counts.get('failed'):
+        batch.status = 'processed'
+    else:
+        batch.status = 'sent'
+    batch.processed_at = now
+
+    return {
+        'records': len(parsed),
+        'updated': len(updates),
+        'statuses': counts,
+        'errors': sorted(errors, key=lambda error: error['line']),
+    }
@@ -0,0 +1,160 @@
+"""Cálculo da folha de pagamento em lote
+
+O cálculo é dividido em três etapas independentes:
+
+- fetch_inputs: carrega em poucas consultas os dados do período como tuplas simples
+  (inclusive benefícios e dependentes, pré-carregados por colaborador);
+- compute_lines: calcula as rubricas de um lote de colaboradores (sem acesso ao banco);
+- persist_lines: grava os itens calculados com inserção em lote.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from src.models.user import db
+from src.models.hr_advanced import Employee, PayrollItem
+from src.services.benefits import DEDUCTION_FIELDS, employee_shares, load_benefits, load_dependents, split_benefit
+from src.services.payroll_tax import evaluate_batch, irrf_bases, load_table
+from src.services.time_bank import month_bounds, month_hours, record_hours
+
+MONTHLY_HOURS = 220
+OVERTIME_FACTOR = 1.5
+FGTS_RATE = 0.08
+INSERT_BATCH_SIZE = 1000
+
+PayrollInput = namedtuple(
+    'PayrollInput',
+    'employee_id department_id salary worked_hours overtime_hours night_shift_hours ir_dependents benefits'
+)
+
+# Tabelas de INSS e IRRF compiladas e participação nos benefícios (tipos simples, podem ir para outro processo)
+PayrollTables = namedtuple('PayrollTables', 'inss irrf benefit_shares')
+
+PAYROLL_FIELDS = (
+    'employee_id', 'base_salary', 'overtime_hours', 'overtime_value', 'taxable_benefits', 'inss', 'irrf',
+    'fgts', *DEDUCTION_FIELDS, 'gross_salary', 'total_deductions', 'net_salary',
+)
+
+
+def _period_hours(period):
+    """Horas por colaborador: do resumo mensal de ponto quando o período é um mês cheio, senão do ponto"""
+    start, end = month_bounds(period.start_date.year, period.start_date.month)
+    if (period.start_date, period.end_date) != (start, end):
+        return record_hours(period.start_date, period.end_date)
+    return month_hours(start.year, start.month)
+
+
+def fetch_inputs(period, include_calculated=False):
+    """Dados de entrada do período, com uma consulta por tabela (ponto agregado no banco)
+
+    Colaboradores que já têm item no período são ignorados, a menos que
+    include_calculated seja verdadeiro (usado pela simulação).
+    """
+    calculated = set()
+    if not include_calculated:
+        calculated = set(db.session.execute(
+            select(PayrollItem.employee_id).where(PayrollItem.period_id == period.id)
+        ).scalars())
+
+    hours = _period_hours(period)
+
+    dependents = load_dependents(period)
+    benefits = load_benefits(period)
+
+    employees = db.session.execute(
+        select(Employee.id, Employee.department_id, Employee.salary)
+        .where(Employee.status == 'active')
+        .order_by(Employee.id)
+    )
+
+    inputs = []
+    for employee_id, department_id, salary in employees:
+        if employee_id in calculated:
+            continue
+        worked, overtime, night = hours.get(employee_id, (0, 0, 0))
+        inputs.append(PayrollInput(
+            employee_id, department_id, float(salary or 0),
+            float(worked), float(overtime), float(night),
+            dependents.get(employee_id, 0), benefits.get(employee_id, ()),
+        ))
+    return inputs
+
+
+def load_tables(reference_date):
+    """Tabelas de INSS e IRRF vigentes na competência e regras de participação nos benefícios"""
+    return PayrollTables(load_table('inss', reference_date), load_table('irrf', reference_date), employee_shares())
+
+
+def compute_lines(inputs, tables):
+    """Calcula as rubricas de um lote de colaboradores
+
+    Recebe e devolve apenas tipos simples (tuplas), então pode ser executada
+    em outro processo. Os tributos são avaliados sobre o lote inteiro de uma
+    vez. Benefícios tributáveis (em utilidade) entram só nas bases de INSS,
+    IRRF e FGTS, sem somar ao bruto nem ao líquido; os demais geram a
+    participação do colaborador na rubrica de desconto da categoria. Cada
+    linha segue a ordem de PAYROLL_FIELDS.
+    """
+    hour_factor = OVERTIME_FACTOR / MONTHLY_HOURS
+    salaries = [item.salary for item in inputs]
+    overtime_values = [
+        round(item.salary * hour_factor * item.overtime_hours, 2) for item in inputs
+    ]
+    benefit_values = [_benefit_values(item, tables.benefit_shares) for item in inputs]
+    gross_values = [round(salary + overtime, 2) for salary, overtime in zip(salaries, overtime_values)]
+    tax_bases = [round(gross + benefits[0], 2) for gross, benefits in zip(gross_values, benefit_values)]
+    inss_values = evaluate_batch(tables.inss, tax_bases)
+    irrf_values = evaluate_batch(tables.irrf, irrf_bases(
+        tables.irrf, tax_bases, inss_values, [item.ir_dependents for item in inputs]
+    ))
+
+    lines = []
+    append = lines.append
+    for item, salary, overtime_value, (taxable_benefits, deductions), gross_salary, tax_base, inss, irrf in zip(
+        inputs, salaries, overtime_values, benefit_values, gross_values, tax_bases, inss_values, irrf_values
+    ):
+        fgts = round(tax_base * FGTS_RATE, 2)
+        total_deductions = round(inss + irrf + sum(deductions), 2)
+        append((
+            item.employee_id, salary, item.overtime_hours, overtime_value, taxable_benefits, inss, irrf, fgts,
+            *deductions, gross_salary, total_deductions,
+            round(gross_salary - total_deductions, 2),
+        ))
+    return lines
+
+
+def _benefit_values(item, shares):
+    """(valor tributável em utilidade, descontos na ordem de DEDUCTION_FIELDS) dos benefícios do colaborador"""
+    taxable_total = 0.0
+    deductions = dict.fromkeys(DEDUCTION_FIELDS, 0.0)
+    for grant in item.benefits:
+        _, field, share, taxable = split_benefit(grant, item.salary, shares)
+        taxable_total += taxable
+        if field:
+            deductions[field] += share
+    return round(taxable_total, 2), tuple(round(deductions[field], 2) for field in DEDUCTION_FIELDS)
+
+
+def persist_lines(period_id, lines, calculated_at=None):
+    """Grava os itens da folha com INSERT em lote"""
+    calculated_at = calculated_at or datetime.utcnow()
+    for start in range(0, len(lines), INSERT_BATCH_SIZE):
+        rows = []
+        for line in lines[start:start + INSERT_BATCH_SIZE]:
+            row = dict(zip(PAYROLL_FIELDS, line))
+            row['period_id'] = period_id
+            row['calculated_at'] = calculated_at
+            rows.append(row)
+        db.session.execute(insert(PayrollItem), rows)
+    return len(lines)
+
+
+def calculate_period(period):
+    """Calcula a folha do período para os colaboradores ainda sem item; não faz commit
+
+    Usa as tabelas de INSS e IRRF vigentes no fim do período, então recálculos
+    de competências antigas seguem a legislação da época.
+    """
+    lines = compute_lines(fetch_inputs(period), load_tables(period.end_date))
+    return persist_lines(period.id, lines)
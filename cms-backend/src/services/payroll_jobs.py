@@ -0,0 +1,193 @@
+"""Cálculo paralelo da folha em faixas de colaboradores
+
+Os colaboradores do período são divididos em faixas de ids. Cada faixa é
+calculada no pool de processos a partir de tuplas simples (compute_lines) e
+gravada em uma transação própria, então uma faixa com erro pode ser
+reprocessada sem refazer o restante do período. workers limita quantas faixas
+do job ficam no pool ao mesmo tempo.
+
+Um job ativo sem progresso (heartbeat_at: criação, reprocessamento, início ou
+faixa gravada) há mais de PAYROLL_JOB_STALE_MINUTES é considerado interrompido (queda do processo) e
+marcado como falho, liberando o período e permitindo o reprocessamento.
+"""
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from src.models.user import db
+from src.models.hr_advanced import PayrollJob, PayrollJobChunk
+from src.services.payroll import compute_lines, fetch_inputs, load_tables, persist_lines
+from src.services.payslips import render_period_payslips
+from src.services.workers import as_completed_in_pool
+
+DEFAULT_CHUNK_SIZE = 2000
+ACTIVE_STATUSES = ('pending', 'running')
+STALE_MINUTES = 30
+
+
+def create_job(period, chunk_size=None, workers=None, user_id=None):
+    """Cria o job e as faixas de colaboradores ainda sem cálculo no período"""
+    chunk_size = max(int(chunk_size or DEFAULT_CHUNK_SIZE), 1)
+    workers = max(int(workers), 1) if workers else None
+    employee_ids = [item.employee_id for item in fetch_inputs(period)]
+
+    job = PayrollJob(
+        period_id=period.id,
+        chunk_size=chunk_size,
+        workers=workers,
+        total_employees=len(employee_ids),
+        processed_employees=0,
+        created_by=user_id
+    )
+    db.session.add(job)
+    for sequence, start in enumerate(range(0, len(employee_ids), chunk_size), start=1):
+        ids = employee_ids[start:start + chunk_size]
+        job.chunks.append(PayrollJobChunk(
+            sequence=sequence,
+            first_employee_id=ids[0],
+            last_employee_id=ids[-1],
+            employee_count=len(ids)
+        ))
+    db.session.commit()
+    return job
+
+
+def last_activity(job):
+    """Momento do último progresso do job; jobs anteriores ao heartbeat_at usam criação, início e faixas"""
+    if job.heartbeat_at is not None:
+        return job.heartbeat_at
+    moments = [job.created_at, job.started_at] + [chunk.finished_at for chunk in job.chunks]
+    return max(moment for moment in moments if moment is not None)
+
+
+def fail_stale_jobs(period_id, now=None):
+    """Marca como falhos os jobs ativos do período sem progresso recente; retorna quantos. Faz commit."""
+    now = now or datetime.utcnow()
+    limit = timedelta(minutes=current_app.config.get('PAYROLL_JOB_STALE_MINUTES', STALE_MINUTES))
+    stale = [
+        job for job in PayrollJob.query.filter(
+            PayrollJob.period_id == period_id,
+            PayrollJob.status.in_(ACTIVE_STATUSES)
+        )
+        if now - last_activity(job) > limit
+    ]
+    for job in stale:
+        for chunk in job.chunks:
+            if chunk.status == 'running':
+                chunk.status = 'pending'
+        job.status = 'failed'
+        job.error_message = f'Cálculo interrompido: sem progresso desde {last_activity(job):%d/%m/%Y %H:%M}; use o reprocessamento'
+        job.finished_at = now
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+
+def active_job(period_id):
+    fail_stale_jobs(period_id)
+    return PayrollJob.query.filter(
+        PayrollJob.period_id == period_id,
+        PayrollJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+
+
+def _split_inputs(inputs, chunks):
+    """Distribui as entradas entre as faixas (busca binária pelo primeiro id)"""
+    starts = [chunk.first_employee_id for chunk in chunks]
+    buckets = {chunk.id: [] for chunk in chunks}
+    for item in inputs:
+        index = bisect_right(starts, item.employee_id) - 1
+        if index >= 0 and item.employee_id <= chunks[index].last_employee_id:
+            buckets[chunks[index].id].append(item)
+    return buckets
+
+
+def _finish(job):
+    statuses = [chunk.status for chunk in job.chunks]
+    failed = statuses.count('failed')
+    job.finished_at = datetime.utcnow()
+    if failed:
+        job.status = 'failed'
+        job.error_message = f'{failed} faixa(s) com erro; use o reprocessamento para tentar novamente'
+    else:
+        job.status = 'completed'
+        job.error_message = None
+        job.period.status = 'calculated'
+    db.session.commit()
+
+
+def run_job(job_id):
+    """Calcula as faixas pendentes do job, gravando cada uma em sua própria transação"""
+    job = PayrollJob.query.get(job_id)
+    job.status = 'running'
+    job.started_at = job.heartbeat_at = datetime.utcnow()
+    job.finished_at = None
+    db.session.commit()
+
+    try:
+        period = job.period
+        tables = load_tables(period.end_date)
+        chunks = sorted(job.chunks, key=lambda chunk: chunk.first_employee_id)
+        pending = [chunk for chunk in chunks if chunk.status == 'pending']
+        buckets = _split_inputs(fetch_inputs(period), chunks)
+
+        for chunk in pending:
+            chunk.status = 'running'
+        db.session.commit()
+
+        completed = as_completed_in_pool(
+            compute_lines, [(buckets[chunk.id], tables) for chunk in pending], max_workers=job.workers
+        )
+        for index, future in completed:
+            chunk = pending[index]
+            try:
+                count = persist_lines(period.id, future.result())
+                chunk.status = 'completed'
+                chunk.attempts = (chunk.attempts or 0) + 1
+                chunk.error_message = None
+                chunk.finished_at = job.heartbeat_at = datetime.utcnow()
+                job.processed_employees = (job.processed_employees or 0) + count
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                chunk.status = 'failed'
+                chunk.attempts = (chunk.attempts or 0) + 1
+                chunk.error_message = str(e)
+                chunk.finished_at = job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+
+        _finish(job)
+        if job.status == 'completed' and current_app.config.get('PAYSLIP_AUTO_RENDER', True):
+            render_period_payslips(period.id)
+    except Exception as e:
+        db.session.rollback()
+        PayrollJobChunk.query.filter_by(job_id=job.id, status='running').update({'status': 'pending'})
+        job.status = 'failed'
+        job.error_message = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    finally:
+        db.session.remove()
+
+
+def prepare_retry(job):
+    """Volta as faixas com erro para pendente; as concluídas são mantidas
+
+    O início e o heartbeat do job são renovados, para que a contagem de
+    inatividade do reprocessamento não parta da execução original.
+    """
+    retried = 0
+    for chunk in job.chunks:
+        if chunk.status == 'failed':
+            chunk.status = 'pending'
+            chunk.error_message = None
+            chunk.finished_at = None
+            retried += 1
+    job.status = 'pending'
+    job.error_message = None
+    job.started_at = None
+    job.finished_at = None
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    return retried
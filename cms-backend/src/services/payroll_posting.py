@@ -0,0 +1,183 @@
+"""Contabilização da folha de pagamento
+
+Os itens do período são somados por departamento e rubrica numa única
+consulta agrupada. Para cada departamento é montado um lançamento balanceado:
+proventos e FGTS a débito nas contas de despesa (com o centro de custo de
+mesmo código do departamento) e, a crédito, INSS, IRRF, demais descontos,
+FGTS a recolher e o líquido em salários a pagar. Todos os lançamentos são
+gravados em lote pelo services.ledger, na mesma transação.
+
+As contas são identificadas pelo código no plano de contas da empresa;
+PAYROLL_ACCOUNTS na configuração substitui os códigos padrão. As contas que a
+folha acrescentou ao plano padrão (SEEDED_ACCOUNTS) são criadas na
+inicialização nas bases que ainda não as têm.
+"""
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from src.models.user import db
+from src.models.departments import Department
+from src.models.hr_advanced import Employee, PayrollItem
+from src.services.ledger import (
+    balance_lines, cost_centers_by_department, delete_entries, existing_entries, insert_entries, load_accounts, money,
+    seed_accounts
+)
+
+DEFAULT_ACCOUNTS = {
+    'salary_expense': '4.3.04',      # Salários e ordenados
+    'fgts_expense': '4.3.05',        # FGTS
+    'salaries_payable': '2.1.1.01',  # Salários a pagar
+    'fgts_payable': '2.1.1.02',      # FGTS a recolher
+    'inss_payable': '2.1.1.03',      # INSS a recolher
+    'irrf_payable': '2.1.1.06',      # IRRF a recolher
+    'deductions_payable': '2.1.1.07',  # Benefícios e demais descontos a repassar
+}
+
+# Contas acrescentadas ao plano padrão para a folha
+SEEDED_ACCOUNTS = {
+    '2.1.1.06': 'IRRF A RECOLHER',
+    '2.1.1.07': 'DESCONTOS EM FOLHA A REPASSAR',
+    '4.3.04': 'SALÁRIOS E ORDENADOS',
+    '4.3.05': 'FGTS',
+}
+
+# Proventos lançados a débito: (campo do item, descrição, conta)
+EARNINGS = (
+    ('base_salary', 'Salários', 'salary_expense'),
+    ('overtime_value', 'Horas extras', 'salary_expense'),
+    ('night_shift_value', 'Adicional noturno', 'salary_expense'),
+    ('commission', 'Comissões', 'salary_expense'),
+    ('bonus', 'Gratificações', 'salary_expense'),
+    ('vacation_pay', 'Férias', 'salary_expense'),
+    ('thirteenth_salary', '13º salário', 'salary_expense'),
+    ('other_earnings', 'Outros proventos', 'salary_expense'),
+)
+
+# Descontos lançados a crédito
+DEDUCTIONS = (
+    ('inss', 'INSS retido', 'inss_payable'),
+    ('irrf', 'IRRF retido', 'irrf_payable'),
+    ('transport_voucher', 'Vale-transporte', 'deductions_payable'),
+    ('meal_voucher', 'Vale-refeição', 'deductions_payable'),
+    ('health_insurance', 'Plano de saúde', 'deductions_payable'),
+    ('dental_insurance', 'Plano odontológico', 'deductions_payable'),
+    ('life_insurance', 'Seguro de vida', 'deductions_payable'),
+    ('union_fee', 'Contribuição sindical', 'deductions_payable'),
+    ('advance_payment', 'Adiantamentos', 'deductions_payable'),
+    ('other_deductions', 'Outros descontos', 'deductions_payable'),
+)
+
+MAX_ROUNDING_DIFFERENCE = Decimal('0.05')
+
+
+def posting_reference(period):
+    return f'FOLHA-{period.id}'
+
+
+def account_codes(app=None):
+    app = app or current_app
+    return {**DEFAULT_ACCOUNTS, **app.config.get('PAYROLL_ACCOUNTS', {})}
+
+
+def seed_payroll_accounts():
+    """Cria as contas de SEEDED_ACCOUNTS que faltam no plano das empresas ativas"""
+    return seed_accounts(SEEDED_ACCOUNTS)
+
+
+def department_totals(period_id):
+    """Somas por departamento de cada rubrica do período (uma consulta agrupada)"""
+    fields = [field for field, _, _ in EARNINGS + DEDUCTIONS] + ['fgts', 'gross_salary', 'net_salary']
+    rows = db.session.execute(
+        select(
+            Employee.department_id, func.max(Department.name), func.count(PayrollItem.id),
+            *[func.coalesce(func.sum(getattr(PayrollItem, field)), 0) for field in fields]
+        )
+        .join(Employee, Employee.id == PayrollItem.employee_id)
+        .outerjoin(Department, Department.id == Employee.department_id)
+        .where(PayrollItem.period_id == period_id)
+        .group_by(Employee.department_id)
+        .order_by(Employee.department_id)
+    )
+    return [
+        {'department_id': row[0], 'department': row[1], 'employees': row[2],
+         **{field: money(value) for field, value in zip(fields, row[3:])}}
+        for row in rows
+    ]
+
+
+def build_entries(period, totals, accounts, cost_centers):
+    """Lançamentos balanceados (um por departamento) a partir das somas"""
+    reference = posting_reference(period)
+    competence = f'{period.month:02d}/{period.year}'
+    entries = []
+    for group in totals:
+        cost_center_id = cost_centers.get(group['department_id'])
+        label = group['department'] or 'Sem departamento'
+
+        def line(role, description, amount, side):
+            return {
+                'account_id': accounts[role],
+                'cost_center_id': cost_center_id,
+                'description': f'{description} {competence} - {label}',
+                f'{side}_amount': amount,
+            }
+
+        lines = [line(role, description, group[field], 'debit')
+                 for field, description, role in EARNINGS if group[field]]
+        lines += [line(role, description, group[field], 'credit')
+                  for field, description, role in DEDUCTIONS if group[field]]
+
+        # Líquido: o que sobra dos proventos depois dos descontos lançados
+        earnings = sum((group[field] for field, _, _ in EARNINGS), Decimal('0'))
+        deductions = sum((group[field] for field, _, _ in DEDUCTIONS), Decimal('0'))
+        net = earnings - deductions
+        if abs(net - group['net_salary']) > MAX_ROUNDING_DIFFERENCE * group['employees']:
+            raise ValueError(f'Itens da folha inconsistentes no departamento {label}: '
+                             f'proventos - descontos = {net}, líquido = {group["net_salary"]}')
+        if net:
+            lines.append(line('salaries_payable', 'Salários a pagar', net, 'credit'))
+
+        if group['fgts']:
+            lines.append(line('fgts_expense', 'FGTS', group['fgts'], 'debit'))
+            lines.append(line('fgts_payable', 'FGTS a recolher', group['fgts'], 'credit'))
+
+        if lines:
+            entries.append({
+                'date': period.end_date,
+                'description': f'Folha de pagamento {competence} - {label} ({group["employees"]} colaboradores)',
+                'reference': reference,
+                'lines': lines,
+            })
+    return entries
+
+
+def post_payroll_period(period, company_id, created_by, status='posted'):
+    """Gera a contabilização do período, substituindo rascunhos anteriores. Não faz commit.
+
+    Levanta ValueError se a folha já foi contabilizada em definitivo, se faltar
+    conta no plano ou se algum departamento não fechar.
+    """
+    reference = posting_reference(period)
+    previous = existing_entries(company_id, reference)
+    if any(entry_status == 'posted' for _, entry_status in previous):
+        raise ValueError('Folha do período já contabilizada')
+
+    codes = account_codes()
+    account_ids = load_accounts(company_id, codes.values())
+    accounts = {role: account_ids[code] for role, code in codes.items()}
+
+    entries = build_entries(period, department_totals(period.id), accounts, cost_centers_by_department(company_id))
+    if not entries:
+        raise ValueError('Período sem itens calculados')
+
+    delete_entries([entry_id for entry_id, _ in previous])
+    entry_ids = insert_entries(company_id, entries, created_by, status=status)
+    return {
+        'entries': len(entry_ids),
+        'lines': sum(len(entry['lines']) for entry in entries),
+        'total_amount': float(sum((balance_lines(entry['lines'])[0] for entry in entries), Decimal('0'))),
+        'replaced_drafts': len(previous),
+        'status': status,
+    }
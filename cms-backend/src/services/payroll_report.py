@@ -0,0 +1,236 @@
+"""Relatório da folha por período: itens paginados por cursor e subtotais
+
+Os itens vêm em uma única consulta (folha + colaborador + departamento),
+ordenados por departamento, nome e id do item, com paginação por cursor sobre
+essa mesma chave. Os subtotais por departamento e o total da empresa saem de
+um GROUP BY por departamento unido (UNION ALL) ao total geral, equivalente ao
+GROUP BY ROLLUP que o SQLite não tem. A exportação CSV/XLSX percorre os itens
+em streaming e intercala as linhas de subtotal ao trocar de departamento.
+"""
+import base64
+import csv
+import io
+import json
+
+from sqlalchemy import func, literal, null, select, tuple_, union_all
+
+from src.models.user import db
+from src.models.departments import Department
+from src.models.hr_advanced import Employee, PayrollItem
+from src.services.xlsx import STYLE_BOLD, STYLE_MONEY, STYLE_MONEY_BOLD, iter_xlsx
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_YIELD_PER = 1000
+NO_DEPARTMENT = 'Sem departamento'
+
+MONEY_COLUMNS = (
+    'base_salary', 'overtime_value', 'night_shift_value', 'commission', 'bonus', 'vacation_pay',
+    'thirteenth_salary', 'other_earnings', 'gross_salary',
+    'inss', 'irrf', 'transport_voucher', 'meal_voucher', 'health_insurance', 'dental_insurance',
+    'life_insurance', 'union_fee', 'advance_payment', 'other_deductions', 'total_deductions',
+    'net_salary', 'fgts',
+)
+
+# Cabeçalho da exportação: (campo, título)
+EXPORT_COLUMNS = (
+    ('department', 'Departamento'), ('employee_code', 'Matrícula'), ('employee_name', 'Colaborador'),
+    ('cpf', 'CPF'), ('position', 'Cargo'), ('overtime_hours', 'Horas extras'),
+    ('base_salary', 'Salário base'), ('overtime_value', 'Horas extras (R$)'),
+    ('night_shift_value', 'Adicional noturno'), ('commission', 'Comissões'), ('bonus', 'Gratificação'),
+    ('vacation_pay', 'Férias'), ('thirteenth_salary', '13º salário'), ('other_earnings', 'Outros proventos'),
+    ('gross_salary', 'Total de proventos'), ('inss', 'INSS'), ('irrf', 'IRRF'),
+    ('transport_voucher', 'Vale-transporte'), ('meal_voucher', 'Vale-refeição'),
+    ('health_insurance', 'Plano de saúde'), ('dental_insurance', 'Plano odontológico'),
+    ('life_insurance', 'Seguro de vida'), ('union_fee', 'Contribuição sindical'),
+    ('advance_payment', 'Adiantamento'), ('other_deductions', 'Outros descontos'),
+    ('total_deductions', 'Total de descontos'), ('net_salary', 'Líquido'), ('fgts', 'FGTS'),
+)
+
+_department_key = func.coalesce(Department.name, '')
+
+
+# ==================== CURSOR ====================
+
+def encode_cursor(department, name, item_id):
+    payload = json.dumps([department, name, item_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Levanta ValueError se o cursor não for válido"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        department, name, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(department), str(name), int(item_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Cursor inválido') from e
+
+
+# ==================== CONSULTAS ====================
+
+def _items_query(period_id, department_id=None):
+    query = (
+        select(
+            PayrollItem.id, PayrollItem.employee_id, Employee.employee_code, Employee.full_name, Employee.cpf,
+            Employee.position, Employee.department_id, _department_key.label('department'),
+            PayrollItem.overtime_hours, *[getattr(PayrollItem, column) for column in MONEY_COLUMNS]
+        )
+        .join(Employee, Employee.id == PayrollItem.employee_id)
+        .outerjoin(Department, Department.id == Employee.department_id)
+        .where(PayrollItem.period_id == period_id)
+        .order_by(_department_key, Employee.full_name, PayrollItem.id)
+    )
+    if department_id is not None:
+        query = query.where(Employee.department_id == department_id)
+    return query
+
+
+def _item_dict(row):
+    item = {
+        'id': row.id,
+        'employee_id': row.employee_id,
+        'employee_code': row.employee_code,
+        'employee_name': row.full_name,
+        'cpf': row.cpf,
+        'position': row.position,
+        'department_id': row.department_id,
+        'department': row.department or NO_DEPARTMENT,
+        'overtime_hours': row.overtime_hours or 0,
+    }
+    item.update({column: round(getattr(row, column) or 0, 2) for column in MONEY_COLUMNS})
+    return item
+
+
+def report_page(period_id, cursor=None, limit=DEFAULT_PAGE_SIZE, department_id=None):
+    """Uma página de itens a partir do cursor; retorna (itens, próximo cursor)"""
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    query = _items_query(period_id, department_id).limit(limit + 1)
+    if cursor:
+        query = query.where(tuple_(_department_key, Employee.full_name, PayrollItem.id) > decode_cursor(cursor))
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.department, last.full_name, last.id)
+    return [_item_dict(row) for row in rows[:limit]], next_cursor
+
+
+def report_subtotals(period_id, department_id=None):
+    """Subtotais por departamento e total da empresa em uma consulta (ROLLUP via UNION ALL)
+
+    O total da empresa é agregado sobre as linhas já agrupadas por
+    departamento (CTE), então os itens são percorridos uma única vez.
+    """
+    by_department = (
+        select(
+            Employee.department_id.label('department_id'),
+            func.max(Department.name).label('department'),
+            func.count(PayrollItem.id).label('employees'),
+            *[func.coalesce(func.sum(getattr(PayrollItem, column)), 0).label(column) for column in MONEY_COLUMNS]
+        )
+        .join(Employee, Employee.id == PayrollItem.employee_id)
+        .outerjoin(Department, Department.id == Employee.department_id)
+        .where(PayrollItem.period_id == period_id)
+        .group_by(Employee.department_id)
+    )
+    if department_id is not None:
+        by_department = by_department.where(Employee.department_id == department_id)
+    grouped = by_department.cte('department_totals')
+
+    rollup = union_all(
+        select(literal(0).label('level'), *grouped.c),
+        select(
+            literal(1), null(), null(), func.coalesce(func.sum(grouped.c.employees), 0),
+            *[func.coalesce(func.sum(grouped.c[column]), 0) for column in MONEY_COLUMNS]
+        )
+    )
+
+    departments, company = [], None
+    for row in db.session.execute(rollup).mappings():
+        values = {column: round(row[column] or 0, 2) for column in MONEY_COLUMNS}
+        values['employees'] = row['employees']
+        if row['level'] == 1:
+            company = values
+        else:
+            departments.append((row['department'] or '', {
+                'department_id': row['department_id'],
+                'department': row['department'] or NO_DEPARTMENT,
+                **values,
+            }))
+    departments.sort(key=lambda item: (item[0], item[1]['department_id'] or 0))
+    return [item for _, item in departments], company
+
+
+# ==================== EXPORTAÇÃO ====================
+
+def _export_rows(period_id, department_id=None):
+    """Linhas da exportação: ('item'|'subtotal'|'total', valores), com subtotais ao trocar de departamento"""
+    current = None
+    department_totals = None
+    company_totals = dict.fromkeys(MONEY_COLUMNS, 0.0)
+    result = db.session.execute(
+        _items_query(period_id, department_id).execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+    for row in result:
+        item = _item_dict(row)
+        if item['department'] != current:
+            if department_totals is not None:
+                yield 'subtotal', _rounded(department_totals)
+            current = item['department']
+            department_totals = dict.fromkeys(MONEY_COLUMNS, 0.0)
+            department_totals.update(department=f'Subtotal {current}', overtime_hours=0.0)
+        for column in MONEY_COLUMNS:
+            department_totals[column] += item[column]
+            company_totals[column] += item[column]
+        department_totals['overtime_hours'] += item['overtime_hours']
+        yield 'item', item
+    if department_totals is not None:
+        yield 'subtotal', _rounded(department_totals)
+    company_totals.update(department='Total da empresa', overtime_hours=None)
+    yield 'total', _rounded(company_totals)
+
+
+def _rounded(totals):
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in totals.items()}
+
+
+def _csv_value(field, value):
+    if value is None:
+        return ''
+    if field in MONEY_COLUMNS or field == 'overtime_hours':
+        return f'{value:.2f}'.replace('.', ',')
+    return value
+
+
+def iter_report_csv(period_id, department_id=None):
+    """CSV (separador ';', decimal com vírgula) em blocos de texto, com BOM para o Excel"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+    buffer.write('\ufeff')
+    writer.writerow([title for _, title in EXPORT_COLUMNS])
+    for kind, values in _export_rows(period_id, department_id):
+        writer.writerow([_csv_value(field, values.get(field)) for field, _ in EXPORT_COLUMNS])
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_report_xlsx(period_id, department_id=None, sheet_name='Folha'):
+    """XLSX em streaming com linhas de subtotal e total em negrito"""
+    def rows():
+        yield [title for _, title in EXPORT_COLUMNS], [STYLE_BOLD] * len(EXPORT_COLUMNS)
+        for kind, values in _export_rows(period_id, department_id):
+            bold = kind != 'item'
+            styles = [
+                (STYLE_MONEY_BOLD if bold else STYLE_MONEY) if field in MONEY_COLUMNS or field == 'overtime_hours'
+                else (STYLE_BOLD if bold else None)
+                for field, _ in EXPORT_COLUMNS
+            ]
+            yield [values.get(field) for field, _ in EXPORT_COLUMNS], styles
+
+    widths = [24, 12, 36, 16, 24] + [14] * (len(EXPORT_COLUMNS) - 5)
+    return iter_xlsx(sheet_name, rows(), widths)
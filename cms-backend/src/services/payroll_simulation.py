@@ -0,0 +1,90 @@
+"""Simulação de folha (cenários "e se") sem gravar itens
+
+Os dados do período são carregados uma única vez e cada cenário aplica seus
+ajustes sobre cópias das tuplas de entrada antes de chamar compute_lines.
+"""
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from src.models.user import db
+from src.models.departments import Department
+from src.services.payroll import PAYROLL_FIELDS, compute_lines, fetch_inputs, load_tables
+
+MAX_SCENARIOS = 10
+
+# Rubricas somadas nos totais (todas as colunas monetárias de PAYROLL_FIELDS)
+RUBRICS = tuple(field for field in PAYROLL_FIELDS if field not in ('employee_id', 'overtime_hours'))
+DEPARTMENT_RUBRICS = ('gross_salary', 'total_deductions', 'net_salary', 'fgts')
+
+
+def _adjust(inputs, scenario):
+    """Aplica os percentuais do cenário sobre as entradas (sem alterar as originais)"""
+    salary_factor = 1 + float(scenario.get('salary_increase') or 0) / 100
+    overtime_factor = 1 + float(scenario.get('overtime_change') or 0) / 100
+    if salary_factor == 1 and overtime_factor == 1:
+        return inputs
+    return [
+        item._replace(
+            salary=round(item.salary * salary_factor, 2),
+            overtime_hours=max(item.overtime_hours * overtime_factor, 0.0)
+        )
+        for item in inputs
+    ]
+
+
+def _summarize(inputs, lines, department_names):
+    index = {field: position for position, field in enumerate(PAYROLL_FIELDS)}
+    totals = dict.fromkeys(RUBRICS, 0.0)
+    departments = OrderedDict()
+
+    for item, line in zip(inputs, lines):
+        for rubric in RUBRICS:
+            totals[rubric] += line[index[rubric]]
+        department = departments.get(item.department_id)
+        if department is None:
+            department = departments[item.department_id] = {
+                'department_id': item.department_id,
+                'department': department_names.get(item.department_id),
+                'employee_count': 0,
+                **dict.fromkeys(DEPARTMENT_RUBRICS, 0.0),
+            }
+        department['employee_count'] += 1
+        for rubric in DEPARTMENT_RUBRICS:
+            department[rubric] += line[index[rubric]]
+
+    for department in departments.values():
+        for rubric in DEPARTMENT_RUBRICS:
+            department[rubric] = round(department[rubric], 2)
+        department['employer_cost'] = round(department['gross_salary'] + department['fgts'], 2)
+
+    totals = {rubric: round(value, 2) for rubric, value in totals.items()}
+    return {
+        'employee_count': len(lines),
+        'employer_cost': round(totals['gross_salary'] + totals['fgts'], 2),
+        'by_rubric': totals,
+        'by_department': sorted(departments.values(), key=lambda item: item['department'] or ''),
+    }
+
+
+def simulate_period(period, scenarios):
+    """Calcula os cenários sobre os dados do período e devolve apenas os totais
+
+    Cada cenário aceita salary_increase e overtime_change (percentuais). Nada é
+    gravado: os itens calculados ficam apenas em memória.
+    """
+    inputs = fetch_inputs(period, include_calculated=True)
+    tables = load_tables(period.end_date)
+    department_names = dict(db.session.execute(select(Department.id, Department.name)).all())
+
+    results = []
+    for position, scenario in enumerate(scenarios, start=1):
+        adjusted = _adjust(inputs, scenario)
+        summary = _summarize(adjusted, compute_lines(adjusted, tables), department_names)
+        summary['name'] = scenario.get('name') or f'Cenário {position}'
+        summary['salary_increase'] = float(scenario.get('salary_increase') or 0)
+        summary['overtime_change'] = float(scenario.get('overtime_change') or 0)
+        if results:
+            summary['employer_cost_change'] = round(summary['employer_cost'] - results[0]['employer_cost'], 2)
+        results.append(summary)
+    return results
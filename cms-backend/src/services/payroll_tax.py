@@ -0,0 +1,214 @@
+"""Tabelas progressivas de INSS e IRRF com vigência
+
+As tabelas ficam no banco (payroll_tax_tables / payroll_tax_brackets) e são
+compiladas em tuplas ordenadas de limites, alíquotas e parcelas a deduzir. A
+faixa de cada base é encontrada por busca binária, e o cálculo usa a forma
+"base x alíquota - parcela a deduzir", que equivale ao cálculo faixa a faixa.
+"""
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date
+
+from src.models.user import db
+from src.models.hr_advanced import PayrollTaxTable, PayrollTaxBracket
+
+CompiledTaxTable = namedtuple(
+    'CompiledTaxTable',
+    'table_id tax effective_date limits rates deductions base_ceiling dependent_deduction simplified_deduction'
+)
+
+TAXES = ('inss', 'irrf')
+
+# Série oficial contínua desde 2015, carregada na inicialização; novas vigências são cadastradas pela API
+DEFAULT_TAX_TABLES = [
+    {
+        'tax': 'inss', 'effective_date': date(2015, 1, 1), 'description': 'INSS 2015 (Portaria MPS/MF 13/2015)',
+        'base_ceiling': 4663.75,
+        'brackets': [(1399.12, 8.0, 0.0), (2331.88, 9.0, 0.0), (4663.75, 11.0, 0.0)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2016, 1, 1), 'description': 'INSS 2016 (Portaria MTPS/MF 1/2016)',
+        'base_ceiling': 5189.82,
+        'brackets': [(1556.94, 8.0, 0.0), (2594.92, 9.0, 0.0), (5189.82, 11.0, 0.0)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2017, 1, 1), 'description': 'INSS 2017 (Portaria MF 8/2017)',
+        'base_ceiling': 5531.31,
+        'brackets': [(1659.38, 8.0, 0.0), (2765.66, 9.0, 0.0), (5531.31, 11.0, 0.0)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2018, 1, 1), 'description': 'INSS 2018 (Portaria MF 15/2018)',
+        'base_ceiling': 5645.80,
+        'brackets': [(1693.72, 8.0, 0.0), (2822.90, 9.0, 0.0), (5645.80, 11.0, 0.0)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2019, 1, 1), 'description': 'INSS 2019 (Portaria ME 9/2019)',
+        'base_ceiling': 5839.45,
+        'brackets': [(1751.81, 8.0, 0.0), (2919.72, 9.0, 0.0), (5839.45, 11.0, 0.0)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2020, 1, 1), 'description': 'INSS janeiro/2020 (Portaria SEPRT/ME 914/2020)',
+        'base_ceiling': 6101.06,
+        'brackets': [(1830.29, 8.0, 0.0), (3050.52, 9.0, 0.0), (6101.06, 11.0, 0.0)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2020, 3, 1), 'description': 'INSS março/2020 (EC 103/2019, Portaria SEPRT/ME 3.659/2020)',
+        'base_ceiling': 6101.06,
+        'brackets': [(1045.00, 7.5, 0.0), (2089.60, 9.0, 15.67), (3134.40, 12.0, 78.36), (6101.06, 14.0, 141.05)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2021, 1, 1), 'description': 'INSS 2021 (Portaria SEPRT/ME 477/2021)',
+        'base_ceiling': 6433.57,
+        'brackets': [(1100.00, 7.5, 0.0), (2203.48, 9.0, 16.50), (3305.22, 12.0, 82.60), (6433.57, 14.0, 148.71)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2022, 1, 1), 'description': 'INSS 2022 (Portaria Interministerial MTP/ME 12/2022)',
+        'base_ceiling': 7087.22,
+        'brackets': [(1212.00, 7.5, 0.0), (2427.35, 9.0, 18.18), (3641.03, 12.0, 91.00), (7087.22, 14.0, 163.82)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2023, 1, 1), 'description': 'INSS janeiro/2023 (Portaria Interministerial MPS/MF 26/2023)',
+        'base_ceiling': 7507.49,
+        'brackets': [(1302.00, 7.5, 0.0), (2571.29, 9.0, 19.53), (3856.94, 12.0, 96.67), (7507.49, 14.0, 173.81)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2023, 5, 1), 'description': 'INSS maio/2023 (Portaria Interministerial MPS/MF 27/2023)',
+        'base_ceiling': 7507.49,
+        'brackets': [(1320.00, 7.5, 0.0), (2571.29, 9.0, 19.80), (3856.94, 12.0, 96.94), (7507.49, 14.0, 174.08)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2024, 1, 1), 'description': 'INSS 2024 (Portaria Interministerial MPS/MF 2/2024)',
+        'base_ceiling': 7786.02,
+        'brackets': [(1412.00, 7.5, 0.0), (2666.68, 9.0, 21.18), (4000.03, 12.0, 101.18), (7786.02, 14.0, 181.18)],
+    },
+    {
+        'tax': 'inss', 'effective_date': date(2025, 1, 1), 'description': 'INSS 2025 (Portaria Interministerial MPS/MF 6/2025)',
+        'base_ceiling': 8157.41,
+        'brackets': [(1518.00, 7.5, 0.0), (2793.88, 9.0, 22.77), (4190.83, 12.0, 106.59), (8157.41, 14.0, 190.40)],
+    },
+    {
+        'tax': 'irrf', 'effective_date': date(2015, 4, 1), 'description': 'IRRF abril/2015 (Lei 13.149/2015)',
+        'dependent_deduction': 189.59, 'simplified_deduction': 0.0,
+        'brackets': [(1903.98, 0.0, 0.0), (2826.65, 7.5, 142.80), (3751.05, 15.0, 354.80),
+                     (4664.68, 22.5, 636.13), (None, 27.5, 869.36)],
+    },
+    {
+        'tax': 'irrf', 'effective_date': date(2023, 5, 1), 'description': 'IRRF maio/2023 (MP 1.171/2023)',
+        'dependent_deduction': 189.59, 'simplified_deduction': 528.00,
+        'brackets': [(2112.00, 0.0, 0.0), (2826.65, 7.5, 158.40), (3751.05, 15.0, 370.40),
+                     (4664.68, 22.5, 651.73), (None, 27.5, 884.96)],
+    },
+    {
+        'tax': 'irrf', 'effective_date': date(2024, 2, 1), 'description': 'IRRF fevereiro/2024 (MP 1.206/2024)',
+        'dependent_deduction': 189.59, 'simplified_deduction': 564.80,
+        'brackets': [(2259.20, 0.0, 0.0), (2826.65, 7.5, 169.44), (3751.05, 15.0, 381.44),
+                     (4664.68, 22.5, 662.77), (None, 27.5, 896.00)],
+    },
+    {
+        'tax': 'irrf', 'effective_date': date(2025, 5, 1), 'description': 'IRRF maio/2025 (MP 1.294/2025)',
+        'dependent_deduction': 189.59, 'simplified_deduction': 607.20,
+        'brackets': [(2428.80, 0.0, 0.0), (2826.65, 7.5, 182.16), (3751.05, 15.0, 394.16),
+                     (4664.68, 22.5, 675.49), (None, 27.5, 908.73)],
+    },
+]
+
+
+def compile_table(table):
+    """Converte a tabela do banco em tuplas ordenadas para busca binária"""
+    brackets = table.sorted_brackets
+    if not brackets:
+        raise ValueError(f'Tabela {table.tax.upper()} de {table.effective_date} sem faixas')
+    limits = tuple(
+        bracket.upper_limit if bracket.upper_limit is not None else float('inf')
+        for bracket in brackets
+    )
+    return CompiledTaxTable(
+        table.id, table.tax, table.effective_date, limits,
+        tuple(bracket.rate / 100.0 for bracket in brackets),
+        tuple(bracket.deduction or 0.0 for bracket in brackets),
+        table.base_ceiling, table.dependent_deduction or 0.0, table.simplified_deduction or 0.0,
+    )
+
+
+def load_table(tax, reference_date):
+    """Tabela compilada vigente na data de referência"""
+    table = PayrollTaxTable.query.filter(
+        PayrollTaxTable.tax == tax,
+        PayrollTaxTable.effective_date <= reference_date
+    ).order_by(PayrollTaxTable.effective_date.desc()).first()
+    if table is None:
+        raise ValueError(f'Nenhuma tabela de {tax.upper()} vigente em {reference_date.strftime("%d/%m/%Y")}')
+    return compile_table(table)
+
+
+def evaluate(table, base):
+    """Valor do tributo para uma base (busca binária da faixa + parcela a deduzir)"""
+    if base <= 0:
+        return 0.0
+    if table.base_ceiling is not None and base > table.base_ceiling:
+        base = table.base_ceiling
+    index = bisect_left(table.limits, base)
+    if index == len(table.limits):
+        index -= 1
+    return max(round(base * table.rates[index] - table.deductions[index], 2), 0.0)
+
+
+def evaluate_batch(table, bases):
+    """Aplica a tabela a uma lista de bases de uma só vez"""
+    limits, rates, deductions = table.limits, table.rates, table.deductions
+    ceiling = table.base_ceiling if table.base_ceiling is not None else float('inf')
+    last = len(limits) - 1
+    values = []
+    append = values.append
+    for base in bases:
+        if base <= 0:
+            append(0.0)
+            continue
+        if base > ceiling:
+            base = ceiling
+        index = min(bisect_left(limits, base), last)
+        append(max(round(base * rates[index] - deductions[index], 2), 0.0))
+    return values
+
+
+def irrf_bases(table, gross_values, inss_values, dependents):
+    """Base do IRRF: bruto menos o maior entre deduções legais e o desconto simplificado"""
+    simplified = table.simplified_deduction
+    per_dependent = table.dependent_deduction
+    return [
+        gross - max(inss + count * per_dependent, simplified)
+        for gross, inss, count in zip(gross_values, inss_values, dependents)
+    ]
+
+
+def create_tax_table(tax, effective_date, brackets, description=None, base_ceiling=None,
+                     dependent_deduction=0.0, simplified_deduction=0.0):
+    """Cadastra uma nova vigência; brackets é uma lista de (limite, alíquota %, parcela a deduzir)"""
+    if tax not in TAXES:
+        raise ValueError(f'Tributo inválido: {tax}')
+    if not brackets:
+        raise ValueError('Informe as faixas da tabela')
+    table = PayrollTaxTable(
+        tax=tax, effective_date=effective_date, description=description,
+        base_ceiling=base_ceiling, dependent_deduction=dependent_deduction,
+        simplified_deduction=simplified_deduction
+    )
+    for upper_limit, rate, deduction in brackets:
+        table.brackets.append(PayrollTaxBracket(upper_limit=upper_limit, rate=rate, deduction=deduction or 0.0))
+    db.session.add(table)
+    return table
+
+
+def seed_tax_tables():
+    """Carrega as vigências oficiais que ainda não estão cadastradas (mesmo tributo e data)"""
+    existing = set(db.session.query(PayrollTaxTable.tax, PayrollTaxTable.effective_date))
+    missing = [data for data in DEFAULT_TAX_TABLES if (data['tax'], data['effective_date']) not in existing]
+    for data in missing:
+        create_tax_table(
+            data['tax'], data['effective_date'], data['brackets'], data['description'],
+            data.get('base_ceiling'), data.get('dependent_deduction', 0.0),
+            data.get('simplified_deduction', 0.0)
+        )
+    if missing:
+        db.session.commit()
+    return len(missing)
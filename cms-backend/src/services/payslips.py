@@ -0,0 +1,266 @@
+"""Holerites em PDF renderizados em lote e guardados por hash do conteúdo
+
+Depois do cálculo da folha, os holerites do período são renderizados no pool
+de processos a partir de dicionários simples. Cada PDF é gravado em
+<pasta>/<2 primeiros caracteres do hash>/<sha256>.pdf; a tabela payslips guarda
+o hash do conteúdo (ETag imutável) e o hash dos dados de origem, então só os
+holerites cujos dados mudaram são renderizados de novo. As linhas são gravadas
+com INSERT ... ON CONFLICT (período, colaborador) DO UPDATE, então a
+renderização em segundo plano e as renderizações sob demanda do mesmo período
+podem rodar ao mesmo tempo.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.models.user import db
+from src.models.accounting import Company
+from src.models.departments import Department
+from src.models.hr_advanced import Employee, PayrollItem, PayrollPeriod, Payslip
+from src.services.pdf import MARGIN, PdfPage, format_money, format_number, pages_to_pdf
+from src.services.workers import map_in_pool
+
+RENDER_VERSION = '1'  # altere ao mudar o leiaute para renderizar tudo de novo
+RENDER_CHUNK_SIZE = 500
+UPSERT_FIELDS = ('department_id', 'source_hash', 'content_hash', 'size', 'rendered_at')
+
+# (código, descrição, campo do item, campo de referência, é desconto)
+RUBRICS = (
+    ('001', 'Salário base', 'base_salary', None, False),
+    ('010', 'Horas extras 50%', 'overtime_value', 'overtime_hours', False),
+    ('011', 'Adicional noturno', 'night_shift_value', 'night_shift_hours', False),
+    ('020', 'Comissões', 'commission', None, False),
+    ('021', 'Gratificação', 'bonus', None, False),
+    ('030', 'Férias', 'vacation_pay', None, False),
+    ('031', '13º salário', 'thirteenth_salary', None, False),
+    ('040', 'Outros proventos', 'other_earnings', None, False),
+    ('501', 'INSS', 'inss', None, True),
+    ('502', 'IRRF', 'irrf', None, True),
+    ('510', 'Vale-transporte', 'transport_voucher', None, True),
+    ('511', 'Vale-refeição', 'meal_voucher', None, True),
+    ('520', 'Plano de saúde', 'health_insurance', None, True),
+    ('521', 'Plano odontológico', 'dental_insurance', None, True),
+    ('522', 'Seguro de vida', 'life_insurance', None, True),
+    ('530', 'Contribuição sindical', 'union_fee', None, True),
+    ('540', 'Adiantamento', 'advance_payment', None, True),
+    ('550', 'Outros descontos', 'other_deductions', None, True),
+)
+ITEM_FIELDS = tuple(sorted({rubric[2] for rubric in RUBRICS} | {rubric[3] for rubric in RUBRICS if rubric[3]} | {
+    'fgts', 'gross_salary', 'total_deductions', 'net_salary', 'taxable_benefits',
+}))
+
+
+def payslip_folder():
+    return current_app.config.get('PAYSLIP_FOLDER') or os.path.join(current_app.root_path, 'database', 'payslips')
+
+
+def archive_path(folder, content_hash):
+    return os.path.join(folder, content_hash[:2], f'{content_hash}.pdf')
+
+
+def payslip_filename(period, employee_id):
+    return f'holerite-{period.year}{period.month:02d}-{employee_id}.pdf'
+
+
+def _company_header():
+    company = Company.query.filter_by(is_active=True).order_by(Company.id).first()
+    if not company:
+        return {'name': '', 'cnpj': ''}
+    return {'name': company.name, 'cnpj': company.cnpj}
+
+
+def snapshots(period, employee_ids=None, department_id=None):
+    """Dados de cada holerite do período em tipos simples (uma consulta)"""
+    query = (
+        select(
+            PayrollItem.employee_id, Employee.full_name, Employee.cpf, Employee.employee_code,
+            Employee.position, Employee.admission_date, Employee.department_id, Department.name,
+            *[getattr(PayrollItem, field) for field in ITEM_FIELDS]
+        )
+        .join(Employee, Employee.id == PayrollItem.employee_id)
+        .outerjoin(Department, Department.id == Employee.department_id)
+        .where(PayrollItem.period_id == period.id)
+        .order_by(PayrollItem.employee_id)
+    )
+    if employee_ids is not None:
+        query = query.where(PayrollItem.employee_id.in_(employee_ids))
+    if department_id is not None:
+        query = query.where(Employee.department_id == department_id)
+
+    company = _company_header()
+    reference = f'{period.month:02d}/{period.year}'
+    for row in db.session.execute(query):
+        yield {
+            'employee_id': row[0],
+            'name': row[1],
+            'cpf': row[2],
+            'code': row[3] or str(row[0]),
+            'position': row[4],
+            'admission_date': row[5].strftime('%d/%m/%Y') if row[5] else '',
+            'department_id': row[6],
+            'department': row[7] or '',
+            'company': company,
+            'reference': reference,
+            'values': {field: float(value or 0) for field, value in zip(ITEM_FIELDS, row[8:])},
+        }
+
+
+def source_hash(data):
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False) + RENDER_VERSION
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# ==================== RENDERIZAÇÃO ====================
+
+RUBRIC_COLUMNS = (('Cód.', 60, 'la'), ('Descrição', 150, 'la'), ('Referência', 700, 'ra'),
+                  ('Vencimentos', 930, 'ra'), ('Descontos', 1170, 'ra'))
+
+
+def render_payslip(data):
+    """Renderiza o holerite (snapshot) e devolve os bytes do PDF"""
+    page = PdfPage()
+    x1, x2 = MARGIN, page.width - MARGIN
+    values = data['values']
+
+    y = MARGIN
+    page.box(x1, y, x2, y + 110)
+    page.text(x1 + 15, y + 15, data['company']['name'], size=24)
+    page.text(x1 + 15, y + 55, f"CNPJ: {data['company']['cnpj']}", size=16)
+    page.text(x2 - 15, y + 15, 'RECIBO DE PAGAMENTO DE SALÁRIO', size=20, anchor='ra')
+    page.text(x2 - 15, y + 55, f"Competência {data['reference']}", size=18, anchor='ra')
+
+    y += 120
+    page.box(x1, y, x2, y + 110)
+    page.label(x1 + 15, y + 10, 'Código', data['code'])
+    page.label(x1 + 180, y + 10, 'Nome do colaborador', data['name'])
+    page.label(900, y + 10, 'CPF', data['cpf'])
+    page.label(x1 + 15, y + 60, 'Cargo', data['position'])
+    page.label(600, y + 60, 'Departamento', data['department'])
+    page.label(960, y + 60, 'Admissão', data['admission_date'])
+
+    y += 125
+    page.line(x1, y, x2, y, width=2)
+    for caption, column_x, anchor in RUBRIC_COLUMNS:
+        page.text(column_x, y + 6, caption.upper(), size=12, anchor=anchor)
+    y += 26
+    page.line(x1, y, x2, y)
+    for code, description, field, reference_field, is_deduction in RUBRICS:
+        amount = values.get(field, 0)
+        if not amount:
+            continue
+        if field == 'base_salary':
+            reference = '30 dias'
+        elif reference_field:
+            reference = format_number(values.get(reference_field, 0))
+        else:
+            reference = ''
+        row = (code, description, reference, '' if is_deduction else format_money(amount),
+               format_money(amount) if is_deduction else '')
+        for (_, column_x, anchor), value in zip(RUBRIC_COLUMNS, row):
+            page.text(column_x, y + 6, value, size=15, anchor=anchor)
+        y += 28
+        page.line(x1, y, x2, y)
+
+    y += 10
+    page.box(x1, y, x2, y + 100)
+    page.label(x1 + 15, y + 10, 'Total de vencimentos', format_money(values['gross_salary']))
+    page.label(500, y + 10, 'Total de descontos', format_money(values['total_deductions']))
+    page.text(x2 - 15, y + 12, 'VALOR LÍQUIDO', size=14, anchor='ra')
+    page.text(x2 - 15, y + 40, format_money(values['net_salary']), size=26, anchor='ra')
+
+    y += 110
+    page.box(x1, y, x2, y + 60)
+    tax_base = values['gross_salary'] + values['taxable_benefits']
+    bases = (
+        ('Salário base', values['base_salary']),
+        ('Base INSS', tax_base),
+        ('Base FGTS', tax_base),
+        ('FGTS do mês', values['fgts']),
+        ('Base IRRF', max(tax_base - values['inss'], 0)),
+    )
+    for index, (caption, amount) in enumerate(bases):
+        page.label(x1 + 15 + index * 225, y + 10, caption, format_money(amount), size=15)
+    return pages_to_pdf([page])
+
+
+def _render_to_archive(job):
+    """Executado no pool: renderiza, calcula o hash e grava o arquivo se ainda não existir"""
+    folder, data = job
+    content = render_payslip(data)
+    content_hash = hashlib.sha256(content).hexdigest()
+    path = archive_path(folder, content_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as handle:
+            handle.write(content)
+        os.replace(temp_path, path)
+    return data['employee_id'], content_hash, len(content)
+
+
+def _upsert():
+    """INSERT dos holerites que atualiza a linha existente do mesmo período e colaborador"""
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(Payslip)
+    return statement.on_conflict_do_update(
+        index_elements=['period_id', 'employee_id'],
+        set_={field: statement.excluded[field] for field in UPSERT_FIELDS}
+    )
+
+
+def render_period(period, folder, employee_ids=None, department_id=None, max_workers=None,
+                  chunk_size=RENDER_CHUNK_SIZE):
+    """Renderiza os holerites do período cujos dados mudaram, gravando cada bloco em sua transação
+
+    Retorna {'rendered': n, 'unchanged': n}.
+    """
+    existing = {
+        row[0]: row[1:] for row in db.session.execute(
+            select(Payslip.employee_id, Payslip.source_hash, Payslip.content_hash)
+            .where(Payslip.period_id == period.id)
+        )
+    }
+
+    pending = []
+    unchanged = 0
+    for data in snapshots(period, employee_ids, department_id):
+        digest = source_hash(data)
+        current = existing.get(data['employee_id'])
+        if current and current[0] == digest and os.path.exists(archive_path(folder, current[1])):
+            unchanged += 1
+            continue
+        pending.append((data, digest))
+
+    rendered = 0
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        results = map_in_pool(_render_to_archive, [(folder, data) for data, _ in chunk],
+                              max_workers=max_workers, chunksize=16)
+
+        now = datetime.utcnow()
+        db.session.execute(_upsert(), [{
+            'period_id': period.id, 'employee_id': employee_id, 'department_id': data['department_id'],
+            'source_hash': digest, 'content_hash': content_hash, 'size': size, 'rendered_at': now,
+        } for (data, digest), (employee_id, content_hash, size) in zip(chunk, results)])
+        db.session.commit()
+        rendered += len(chunk)
+
+    return {'rendered': rendered, 'unchanged': unchanged}
+
+
+def render_period_payslips(period_id):
+    """Tarefa de segundo plano: renderiza todos os holerites do período"""
+    try:
+        period = PayrollPeriod.query.get(period_id)
+        if period is not None:
+            return render_period(period, payslip_folder(), max_workers=current_app.config.get('PAYSLIP_RENDER_WORKERS'))
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Falha ao renderizar os holerites do período %s', period_id)
+    finally:
+        db.session.remove()
@@ -0,0 +1,102 @@
+"""Geração de documentos PDF simples com Pillow"""
+import unicodedata
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Página A4 em 150 DPI
+PAGE_SIZE = (1240, 1754)
+PAGE_RESOLUTION = 150.0
+MARGIN = 60
+
+# Fontes TrueType com acentuação, procuradas nas pastas de fontes do sistema
+FONT_CANDIDATES = ['DejaVuSans.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf', 'arial.ttf']
+
+
+@lru_cache(maxsize=16)
+def get_font(size):
+    """Fonte no tamanho informado; usa a fonte embutida do Pillow se não houver outra"""
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+
+@lru_cache(maxsize=1)
+def has_accented_font():
+    return any(_font_available(name) for name in FONT_CANDIDATES)
+
+
+def _font_available(name):
+    try:
+        ImageFont.truetype(name, 12)
+        return True
+    except OSError:
+        return False
+
+
+def printable(value):
+    """Remove acentos quando só a fonte embutida (sem acentuação) está disponível"""
+    text = str(value if value is not None else '')
+    if has_accented_font():
+        return text
+    normalized = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in normalized if not unicodedata.combining(char))
+
+
+class PdfPage:
+    """Página desenhada em memória e exportada como PDF"""
+
+    def __init__(self):
+        self.image = Image.new('L', PAGE_SIZE, 255)
+        self.draw = ImageDraw.Draw(self.image)
+
+    @property
+    def width(self):
+        return PAGE_SIZE[0]
+
+    @property
+    def height(self):
+        return PAGE_SIZE[1]
+
+    def text(self, x, y, value, size=18, anchor='la'):
+        """Escreve um texto na posição informada"""
+        self.draw.text((x, y), printable(value), fill=0, font=get_font(size), anchor=anchor)
+
+    def label(self, x, y, caption, value, size=18):
+        """Escreve um campo com legenda pequena acima do valor"""
+        self.text(x, y, caption.upper(), size=12)
+        self.text(x, y + 16, value, size=size)
+
+    def box(self, x1, y1, x2, y2, width=2):
+        """Desenha um retângulo"""
+        self.draw.rectangle((x1, y1, x2, y2), outline=0, width=width)
+
+    def line(self, x1, y1, x2, y2, width=1):
+        """Desenha uma linha"""
+        self.draw.line((x1, y1, x2, y2), fill=0, width=width)
+
+
+def pages_to_pdf(pages):
+    """Converte uma lista de páginas em bytes de um único PDF"""
+    buffer = BytesIO()
+    images = [page.image for page in pages]
+    images[0].save(
+        buffer, format='PDF', resolution=PAGE_RESOLUTION,
+        save_all=True, append_images=images[1:]
+    )
+    return buffer.getvalue()
+
+
+def format_number(value, decimals=2):
+    """Formata número no padrão brasileiro (1.234,56)"""
+    formatted = f"{float(value or 0):,.{decimals}f}"
+    return formatted.replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def format_money(value):
+    """Formata valor monetário no padrão brasileiro"""
+    return format_number(value, 2)
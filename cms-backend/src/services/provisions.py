@@ -0,0 +1,344 @@
+"""Provisões mensais de férias e 13º salário
+
+Os colaboradores com direito (CLT e temporários em atividade no fim do mês)
+são carregados numa única consulta como tuplas simples, assim como as férias
+pagas na folha nos últimos 12 meses, e os avos são calculados uma vez por data
+de admissão distinta, então o custo não depende de carregar objetos por
+colaborador. Regras:
+
+- férias: avos do período aquisitivo em curso (a partir do último aniversário
+  de admissão) mais o último período completo, que continua provisionado até
+  as férias serem pagas (vacation_pay nas folhas desde o aniversário, convertido
+  em avos pelo salário-base do item), com o terço constitucional;
+- 13º salário: avos do ano civil;
+- a fração de mês com 15 dias ou mais conta como um avo.
+
+O saldo de cada colaborador fica em provision_snapshots. A contabilização do
+mês lança, por departamento, a diferença entre o saldo do mês e o da última
+fotografia anterior: constituição (despesa a débito) quando o saldo cresce e
+reversão quando diminui (férias gozadas, 13º pago, desligamentos). Refazer o
+mesmo mês substitui a fotografia e os rascunhos; se o mês já foi contabilizado
+em definitivo, só é aceito quando os valores não mudaram.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, or_, select, tuple_
+
+from src.models.user import db
+from src.models.accounting import JournalEntry
+from src.models.departments import Department
+from src.models.hr_advanced import Employee, PayrollItem, PayrollPeriod, ProvisionSnapshot
+from src.services.ledger import (
+    balance_lines, cost_centers_by_department, delete_entries, existing_entries, insert_entries, load_accounts, money,
+    seed_accounts
+)
+
+PROVISIONED_CONTRACTS = ('clt', 'temporary')
+MIN_DAYS_FOR_MONTH = 15
+VACATION_BONUS = 1 / 3
+INSERT_BATCH_SIZE = 1000
+
+DEFAULT_ACCOUNTS = {
+    'vacation_expense': '4.3.06',       # Férias
+    'thirteenth_expense': '4.3.07',     # 13º salário
+    'vacation_provision': '2.1.1.04',   # Provisão para férias
+    'thirteenth_provision': '2.1.1.05',  # Provisão para 13º salário
+}
+
+# Contas acrescentadas ao plano padrão para as provisões
+SEEDED_ACCOUNTS = {
+    '4.3.06': 'FÉRIAS',
+    '4.3.07': '13º SALÁRIO',
+}
+
+# Provisões lançadas: (campo da fotografia, descrição, conta de despesa, conta de provisão)
+PROVISIONS = (
+    ('vacation_provision', 'Provisão de férias', 'vacation_expense', 'vacation_provision'),
+    ('thirteenth_provision', 'Provisão de 13º salário', 'thirteenth_expense', 'thirteenth_provision'),
+)
+
+SNAPSHOT_FIELDS = (
+    'employee_id', 'department_id', 'salary',
+    'vacation_months', 'vacation_provision', 'thirteenth_months', 'thirteenth_provision',
+)
+
+
+def month_index(year, month):
+    return year * 12 + month - 1
+
+
+def provision_reference(year, month):
+    return f'PROV-{year}-{month:02d}'
+
+
+def account_codes(app=None):
+    app = app or current_app
+    return {**DEFAULT_ACCOUNTS, **app.config.get('PROVISION_ACCOUNTS', {})}
+
+
+def seed_provision_accounts():
+    """Cria as contas de SEEDED_ACCOUNTS que faltam no plano das empresas ativas"""
+    return seed_accounts(SEEDED_ACCOUNTS)
+
+
+# ==================== AVOS ====================
+
+def _add_months(value, months):
+    year, month = divmod(value.month - 1 + months, 12)
+    year += value.year
+    return date(year, month + 1, min(value.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def accrued_months(start, reference):
+    """Avos entre start e reference (inclusive): meses cheios e a fração com 15 dias ou mais"""
+    limit = reference + timedelta(days=1)
+    months = (reference.year - start.year) * 12 + reference.month - start.month + 1
+    while months > 0 and _add_months(start, months) > limit:
+        months -= 1
+    remaining = (reference - _add_months(start, months)).days + 1
+    return max(months, 0) + (1 if remaining >= MIN_DAYS_FOR_MONTH else 0)
+
+
+def acquisition_start(admission_date, reference):
+    """Início do período aquisitivo em curso (último aniversário de admissão até reference)"""
+    years = reference.year - admission_date.year
+    anniversary = _add_months(admission_date, 12 * years)
+    if anniversary > reference:
+        anniversary = _add_months(admission_date, 12 * (years - 1))
+    return anniversary
+
+
+def vacation_months(admission_date, reference, paid_months=0):
+    """Avos em aberto: período aquisitivo em curso mais o último período completo ainda não pago
+
+    paid_months são os avos de férias pagos desde o início do período em curso;
+    o período completo deixa de ser provisionado à medida que é pago.
+    """
+    start = acquisition_start(admission_date, reference)
+    carried = max(12 - paid_months, 0) if start > admission_date else 0
+    return min(accrued_months(start, reference), 12) + carried
+
+
+def thirteenth_months(admission_date, reference):
+    """Avos do ano civil até o mês de referência"""
+    start = max(admission_date, date(reference.year, 1, 1))
+    first_month_days = calendar.monthrange(start.year, start.month)[1] - start.day + 1
+    return reference.month - start.month + (1 if first_month_days >= MIN_DAYS_FOR_MONTH else 0)
+
+
+def compute_provisions(employees, reference, vacation_payments=None):
+    """Saldos de provisão no fim do mês, na ordem de SNAPSHOT_FIELDS
+
+    employees: tuplas (id, departamento, salário, admissão); vacation_payments:
+    {id: [(fim do período da folha, avos pagos)]}. Os avos são calculados uma
+    vez por data de admissão distinta; só quem recebeu férias é recalculado.
+    """
+    vacation_payments = vacation_payments or {}
+    months = {
+        admission: (vacation_months(admission, reference), thirteenth_months(admission, reference))
+        for admission in {row[3] for row in employees}
+    }
+    lines = []
+    append = lines.append
+    for employee_id, department_id, salary, admission in employees:
+        vacation, thirteenth = months[admission]
+        payments = vacation_payments.get(employee_id)
+        if payments:
+            start = acquisition_start(admission, reference)
+            paid = round(sum(avos for end_date, avos in payments if end_date >= start))
+            vacation = vacation_months(admission, reference, paid)
+        monthly = salary / 12
+        append((
+            employee_id, department_id, salary,
+            vacation, round(monthly * vacation * (1 + VACATION_BONUS), 2),
+            thirteenth, round(monthly * thirteenth, 2),
+        ))
+    return lines
+
+
+# ==================== FOTOGRAFIAS ====================
+
+def load_employees(reference):
+    """Colaboradores com direito a provisão no fim do mês, como tuplas simples"""
+    return [
+        (employee_id, department_id, float(salary or 0), admission)
+        for employee_id, department_id, salary, admission in db.session.execute(
+            select(Employee.id, Employee.department_id, Employee.salary, Employee.admission_date)
+            .where(
+                Employee.admission_date <= reference,
+                or_(Employee.dismissal_date.is_(None), Employee.dismissal_date > reference),
+                Employee.status != 'inactive',
+                or_(Employee.contract_type.is_(None), Employee.contract_type.in_(PROVISIONED_CONTRACTS))
+            )
+            .order_by(Employee.id)
+        )
+    ]
+
+
+def load_vacation_payments(reference):
+    """{employee_id: [(fim do período da folha, avos pagos)]} das férias pagas nos 12 meses até reference"""
+    payments = {}
+    monthly_with_bonus = PayrollItem.base_salary / 12 * (1 + VACATION_BONUS)
+    for employee_id, end_date, avos in db.session.execute(
+        select(PayrollItem.employee_id, PayrollPeriod.end_date, PayrollItem.vacation_pay / monthly_with_bonus)
+        .join(PayrollPeriod, PayrollPeriod.id == PayrollItem.period_id)
+        .where(
+            PayrollItem.vacation_pay > 0,
+            PayrollItem.base_salary > 0,
+            PayrollPeriod.end_date > _add_months(reference, -12),
+            PayrollPeriod.end_date <= reference
+        )
+    ):
+        payments.setdefault(employee_id, []).append((end_date, float(avos)))
+    return payments
+
+
+def store_snapshots(year, month, lines, computed_at=None):
+    """Substitui a fotografia do mês com INSERT em lote. Não faz commit."""
+    computed_at = computed_at or datetime.utcnow()
+    db.session.execute(delete(ProvisionSnapshot).where(
+        ProvisionSnapshot.year == year, ProvisionSnapshot.month == month
+    ))
+    for start in range(0, len(lines), INSERT_BATCH_SIZE):
+        db.session.execute(insert(ProvisionSnapshot), [
+            dict(zip(SNAPSHOT_FIELDS, line), year=year, month=month, computed_at=computed_at)
+            for line in lines[start:start + INSERT_BATCH_SIZE]
+        ])
+
+
+def _snapshot_index():
+    return ProvisionSnapshot.year * 12 + ProvisionSnapshot.month - 1
+
+
+def previous_month(year, month):
+    """(ano, mês) da última fotografia anterior ao mês, ou None"""
+    index = db.session.execute(
+        select(func.max(_snapshot_index())).where(_snapshot_index() < month_index(year, month))
+    ).scalar()
+    return None if index is None else (index // 12, index % 12 + 1)
+
+
+def department_balances(months):
+    """{(ano, mês): {department_id: (colaboradores, férias, 13º)}} numa consulta agrupada"""
+    balances = {key: {} for key in months}
+    if not months:
+        return balances
+    rows = db.session.execute(
+        select(
+            ProvisionSnapshot.year, ProvisionSnapshot.month, ProvisionSnapshot.department_id,
+            func.count(ProvisionSnapshot.id),
+            func.coalesce(func.sum(ProvisionSnapshot.vacation_provision), 0),
+            func.coalesce(func.sum(ProvisionSnapshot.thirteenth_provision), 0),
+        )
+        .where(tuple_(ProvisionSnapshot.year, ProvisionSnapshot.month).in_(months))
+        .group_by(ProvisionSnapshot.year, ProvisionSnapshot.month, ProvisionSnapshot.department_id)
+    )
+    for year, month, department_id, count, vacation, thirteenth in rows:
+        balances[(year, month)][department_id] = (count, money(vacation), money(thirteenth))
+    return balances
+
+
+# ==================== CONTABILIZAÇÃO ====================
+
+def build_entries(year, month, current, previous, accounts, cost_centers, department_names):
+    """Um lançamento por departamento com a variação de cada provisão"""
+    reference = provision_reference(year, month)
+    competence = f'{month:02d}/{year}'
+    entry_date = date(year, month, calendar.monthrange(year, month)[1])
+    empty = (0, Decimal('0'), Decimal('0'))
+
+    entries = []
+    for department_id in sorted(set(current) | set(previous), key=lambda value: (value is None, value)):
+        count, *balances = current.get(department_id, empty)
+        _, *previous_balances = previous.get(department_id, empty)
+        cost_center_id = cost_centers.get(department_id)
+        label = department_names.get(department_id) or 'Sem departamento'
+
+        lines = []
+        for (_, description, expense, provision), balance, previous_balance in zip(
+            PROVISIONS, balances, previous_balances
+        ):
+            delta = balance - previous_balance
+            if not delta:
+                continue
+            if delta < 0:
+                description = f'Reversão - {description.lower()}'
+            debit, credit = (expense, provision) if delta > 0 else (provision, expense)
+            for role, side in ((debit, 'debit'), (credit, 'credit')):
+                lines.append({
+                    'account_id': accounts[role],
+                    'cost_center_id': cost_center_id,
+                    'description': f'{description} {competence} - {label}',
+                    f'{side}_amount': abs(delta),
+                })
+        if lines:
+            entries.append({
+                'date': entry_date,
+                'description': f'Provisões de férias e 13º {competence} - {label} ({count} colaboradores)',
+                'reference': reference,
+                'lines': lines,
+            })
+    return entries
+
+
+def provision_month(year, month, company_id, created_by, status='posted'):
+    """Calcula as provisões do mês, grava a fotografia e lança as variações. Não faz commit.
+
+    Levanta ValueError se já houver fotografia de mês posterior, se faltar
+    conta no plano ou se o mês já foi contabilizado com outros valores.
+    """
+    first = month_index(year, month)
+    later = db.session.execute(
+        select(func.count(ProvisionSnapshot.id)).where(_snapshot_index() > first)
+    ).scalar()
+    if later:
+        raise ValueError('Já existem provisões de meses posteriores; refaça a partir do último mês')
+
+    reference_date = date(year, month, calendar.monthrange(year, month)[1])
+    lines = compute_provisions(load_employees(reference_date), reference_date, load_vacation_payments(reference_date))
+    store_snapshots(year, month, lines)
+
+    previous = previous_month(year, month)
+    months = [(year, month)] + ([previous] if previous else [])
+    balances = department_balances(months)
+
+    codes = account_codes()
+    account_ids = load_accounts(company_id, codes.values())
+    accounts = {role: account_ids[code] for role, code in codes.items()}
+    department_names = dict(db.session.execute(select(Department.id, Department.name)).all())
+    entries = build_entries(
+        year, month, balances[(year, month)], balances.get(previous, {}),
+        accounts, cost_centers_by_department(company_id), department_names
+    )
+
+    totals = {field: round(sum(line[SNAPSHOT_FIELDS.index(field)] for line in lines), 2)
+              for field, _, _, _ in PROVISIONS}
+    total_amount = sum((balance_lines(entry['lines'])[0] for entry in entries), Decimal('0'))
+    summary = {
+        'year': year,
+        'month': month,
+        'employees': len(lines),
+        'previous_month': '{:04d}-{:02d}'.format(*previous) if previous else None,
+        **totals,
+        'entries': len(entries),
+        'total_amount': float(total_amount),
+        'status': status,
+    }
+
+    reference = provision_reference(year, month)
+    previous_entries = existing_entries(company_id, reference)
+    if any(entry_status == 'posted' for _, entry_status in previous_entries):
+        posted_total = db.session.execute(
+            select(func.coalesce(func.sum(JournalEntry.total_amount), 0))
+            .where(JournalEntry.company_id == company_id, JournalEntry.reference == reference)
+        ).scalar()
+        if len(previous_entries) != len(entries) or money(posted_total) != total_amount:
+            raise ValueError('Provisões do mês já contabilizadas com outros valores')
+        return {**summary, 'status': 'posted', 'unchanged': True}
+
+    delete_entries([entry_id for entry_id, _ in previous_entries])
+    insert_entries(company_id, entries, created_by, status=status)
+    return {**summary, 'replaced_drafts': len(previous_entries), 'unchanged': False}
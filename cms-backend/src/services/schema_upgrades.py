@@ -0,0 +1,106 @@
+"""Ajustes de esquema em bancos já existentes
+
+db.create_all() só cria as tabelas que ainda não existem: colunas, índices e
+restrições de unicidade acrescentados a tabelas antigas precisam ser
+aplicados aqui. Cada passo consulta o catálogo (ou usa IF NOT EXISTS) antes
+de alterar, então upgrade_schema pode rodar a cada inicialização, logo depois
+do create_all.
+
+As colunas novas entram sem valor padrão no banco (NULL nas linhas antigas);
+os valores padrão continuam vindo do modelo nas inserções, e os passos de
+carga usam o NULL para saber quais linhas ainda não foram preenchidas.
+"""
+from flask import current_app
+from sqlalchemy import UniqueConstraint, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+from src.models.user import db
+from src.models.hr_advanced import ESocialEvent, InternalCommunication, PaymentBatch, PayrollItem, PayrollJob
+from src.services.communications import backfill_recipients
+
+# Modelo: colunas acrescentadas depois da criação da tabela
+ADDED_COLUMNS = (
+    (InternalCommunication, ('recipient_count', 'read_count', 'confirmation_count')),
+    (ESocialEvent, ('batch_id',)),
+    (PaymentBatch, ('company_id', 'file_sequence')),
+    (PayrollItem, ('taxable_benefits',)),
+    (PayrollJob, ('heartbeat_at',)),
+)
+
+
+def _column_ddl(column, dialect):
+    ddl = f'{column.name} {column.type.compile(dialect=dialect)}'
+    for foreign_key in column.foreign_keys:
+        ddl += f' REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})'
+    return ddl
+
+
+def add_missing_columns(connection):
+    """ALTER TABLE ... ADD COLUMN para as colunas de ADDED_COLUMNS ausentes; retorna as adicionadas"""
+    inspector = inspect(connection)
+    added = []
+    for model, names in ADDED_COLUMNS:
+        table = model.__table__
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for name in names:
+            if name in existing:
+                continue
+            connection.execute(text(
+                f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(table.c[name], connection.dialect)}'
+            ))
+            added.append(f'{table.name}.{name}')
+    return added
+
+
+def create_missing_indexes(connection):
+    """Cria os índices e as restrições de unicidade declarados nos modelos que faltam no banco
+
+    Os índices (inclusive parciais e por expressão, como ix_products_stock_shortage)
+    usam CREATE INDEX IF NOT EXISTS. As restrições de unicidade viram índices
+    únicos com o mesmo nome; se a tabela já tiver duplicidades, a restrição é
+    ignorada com um aviso no log. Retorna as restrições criadas.
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+        constraints = [
+            constraint for constraint in table.constraints
+            if isinstance(constraint, UniqueConstraint) and constraint.name
+        ]
+        if not constraints:
+            continue
+        existing = {item['name'] for item in inspector.get_unique_constraints(table.name)}
+        existing |= {item['name'] for item in inspector.get_indexes(table.name)}
+        for constraint in constraints:
+            if constraint.name in existing:
+                continue
+            columns = ', '.join(column.name for column in constraint.columns)
+            try:
+                connection.execute(text(
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS {constraint.name} ON {table.name} ({columns})'
+                ))
+            except IntegrityError:
+                current_app.logger.warning(
+                    'Restrição %s não criada: há linhas duplicadas em %s (%s)', constraint.name, table.name, columns
+                )
+                continue
+            created.append(constraint.name)
+    return created
+
+
+def upgrade_schema():
+    """Aplica os ajustes pendentes e as cargas iniciais das colunas novas"""
+    with db.engine.begin() as connection:
+        added = add_missing_columns(connection)
+        constraints = create_missing_indexes(connection)
+
+    backfilled = backfill_recipients()
+    db.session.commit()
+    return {'columns': added, 'constraints': constraints, 'communications': backfilled}
@@ -0,0 +1,447 @@
+"""Índice de busca textual (SQLite FTS5, com tabela de termos como alternativa portátil)
+
+O texto é normalizado antes de indexar e antes de consultar (minúsculas e sem
+acentos), então "joao" encontra "João" em qualquer banco. As consultas fazem
+casamento por prefixo de cada palavra digitada, próprio para autocompletar.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import bindparam, column, event, false, func, insert, literal, select, text, union_all, Integer
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from src.models.user import db
+from src.models.fiscal import Customer, Product, Invoice
+from src.models.hr_advanced import Employee
+from src.models.search import SearchDocument, SearchTerm
+
+FTS_TABLE = 'search_fts'
+ROWID_FACTOR = 10 ** 12  # rowid = código da entidade * fator + id
+BACKEND_EXTENSION_KEY = 'search_index_backend'
+MAX_TERM_LENGTH = 60
+RANKED_MATCH_LIMIT = 1000  # acima disso o autocompletar não ordena por bm25 (custo cresce com os candidatos)
+
+SearchEntity = namedtuple('SearchEntity', 'name code model document')
+
+# Documento indexado: (company_id, rótulo, detalhe, título, corpo)
+IndexDocument = namedtuple('IndexDocument', 'company_id label detail title body')
+
+ENTITIES = {}
+_ENTITIES_BY_MODEL = {}
+
+
+def register_entity(name, code, model, document):
+    """Registra um modelo no índice; document(obj, connection) devolve um IndexDocument"""
+    entity = SearchEntity(name, code, model, document)
+    ENTITIES[name] = entity
+    _ENTITIES_BY_MODEL[model] = entity
+    return entity
+
+
+def normalize_text(value):
+    """Minúsculas, sem acentos e apenas letras/números separados por espaço"""
+    if not value:
+        return ''
+    normalized = unicodedata.normalize('NFKD', str(value))
+    normalized = ''.join(char for char in normalized if not unicodedata.combining(char))
+    return re.sub(r'[^0-9a-z]+', ' ', normalized.lower()).strip()
+
+
+def only_digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def _join(*values):
+    return ' '.join(str(value) for value in values if value)
+
+
+# ==================== ENTIDADES INDEXADAS ====================
+
+def _customer_document(customer, connection):
+    return IndexDocument(
+        customer.company_id,
+        customer.name,
+        _join(customer.document, customer.city and f"{customer.city}/{customer.state or ''}"),
+        _join(customer.name, customer.trade_name),
+        _join(customer.document, only_digits(customer.document), customer.email, customer.city),
+    )
+
+
+def _product_document(product, connection):
+    return IndexDocument(
+        product.company_id,
+        product.name,
+        _join(product.code, product.unit),
+        _join(product.name, product.code),
+        _join(product.description, product.ncm, only_digits(product.ncm)),
+    )
+
+
+def _invoice_document(invoice, connection):
+    customer_name = connection.execute(
+        select(Customer.name).where(Customer.id == invoice.customer_id)
+    ).scalar()
+    return IndexDocument(
+        invoice.company_id,
+        f"NF {invoice.number}/{invoice.series}",
+        _join(customer_name, invoice.status),
+        _join(invoice.number, customer_name),
+        _join(invoice.access_key, invoice.additional_info),
+    )
+
+
+def _employee_document(employee, connection):
+    # O RH não separa colaboradores por empresa: documentos com company_id nulo
+    return IndexDocument(
+        None,
+        employee.full_name,
+        _join(employee.employee_code, employee.position),
+        _join(employee.full_name, employee.employee_code),
+        _join(employee.cpf, only_digits(employee.cpf), employee.pis_pasep, only_digits(employee.pis_pasep),
+              employee.position),
+    )
+
+
+register_entity('customer', 1, Customer, _customer_document)
+register_entity('product', 2, Product, _product_document)
+register_entity('invoice', 3, Invoice, _invoice_document)
+register_entity('employee', 4, Employee, _employee_document)
+
+
+# ==================== ESTRUTURA DO ÍNDICE ====================
+
+def ensure_search_index(connection):
+    """Cria o índice FTS5 se o banco suportar; retorna 'fts5' ou 'table'"""
+    extensions = current_app.extensions
+    backend = extensions.get(BACKEND_EXTENSION_KEY)
+    if backend:
+        return backend
+
+    backend = 'table'
+    if connection.dialect.name == 'sqlite':
+        try:
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "company_id UNINDEXED, label UNINDEXED, detail UNINDEXED, title, body, "
+                "tokenize='unicode61', prefix='2 3')"
+            )
+            backend = 'fts5'
+        except OperationalError:
+            backend = 'table'
+
+    extensions[BACKEND_EXTENSION_KEY] = backend
+    return backend
+
+
+def _is_indexed(connection, backend, entity):
+    if backend == 'fts5':
+        return connection.execute(
+            text(f"SELECT 1 FROM {FTS_TABLE} WHERE rowid BETWEEN :low AND :high LIMIT 1"),
+            {'low': entity.code * ROWID_FACTOR, 'high': (entity.code + 1) * ROWID_FACTOR - 1}
+        ).first() is not None
+    return connection.execute(
+        select(SearchDocument.entity_id).where(SearchDocument.entity_code == entity.code).limit(1)
+    ).first() is not None
+
+
+def init_search_index():
+    """Prepara o índice na inicialização e reconstrói as entidades ainda não indexadas"""
+    with db.engine.begin() as connection:
+        backend = ensure_search_index(connection)
+        missing = [name for name, entity in ENTITIES.items() if not _is_indexed(connection, backend, entity)]
+    if missing:
+        rebuild_search_index(missing)
+    return backend
+
+
+def _tokens(value):
+    return [token[:MAX_TERM_LENGTH] for token in normalize_text(value).split()]
+
+
+def _write_documents(connection, entity, documents):
+    """Grava (substituindo) documentos do índice: lista de (entity_id, IndexDocument ou None)"""
+    if not documents:
+        return
+    backend = ensure_search_index(connection)
+    ids = [entity_id for entity_id, _ in documents]
+    rows = [(entity_id, doc) for entity_id, doc in documents if doc is not None]
+
+    if backend == 'fts5':
+        connection.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :rowid"),
+            [{'rowid': entity.code * ROWID_FACTOR + entity_id} for entity_id in ids]
+        )
+        if rows:
+            connection.execute(
+                text(
+                    f"INSERT INTO {FTS_TABLE} (rowid, company_id, label, detail, title, body) "
+                    "VALUES (:rowid, :company_id, :label, :detail, :title, :body)"
+                ),
+                [{
+                    'rowid': entity.code * ROWID_FACTOR + entity_id,
+                    'company_id': doc.company_id,
+                    'label': doc.label,
+                    'detail': doc.detail,
+                    'title': normalize_text(doc.title),
+                    'body': normalize_text(doc.body),
+                } for entity_id, doc in rows]
+            )
+        return
+
+    terms_table = SearchTerm.__table__
+    documents_table = SearchDocument.__table__
+    connection.execute(
+        terms_table.delete().where(
+            terms_table.c.entity_code == entity.code,
+            terms_table.c.entity_id.in_(ids)
+        )
+    )
+    connection.execute(
+        documents_table.delete().where(
+            documents_table.c.entity_code == entity.code,
+            documents_table.c.entity_id.in_(ids)
+        )
+    )
+    if not rows:
+        return
+    connection.execute(insert(documents_table), [{
+        'entity_code': entity.code,
+        'entity_id': entity_id,
+        'company_id': doc.company_id,
+        'label': (doc.label or '')[:255],
+        'detail': (doc.detail or '')[:255],
+    } for entity_id, doc in rows])
+
+    term_rows = []
+    for entity_id, doc in rows:
+        weights = {}
+        for term in _tokens(doc.body):
+            weights[term] = 1
+        for term in _tokens(doc.title):
+            weights[term] = 2
+        term_rows.extend({
+            'entity_code': entity.code,
+            'entity_id': entity_id,
+            'company_id': doc.company_id,
+            'term': term,
+            'weight': weight,
+        } for term, weight in weights.items())
+    if term_rows:
+        connection.execute(insert(terms_table), term_rows)
+
+
+def index_entities(connection, entity_name, objects):
+    """Indexa objetos já gravados (usado por cargas em lote que não passam pelo flush)"""
+    entity = ENTITIES[entity_name]
+    _write_documents(connection, entity, [
+        (obj.id, entity.document(obj, connection)) for obj in objects
+    ])
+
+
+def rebuild_search_index(entity_names=None, chunk_size=2000):
+    """Reconstrói o índice das entidades informadas (todas por padrão)"""
+    for name in entity_names or list(ENTITIES):
+        entity = ENTITIES[name]
+        with db.engine.begin() as connection:
+            backend = ensure_search_index(connection)
+            if backend == 'fts5':
+                connection.execute(
+                    text(f"DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN :low AND :high"),
+                    {'low': entity.code * ROWID_FACTOR, 'high': (entity.code + 1) * ROWID_FACTOR - 1}
+                )
+            else:
+                connection.execute(SearchTerm.__table__.delete().where(SearchTerm.entity_code == entity.code))
+                connection.execute(SearchDocument.__table__.delete().where(SearchDocument.entity_code == entity.code))
+
+        last_id = 0
+        while True:
+            objects = entity.model.query.filter(entity.model.id > last_id) \
+                .order_by(entity.model.id).limit(chunk_size).all()
+            if not objects:
+                break
+            connection = db.session.connection()
+            _write_documents(connection, entity, [
+                (obj.id, entity.document(obj, connection)) for obj in objects
+            ])
+            db.session.commit()
+            last_id = objects[-1].id
+
+
+# ==================== SINCRONIZAÇÃO NAS GRAVAÇÕES ====================
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """Mantém o índice em dia na mesma transação das gravações via ORM"""
+    pending = {}
+    changed = list(session.new) + [obj for obj in session.dirty if session.is_modified(obj)]
+    for obj in changed:
+        entity = _ENTITIES_BY_MODEL.get(type(obj))
+        if entity is not None and obj.id is not None:
+            pending.setdefault(entity, {})[obj.id] = obj
+    for obj in session.deleted:
+        entity = _ENTITIES_BY_MODEL.get(type(obj))
+        if entity is not None and obj.id is not None:
+            pending.setdefault(entity, {})[obj.id] = None
+
+    if not pending:
+        return
+
+    connection = session.connection()
+    with session.no_autoflush:
+        for entity, objects in pending.items():
+            _write_documents(connection, entity, [
+                (entity_id, entity.document(obj, connection) if obj is not None else None)
+                for entity_id, obj in objects.items()
+            ])
+
+
+# ==================== CONSULTAS ====================
+
+def _match_expression(tokens):
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _fts_query(entity, company_id, tokens, with_label=False, column_filter=None):
+    columns = 'rowid - :base AS entity_id, bm25(' + FTS_TABLE + ', 10.0, 1.0) AS score'
+    if with_label:
+        columns += ', label, detail'
+    sql = (
+        f"SELECT {columns} FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :match AND rowid BETWEEN :low AND :high"
+    )
+    params = {
+        'base': entity.code * ROWID_FACTOR,
+        'match': f'{column_filter} : ({_match_expression(tokens)})' if column_filter else _match_expression(tokens),
+        'low': entity.code * ROWID_FACTOR,
+        'high': (entity.code + 1) * ROWID_FACTOR - 1,
+    }
+    if company_id is not None:
+        sql += ' AND company_id = :company_id'
+        params['company_id'] = company_id
+    return sql, params
+
+
+def _terms_query(entity, company_id, tokens):
+    """Busca por prefixo na tabela de termos: todas as palavras precisam casar"""
+    selects = []
+    for index, token in enumerate(tokens):
+        conditions = [
+            SearchTerm.entity_code == entity.code,
+            SearchTerm.term >= token,
+            SearchTerm.term < token + '\uffff',
+        ]
+        if company_id is not None:
+            conditions.append(SearchTerm.company_id == company_id)
+        else:
+            conditions.append(SearchTerm.company_id.is_(None))
+        selects.append(
+            select(
+                SearchTerm.entity_id.label('entity_id'),
+                literal(index).label('token_index'),
+                SearchTerm.weight.label('weight')
+            ).where(*conditions)
+        )
+    matches = union_all(*selects).subquery()
+    return select(
+        matches.c.entity_id,
+        (-func.sum(matches.c.weight)).label('score')
+    ).group_by(matches.c.entity_id).having(
+        func.count(func.distinct(matches.c.token_index)) == len(tokens)
+    )
+
+
+def search_ids_subquery(entity_name, company_id, query):
+    """Subconsulta com os ids que casam com a busca, para usar em filtros IN
+
+    Uma busca sem nenhuma palavra pesquisável (só pontuação, por exemplo) não
+    casa com nada: a subconsulta volta vazia em vez de deixar a listagem sem filtro.
+    """
+    entity = ENTITIES[entity_name]
+    tokens = _tokens(query)
+    if not tokens:
+        return select(literal(0).label('entity_id'), literal(0).label('score')).where(false()).subquery()
+    connection = db.session.connection()
+    if ensure_search_index(connection) == 'fts5':
+        sql, params = _fts_query(entity, company_id, tokens)
+        return text(sql).bindparams(**params).columns(column('entity_id', Integer), column('score')).subquery()
+    return _terms_query(entity, company_id, tokens).subquery()
+
+
+def search(company_id, query, entity_names=None, limit=10):
+    """Busca unificada: devolve resultados ordenados por relevância em cada entidade"""
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    connection = db.session.connection()
+    backend = ensure_search_index(connection)
+    results = []
+
+    for name in entity_names or list(ENTITIES):
+        entity = ENTITIES[name]
+        if backend == 'fts5':
+            sql, params = _fts_query(entity, company_id, tokens, with_label=True)
+            rows = connection.execute(
+                text(sql + ' ORDER BY score LIMIT :limit'),
+                {**params, 'limit': limit}
+            ).all()
+        else:
+            matches = _terms_query(entity, company_id, tokens).subquery()
+            rows = connection.execute(
+                select(matches.c.entity_id, matches.c.score, SearchDocument.label, SearchDocument.detail)
+                .join(SearchDocument, (SearchDocument.entity_code == entity.code) &
+                      (SearchDocument.entity_id == matches.c.entity_id))
+                .order_by(matches.c.score)
+                .limit(limit)
+            ).all()
+        results.extend({
+            'type': name,
+            'id': row.entity_id,
+            'label': row.label,
+            'detail': row.detail,
+            'score': round(-float(row.score), 4),
+        } for row in rows)
+
+    results.sort(key=lambda result: -result['score'])
+    return results
+
+
+def autocomplete(entity_name, company_id, query, limit=10):
+    """Sugestões (id, rótulo, detalhe) de uma entidade para autocompletar
+
+    Com até RANKED_MATCH_LIMIT candidatos o resultado vem por relevância. Para
+    prefixos muito comuns o bm25 de todos os candidatos ficaria caro, então vêm
+    primeiro os documentos que casam no título e depois os demais, na ordem do
+    índice.
+    """
+    entity = ENTITIES[entity_name]
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    connection = db.session.connection()
+    if ensure_search_index(connection) != 'fts5':
+        return [{key: result[key] for key in ('id', 'label', 'detail')}
+                for result in search(company_id, query, [entity_name], limit)]
+
+    sql, params = _fts_query(entity, company_id, tokens)
+    candidates = connection.execute(
+        text(f'SELECT count(*) FROM ({sql} LIMIT :cap)'),
+        {**params, 'cap': RANKED_MATCH_LIMIT + 1}
+    ).scalar()
+
+    if candidates <= RANKED_MATCH_LIMIT:
+        sql, params = _fts_query(entity, company_id, tokens, with_label=True)
+        rows = connection.execute(text(sql + ' ORDER BY score LIMIT :limit'), {**params, 'limit': limit}).all()
+    else:
+        sql, params = _fts_query(entity, company_id, tokens, with_label=True, column_filter='title')
+        rows = connection.execute(text(sql + ' LIMIT :limit'), {**params, 'limit': limit}).all()
+        if len(rows) < limit:
+            sql, params = _fts_query(entity, company_id, tokens, with_label=True)
+            seen = [row.entity_id for row in rows]
+            rows += connection.execute(
+                text(sql + ' AND rowid - :base NOT IN :seen LIMIT :limit').bindparams(bindparam('seen', expanding=True)),
+                {**params, 'seen': seen or [0], 'limit': limit - len(rows)}
+            ).all()
+    return [{'id': row.entity_id, 'label': row.label, 'detail': row.detail} for row in rows]
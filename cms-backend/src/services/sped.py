@@ -0,0 +1,271 @@
+"""Geração em streaming do arquivo SPED EFD ICMS/IPI
+
+O arquivo é produzido registro a registro a partir de consultas lidas em
+blocos (yield_per), então a memória usada não depende da quantidade de notas
+do mês. Os totalizadores (X990, 9900, 9990 e 9999) e a apuração do bloco E
+são calculados na mesma passagem em que os registros são gerados.
+"""
+import calendar
+import re
+from collections import Counter, OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+
+from sqlalchemy import select
+
+from src.models.user import db
+from src.models.accounting import Company
+from src.models.fiscal import Customer, Product, Invoice, InvoiceItem
+
+LAYOUT_VERSION = '018'
+FETCH_SIZE = 1000
+LINE_END = '\r\n'
+SPED_MODELS = ('55', '65')
+FILE_ENCODING = 'latin-1'
+CHUNK_SIZE = 64 * 1024
+
+
+def _text(value):
+    return re.sub(r'[|\r\n]', ' ', str(value)).strip() if value is not None else ''
+
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def _date(value):
+    return value.strftime('%d%m%Y') if value else ''
+
+
+def _num(value, decimals=2):
+    if value is None:
+        value = 0
+    return f"{Decimal(value):.{decimals}f}".replace('.', ',')
+
+
+class SpedWriter:
+    """Monta as linhas e acumula as contagens por registro e por bloco"""
+
+    def __init__(self):
+        self.record_counts = Counter()
+        self.block_counts = Counter()
+        self.total_lines = 0
+
+    def line(self, record, *fields):
+        self.record_counts[record] += 1
+        self.block_counts[record[0]] += 1
+        self.total_lines += 1
+        return '|' + '|'.join([record] + [_text(field) for field in fields]) + '|' + LINE_END
+
+    def block_close(self, block):
+        # O próprio registro de encerramento entra na contagem do bloco
+        return self.line(f'{block}990', self.block_counts[block] + 1)
+
+
+def _period_filter(company_id, start, end):
+    return (
+        Invoice.company_id == company_id,
+        Invoice.issue_date >= start,
+        Invoice.issue_date < end,
+        Invoice.status.in_(['issued', 'cancelled']),
+        Invoice.model.in_(SPED_MODELS),
+    )
+
+
+def _stream(statement):
+    """Executa a consulta em blocos, com cursor de servidor quando o banco suporta"""
+    result = db.session.execute(statement.execution_options(yield_per=FETCH_SIZE))
+    for partition in result.partitions():
+        for row in partition:
+            yield row
+
+
+def _block_0(writer, company, start_date, end_date, filters):
+    yield writer.line(
+        '0000', LAYOUT_VERSION, '0', _date(start_date), _date(end_date), company.name,
+        _digits(company.cnpj), '', company.state, '', '', '', '', 'A', '1'
+    )
+    yield writer.line('0001', '0')
+    yield writer.line(
+        '0005', company.trade_name or company.name, _digits(company.zip_code), company.address,
+        '', '', '', _digits(company.phone), '', company.email
+    )
+
+    invoice_customers = select(Invoice.customer_id).where(*filters).distinct()
+    customers = select(
+        Customer.id, Customer.name, Customer.type, Customer.document,
+        Customer.state_registration, Customer.address, Customer.number,
+        Customer.complement, Customer.neighborhood
+    ).where(Customer.id.in_(invoice_customers)).order_by(Customer.id)
+    for row in _stream(customers):
+        document = _digits(row.document)
+        yield writer.line(
+            '0150', f'C{row.id}', row.name, '01058',
+            document if row.type == 'pj' else '', document if row.type == 'pf' else '',
+            row.state_registration, '', '', row.address, row.number, row.complement, row.neighborhood
+        )
+
+    invoice_products = select(InvoiceItem.product_id).join(
+        Invoice, Invoice.id == InvoiceItem.invoice_id
+    ).where(*filters).distinct()
+    products = select(
+        Product.code, Product.name, Product.unit, Product.type, Product.ncm, Product.cest
+    ).where(Product.id.in_(invoice_products)).order_by(Product.code)
+
+    # 0190 precisa vir antes dos 0200; as unidades são poucas e ficam em memória
+    units = OrderedDict()
+    for row in _stream(products.with_only_columns(Product.unit).distinct().order_by(None)):
+        units[row.unit or 'UN'] = True
+    for unit in units:
+        yield writer.line('0190', unit, unit)
+
+    for row in _stream(products):
+        yield writer.line(
+            '0200', row.code, row.name, '', '', row.unit or 'UN',
+            '09' if row.type == 'service' else '00', _digits(row.ncm), '', '', '', '', _digits(row.cest)
+        )
+
+    yield writer.block_close('0')
+
+
+def _c100(writer, invoice):
+    if invoice.status == 'cancelled':
+        return writer.line(
+            'C100', '1', '0', '', invoice.model, '02', invoice.series, invoice.number,
+            invoice.access_key, *([''] * 20)
+        )
+    return writer.line(
+        'C100', '1', '0', f'C{invoice.customer_id}', invoice.model, '00', invoice.series,
+        invoice.number, invoice.access_key, _date(invoice.issue_date), _date(invoice.issue_date),
+        _num(invoice.total_value), '0', _num(invoice.discount_value), _num(0),
+        _num(invoice.products_value), '9', _num(invoice.freight_value), _num(invoice.insurance_value),
+        _num(invoice.other_expenses), _num(invoice.icms_base), _num(invoice.icms_value), _num(0), _num(0),
+        _num(invoice.ipi_value), _num(invoice.pis_value), _num(invoice.cofins_value), _num(0), _num(0)
+    )
+
+
+def _block_c(writer, filters, totals):
+    rows = select(
+        Invoice.id, Invoice.customer_id, Invoice.model, Invoice.series, Invoice.number,
+        Invoice.access_key, Invoice.issue_date, Invoice.status, Invoice.total_value,
+        Invoice.discount_value, Invoice.products_value, Invoice.freight_value,
+        Invoice.insurance_value, Invoice.other_expenses, Invoice.icms_base, Invoice.icms_value,
+        Invoice.ipi_value, Invoice.pis_value, Invoice.cofins_value,
+        InvoiceItem.icms_cst, InvoiceItem.icms_origin, InvoiceItem.cfop, InvoiceItem.icms_rate,
+        InvoiceItem.total_value.label('item_value'), InvoiceItem.icms_base.label('item_icms_base'),
+        InvoiceItem.icms_value.label('item_icms_value'), InvoiceItem.ipi_value.label('item_ipi_value'),
+    ).outerjoin(
+        InvoiceItem, InvoiceItem.invoice_id == Invoice.id
+    ).where(*filters).order_by(Invoice.id, InvoiceItem.sequence)
+
+    has_data = False
+    for _, invoice_rows in groupby(_stream(rows), key=lambda row: row.id):
+        if not has_data:
+            has_data = True
+            yield writer.line('C001', '0')
+        first = next(invoice_rows)
+        yield _c100(writer, first)
+        if first.status == 'cancelled':
+            continue
+
+        # C190: consolidação por CST, CFOP e alíquota, só desta nota
+        analytic = OrderedDict()
+        for row in [first, *invoice_rows]:
+            if row.cfop is None:
+                continue
+            cst = f"{row.icms_origin or '0'}{(row.icms_cst or '00')[-2:]}"
+            key = (cst, row.cfop, Decimal(row.icms_rate or 0))
+            values = analytic.setdefault(key, [Decimal(0)] * 4)
+            values[0] += Decimal(row.item_value or 0)
+            values[1] += Decimal(row.item_icms_base or 0)
+            values[2] += Decimal(row.item_icms_value or 0)
+            values[3] += Decimal(row.item_ipi_value or 0)
+        for (cst, cfop, rate), (operation, base, icms, ipi) in analytic.items():
+            totals['icms_debits'] += icms
+            yield writer.line(
+                'C190', cst, cfop, _num(rate), _num(operation), _num(base), _num(icms),
+                _num(0), _num(0), _num(0), _num(ipi), ''
+            )
+
+    if not has_data:
+        yield writer.line('C001', '1')
+    yield writer.block_close('C')
+
+
+def _empty_block(writer, block):
+    yield writer.line(f'{block}001', '1')
+    yield writer.block_close(block)
+
+
+def _block_e(writer, start_date, end_date, totals):
+    debits = totals['icms_debits']
+    yield writer.line('E001', '0')
+    yield writer.line('E100', _date(start_date), _date(end_date))
+    yield writer.line(
+        'E110', _num(debits), _num(0), _num(0), _num(0), _num(0), _num(0), _num(0), _num(0),
+        _num(0), _num(debits), _num(0), _num(debits), _num(0), _num(0)
+    )
+    yield writer.block_close('E')
+
+
+def _block_1(writer):
+    yield writer.line('1001', '0')
+    yield writer.line('1010', *(['N'] * 13))
+    yield writer.block_close('1')
+
+
+def _block_9(writer):
+    yield writer.line('9001', '0')
+    # 9900 relaciona os tipos de registro na ordem do arquivo, inclusive 9900, 9990 e 9999
+    records = list(writer.record_counts) + ['9900', '9990', '9999']
+    counts = dict(writer.record_counts)
+    counts.update({'9900': len(records), '9990': 1, '9999': 1})
+    for record in records:
+        yield writer.line('9900', record, counts[record])
+    # 9990 conta as linhas do bloco 9 incluindo ele mesmo e o 9999
+    yield writer.line('9990', writer.block_counts['9'] + 2)
+    yield writer.line('9999', writer.total_lines + 1)
+
+
+def generate_efd_icms_ipi(company_id, year, month):
+    """Gera as linhas do arquivo EFD ICMS/IPI do mês, uma a uma"""
+    company = Company.query.get(company_id)
+    if company is None:
+        raise ValueError('Empresa não encontrada')
+
+    start_date = date(year, month, 1)
+    end_date = date(year, month, calendar.monthrange(year, month)[1])
+    start = datetime(year, month, 1)
+    end = datetime(year + (month // 12), month % 12 + 1, 1)
+    filters = _period_filter(company_id, start, end)
+
+    writer = SpedWriter()
+    totals = {'icms_debits': Decimal(0)}
+
+    yield from _block_0(writer, company, start_date, end_date, filters)
+    yield from _empty_block(writer, 'B')
+    yield from _block_c(writer, filters, totals)
+    yield from _empty_block(writer, 'D')
+    yield from _block_e(writer, start_date, end_date, totals)
+    yield from _empty_block(writer, 'G')
+    yield from _empty_block(writer, 'H')
+    yield from _empty_block(writer, 'K')
+    yield from _block_1(writer)
+    yield from _block_9(writer)
+
+
+def encode_chunks(lines, chunk_size=CHUNK_SIZE):
+    """Agrupa as linhas em blocos de bytes na codificação exigida pelo SPED"""
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode(FILE_ENCODING, errors='replace')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
@@ -0,0 +1,77 @@
+"""Movimentação de estoque a partir das notas fiscais"""
+from sqlalchemy import bindparam, func, insert
+
+from src.models.user import db
+from src.models.fiscal import InvoiceItem, Product, StockMovement
+
+
+def _apply(company_id, invoice_id, movement_type, quantities, user_id):
+    """Grava as movimentações em lote e ajusta o saldo com atualizações relativas
+
+    quantities: lista de (product_id, quantidade com sinal). O saldo é alterado
+    com "current_stock = current_stock + delta" no próprio banco, então emissões
+    concorrentes não sobrescrevem o valor uma da outra.
+    """
+    quantities = [(product_id, quantity) for product_id, quantity in quantities if quantity]
+    if not quantities:
+        return 0
+
+    db.session.execute(insert(StockMovement), [{
+        'company_id': company_id,
+        'product_id': product_id,
+        'invoice_id': invoice_id,
+        'movement_type': movement_type,
+        'quantity': quantity,
+        'created_by': user_id,
+    } for product_id, quantity in quantities])
+
+    products = Product.__table__
+    db.session.execute(
+        products.update()
+        .where(products.c.id == bindparam('b_product_id'))
+        .values(current_stock=func.coalesce(products.c.current_stock, 0) + bindparam('b_delta')),
+        [{'b_product_id': product_id, 'b_delta': quantity} for product_id, quantity in quantities]
+    )
+    return len(quantities)
+
+
+def register_invoice_issue(invoice, user_id=None):
+    """Baixa o estoque dos produtos controlados da nota emitida"""
+    rows = db.session.query(
+        InvoiceItem.product_id,
+        func.sum(InvoiceItem.quantity)
+    ).join(Product, Product.id == InvoiceItem.product_id).filter(
+        InvoiceItem.invoice_id == invoice.id,
+        Product.manage_stock == True,
+        Product.type == 'product'
+    ).group_by(InvoiceItem.product_id).all()
+
+    return _apply(
+        invoice.company_id, invoice.id, 'invoice_issue',
+        [(product_id, -quantity) for product_id, quantity in rows], user_id
+    )
+
+
+def register_invoice_cancel(invoice, user_id=None):
+    """Estorna exatamente o que foi movimentado pela nota (saldo líquido por produto)"""
+    rows = db.session.query(
+        StockMovement.product_id,
+        func.sum(StockMovement.quantity)
+    ).filter(
+        StockMovement.invoice_id == invoice.id
+    ).group_by(StockMovement.product_id).all()
+
+    return _apply(
+        invoice.company_id, invoice.id, 'invoice_cancel',
+        [(product_id, -quantity) for product_id, quantity in rows], user_id
+    )
+
+
+def low_stock_query(company_id):
+    """Produtos com saldo igual ou abaixo do mínimo (usa ix_products_stock_shortage)"""
+    shortage = Product.current_stock - Product.minimum_stock
+    return Product.query.filter(
+        Product.company_id == company_id,
+        Product.manage_stock == True,
+        shortage <= 0
+    ).order_by(shortage)
@@ -0,0 +1,190 @@
+"""Resumo mensal de ponto e banco de horas (time_bank_summaries)
+
+O resumo é mantido de forma incremental: a cada alteração de ponto apenas os
+meses afetados de cada colaborador são reagregados, e os saldos dos meses
+seguintes são recalculados a partir do saldo anterior.
+"""
+import calendar
+from datetime import date
+
+from sqlalchemy import and_, bindparam, case, func, insert, select
+
+from src.models.user import db
+from src.models.hr_advanced import TimeBankSummary, TimeRecord
+from src.services.worked_hours import DAILY_HOURS
+
+JUSTIFIED_ABSENCES = ('medical', 'justified')
+SUMMARY_FIELDS = (
+    'worked_days', 'worked_hours', 'overtime_hours', 'night_shift_hours',
+    'absence_days', 'unjustified_absence_days',
+)
+
+
+def month_bounds(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _month_key(value):
+    """Aceita (employee_id, data) ou (employee_id, ano, mês)"""
+    if len(value) == 2:
+        return value[0], value[1].year, value[1].month
+    return tuple(value)
+
+
+def _aggregate(employee_ids, start_date, end_date):
+    """Totais de ponto por colaborador e mês, calculados no banco"""
+    year = func.extract('year', TimeRecord.record_date)
+    month = func.extract('month', TimeRecord.record_date)
+    is_absence = TimeRecord.status == 'absence'
+    query = select(
+        TimeRecord.employee_id, year, month,
+        func.sum(case((TimeRecord.worked_hours > 0, 1), else_=0)),
+        func.coalesce(func.sum(TimeRecord.worked_hours), 0),
+        func.coalesce(func.sum(TimeRecord.overtime_hours), 0),
+        func.coalesce(func.sum(TimeRecord.night_shift_hours), 0),
+        func.sum(case((is_absence, 1), else_=0)),
+        func.sum(case((and_(
+            is_absence, func.coalesce(TimeRecord.absence_type, '').notin_(JUSTIFIED_ABSENCES)
+        ), 1), else_=0)),
+    ).where(
+        TimeRecord.record_date >= start_date,
+        TimeRecord.record_date <= end_date
+    ).group_by(TimeRecord.employee_id, year, month)
+    if employee_ids is not None:
+        query = query.where(TimeRecord.employee_id.in_(employee_ids))
+    return {
+        (row[0], int(row[1]), int(row[2])): row[3:] for row in db.session.execute(query)
+    }
+
+
+def _carry_forward(employee_ids):
+    """Recalcula saldo trazido e saldo final em ordem cronológica; grava só o que mudou"""
+    table = TimeBankSummary.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.employee_id, table.c.balance_hours,
+               table.c.carried_balance, table.c.closing_balance)
+        .where(table.c.employee_id.in_(employee_ids))
+        .order_by(table.c.employee_id, table.c.year, table.c.month)
+    )
+    changes = []
+    current_employee = None
+    carried = 0.0
+    for summary_id, employee_id, balance, old_carried, old_closing in rows:
+        if employee_id != current_employee:
+            current_employee = employee_id
+            carried = 0.0
+        closing = round(carried + (balance or 0), 2)
+        if (old_carried, old_closing) != (carried, closing):
+            changes.append({'b_id': summary_id, 'b_carried': carried, 'b_closing': closing})
+        carried = closing
+    if changes:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(
+                carried_balance=bindparam('b_carried'), closing_balance=bindparam('b_closing')
+            ),
+            changes
+        )
+
+
+def refresh_months(keys):
+    """Reagrega os meses informados [(employee_id, data) ou (employee_id, ano, mês)]. Não faz commit."""
+    keys = {_month_key(key) for key in keys}
+    if not keys:
+        return 0
+
+    employee_ids = {employee_id for employee_id, _, _ in keys}
+    start_date = month_bounds(*min((year, month) for _, year, month in keys))[0]
+    end_date = month_bounds(*max((year, month) for _, year, month in keys))[1]
+    totals = _aggregate(employee_ids, start_date, end_date)
+
+    table = TimeBankSummary.__table__
+    existing = {
+        (row.employee_id, row.year, row.month): row.id for row in db.session.execute(
+            select(table.c.id, table.c.employee_id, table.c.year, table.c.month).where(
+                table.c.employee_id.in_(employee_ids),
+                table.c.year * 100 + table.c.month >= start_date.year * 100 + start_date.month,
+                table.c.year * 100 + table.c.month <= end_date.year * 100 + end_date.month
+            )
+        )
+    }
+
+    new_rows, updates = [], []
+    for key in sorted(keys):
+        values = dict(zip(SUMMARY_FIELDS, totals.get(key, (0,) * len(SUMMARY_FIELDS))))
+        values = {field: (int(value) if field.endswith('days') else round(float(value), 2)) for field, value in values.items()}
+        values['balance_hours'] = round(values['overtime_hours'] - values['unjustified_absence_days'] * DAILY_HOURS, 2)
+        if key in existing:
+            values['b_id'] = existing[key]
+            updates.append(values)
+        else:
+            values.update(employee_id=key[0], year=key[1], month=key[2])
+            new_rows.append(values)
+
+    if new_rows:
+        db.session.execute(insert(TimeBankSummary), new_rows)
+    if updates:
+        fields = SUMMARY_FIELDS + ('balance_hours',)
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(
+                **{field: bindparam(field) for field in fields}
+            ),
+            updates
+        )
+    _carry_forward(employee_ids)
+    return len(keys)
+
+
+def refresh_period(start_date, end_date, employee_id=None):
+    """Reagrega todos os meses do intervalo (usado após recálculos em lote). Não faz commit."""
+    start_date = month_bounds(start_date.year, start_date.month)[0]
+    end_date = month_bounds(end_date.year, end_date.month)[1]
+    keys = set(_aggregate([employee_id] if employee_id else None, start_date, end_date))
+
+    table = TimeBankSummary.__table__
+    query = select(table.c.employee_id, table.c.year, table.c.month).where(
+        table.c.year * 100 + table.c.month >= start_date.year * 100 + start_date.month,
+        table.c.year * 100 + table.c.month <= end_date.year * 100 + end_date.month
+    )
+    if employee_id:
+        query = query.where(table.c.employee_id == employee_id)
+    keys.update(tuple(row) for row in db.session.execute(query))
+    return refresh_months(keys)
+
+
+def record_hours(start_date, end_date, excluded=None):
+    """{employee_id: (trabalhadas, extras, noturnas)} somadas direto do ponto no intervalo
+
+    excluded é uma subconsulta opcional de colaboradores a ignorar.
+    """
+    query = select(
+        TimeRecord.employee_id,
+        func.coalesce(func.sum(TimeRecord.worked_hours), 0),
+        func.coalesce(func.sum(TimeRecord.overtime_hours), 0),
+        func.coalesce(func.sum(TimeRecord.night_shift_hours), 0),
+    ).where(
+        TimeRecord.record_date >= start_date,
+        TimeRecord.record_date <= end_date
+    ).group_by(TimeRecord.employee_id)
+    if excluded is not None:
+        query = query.where(TimeRecord.employee_id.notin_(excluded))
+    return {row[0]: tuple(row[1:]) for row in db.session.execute(query)}
+
+
+def month_hours(year, month):
+    """Horas do mês por colaborador lidas do resumo
+
+    Quem tem ponto no mês mas ainda não tem resumo (meses anteriores ao
+    resumo, cargas feitas fora da API) tem as horas somadas direto do ponto.
+    """
+    summarized = (TimeBankSummary.year == year, TimeBankSummary.month == month)
+    hours = {
+        row[0]: tuple(row[1:]) for row in db.session.execute(
+            select(TimeBankSummary.employee_id, TimeBankSummary.worked_hours,
+                   TimeBankSummary.overtime_hours, TimeBankSummary.night_shift_hours)
+            .where(*summarized)
+        )
+    }
+    hours.update(record_hours(
+        *month_bounds(year, month), excluded=select(TimeBankSummary.employee_id).where(*summarized)
+    ))
+    return hours
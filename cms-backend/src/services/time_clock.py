@@ -0,0 +1,187 @@
+"""Importação em lote de marcações de ponto (API dos relógios e arquivo AFD)
+
+As marcações são ordenadas por colaborador e horário e distribuídas nos
+quatro horários do TimeRecord em memória. Marcações já gravadas são
+reconhecidas pelo horário completo (data e hora), então reenviar o mesmo
+lote ou o mesmo arquivo não duplica registros.
+"""
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, insert, select
+
+from src.models.user import db
+from src.models.hr_advanced import Employee, TimeRecord
+from src.services.time_bank import refresh_months
+from src.services.worked_hours import SLOTS, compute_day, slot_datetimes
+
+# Uma jornada aberta (marcações ímpares) aceita a marcação do dia seguinte até este intervalo
+MAX_OPEN_GAP = timedelta(hours=12)
+
+
+def _journey_day(days, moment):
+    """Dia da jornada da marcação: o anterior se ele ainda está aberto ou já virou a meia-noite"""
+    previous_day = moment.date() - timedelta(days=1)
+    previous = days.get(previous_day)
+    if previous and len(previous) < len(SLOTS) and previous[-1] < moment:
+        crossed = previous[-1].date() == moment.date()
+        open_journey = len(previous) % 2 == 1 and moment - previous[-1] <= MAX_OPEN_GAP
+        if crossed or open_journey:
+            return previous_day
+    return moment.date()
+
+
+def ingest_punches(punches):
+    """Grava marcações [(employee_id, datetime)] em lote
+
+    Retorna um resumo com as quantidades de marcações gravadas, duplicadas e
+    recusadas (dia com mais de quatro marcações) e de registros criados ou
+    alterados. O resumo mensal dos meses afetados é atualizado. Não faz commit.
+    """
+    punches = sorted({
+        (employee_id, moment.replace(second=0, microsecond=0)) for employee_id, moment in punches
+    })
+    summary = {
+        'received': len(punches), 'inserted': 0, 'duplicates': 0,
+        'records_created': 0, 'records_updated': 0, 'rejected': [],
+    }
+    if not punches:
+        return summary
+
+    employee_ids = {employee_id for employee_id, _ in punches}
+    first_day = punches[0][1].date() - timedelta(days=1)
+    last_day = max(moment for _, moment in punches).date()
+
+    # Registros existentes do intervalo (inclui o dia anterior para jornadas noturnas)
+    existing = {}
+    rows = db.session.execute(
+        select(TimeRecord.id, TimeRecord.employee_id, TimeRecord.record_date, TimeRecord.status, *[
+            getattr(TimeRecord, slot) for slot in SLOTS
+        ]).where(
+            TimeRecord.employee_id.in_(employee_ids),
+            TimeRecord.record_date >= first_day,
+            TimeRecord.record_date <= last_day
+        )
+    )
+    for row in rows:
+        existing[(row.employee_id, row.record_date)] = (
+            row.id, slot_datetimes(row.record_date, row[4:]), row.status
+        )
+
+    journeys = defaultdict(dict)
+    known = set()
+    for (employee_id, record_date), (_, moments, _) in existing.items():
+        journeys[employee_id][record_date] = list(moments)
+        known.update((employee_id, moment) for moment in moments)
+
+    changed = set()
+    for employee_id, moment in punches:
+        if (employee_id, moment) in known:
+            summary['duplicates'] += 1
+            continue
+        days = journeys[employee_id]
+        record_date = _journey_day(days, moment)
+        moments = days.setdefault(record_date, [])
+        if len(moments) >= len(SLOTS):
+            summary['rejected'].append({
+                'employee_id': employee_id,
+                'datetime': moment.isoformat(),
+                'reason': 'Todos os horários do dia já foram registrados'
+            })
+            continue
+        moments.append(moment)
+        moments.sort()
+        known.add((employee_id, moment))
+        changed.add((employee_id, record_date))
+        summary['inserted'] += 1
+
+    new_rows, updates = [], []
+    now = datetime.utcnow()
+    for employee_id, record_date in sorted(changed):
+        moments = journeys[employee_id][record_date]
+        times = [moment.time() for moment in moments] + [None] * (len(SLOTS) - len(moments))
+        record = existing.get((employee_id, record_date))
+        hours = compute_day(record_date, times, record[2] if record else 'normal')
+        values = dict(zip(SLOTS, times))
+        values['worked_hours'] = hours.worked
+        values['overtime_hours'] = hours.overtime
+        values['night_shift_hours'] = hours.night
+        values['updated_at'] = now
+        if record:
+            values['b_id'] = record[0]
+            updates.append(values)
+        else:
+            values.update(employee_id=employee_id, record_date=record_date, created_at=now)
+            new_rows.append(values)
+
+    if new_rows:
+        db.session.execute(insert(TimeRecord), new_rows)
+    if updates:
+        table = TimeRecord.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(
+                **{column: bindparam(column) for column in list(SLOTS) + ['worked_hours', 'overtime_hours', 'night_shift_hours', 'updated_at']}
+            ),
+            updates
+        )
+    refresh_months(changed)
+    summary['records_created'] = len(new_rows)
+    summary['records_updated'] = len(updates)
+    return summary
+
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def parse_afd(lines):
+    """Lê as marcações (registro tipo 3) de um AFD
+
+    Aceita o leiaute da Portaria 1.510/2009 (data, hora e PIS) e o da
+    Portaria 671/2021 (data/hora ISO e CPF). Retorna a lista de marcações
+    (linha, tipo do identificador, identificador, data e hora) e as linhas
+    com erro.
+    """
+    punches, errors = [], []
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('latin-1')
+        line = line.rstrip('\r\n')
+        if len(line) < 10 or line[9] != '3':
+            continue
+        try:
+            if len(line) >= 46 and line[14] == '-':
+                moment = datetime.strptime(line[10:26], '%Y-%m-%dT%H:%M')
+                punches.append((number, 'cpf', _digits(line[34:46])[-11:], moment))
+            else:
+                moment = datetime.strptime(line[10:22], '%d%m%Y%H%M')
+                punches.append((number, 'pis', _digits(line[22:34])[-11:], moment))
+        except ValueError:
+            errors.append({'line': number, 'reason': 'Data ou hora inválida'})
+    return punches, errors
+
+
+def import_afd(lines):
+    """Importa um arquivo AFD, associando PIS/CPF aos colaboradores. Não faz commit."""
+    punches, errors = parse_afd(lines)
+
+    by_pis, by_cpf = {}, {}
+    for employee_id, pis, cpf in db.session.execute(select(Employee.id, Employee.pis_pasep, Employee.cpf)):
+        if pis:
+            by_pis[_digits(pis)[-11:]] = employee_id
+        if cpf:
+            by_cpf[_digits(cpf)[-11:]] = employee_id
+
+    resolved = []
+    for number, kind, identifier, moment in punches:
+        employee_id = (by_pis if kind == 'pis' else by_cpf).get(identifier)
+        if employee_id is None:
+            errors.append({'line': number, 'reason': f'Colaborador não encontrado ({kind.upper()} {identifier})'})
+            continue
+        resolved.append((employee_id, moment))
+
+    summary = ingest_punches(resolved)
+    summary['afd_records'] = len(punches)
+    summary['errors'] = sorted(errors, key=lambda error: error['line'])
+    return summary
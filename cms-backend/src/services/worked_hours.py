@@ -0,0 +1,127 @@
+"""Cálculo de horas trabalhadas, extras e noturnas dos registros de ponto
+
+As marcações do dia são convertidas em data e hora completas (uma saída menor
+que a entrada anterior pertence ao dia seguinte). O período noturno vai das
+22h às 5h e a hora noturna é reduzida (52min30s), conforme o art. 73 da CLT.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, select
+
+from src.models.user import db
+from src.models.hr_advanced import TimeRecord
+
+SLOTS = ('entry_time_1', 'exit_time_1', 'entry_time_2', 'exit_time_2')
+
+DAILY_HOURS = 8
+NIGHT_START_HOUR = 22
+NIGHT_END_HOUR = 5
+NIGHT_HOUR_FACTOR = 60 / 52.5
+RECOMPUTE_CHUNK_SIZE = 5000
+
+WorkedHours = namedtuple('WorkedHours', 'worked overtime night')
+
+
+def slot_datetimes(record_date, times):
+    """Converte os horários do registro em data e hora, avançando o dia ao passar da meia-noite"""
+    result = []
+    day = datetime.combine(record_date, datetime.min.time())
+    previous = None
+    for value in times:
+        if value is None:
+            continue
+        moment = datetime.combine(day.date(), value)
+        if previous is not None and moment < previous:
+            day += timedelta(days=1)
+            moment = datetime.combine(day.date(), value)
+        result.append(moment)
+        previous = moment
+    return result
+
+
+def _night_seconds(start, end):
+    """Segundos do intervalo que caem entre 22h e 5h"""
+    total = 0.0
+    day = datetime.combine(start.date() - timedelta(days=1), datetime.min.time())
+    while day < end:
+        night_start = day + timedelta(hours=NIGHT_START_HOUR)
+        night_end = day + timedelta(days=1, hours=NIGHT_END_HOUR)
+        overlap = (min(end, night_end) - max(start, night_start)).total_seconds()
+        if overlap > 0:
+            total += overlap
+        day += timedelta(days=1)
+    return total
+
+
+def compute_day(record_date, times, status='normal', daily_hours=DAILY_HOURS):
+    """Horas trabalhadas, extras e noturnas de um dia a partir dos quatro horários
+
+    Só pares completos (entrada e saída) são considerados. As horas noturnas
+    são devolvidas já convertidas em horas reduzidas e também contam na
+    jornada. Em feriados todas as horas trabalhadas são extras.
+    """
+    moments = slot_datetimes(record_date, times)
+    real_seconds = 0.0
+    night_seconds = 0.0
+    for start, end in zip(moments[0::2], moments[1::2]):
+        real_seconds += (end - start).total_seconds()
+        night_seconds += _night_seconds(start, end)
+
+    night = night_seconds / 3600 * NIGHT_HOUR_FACTOR
+    worked = real_seconds / 3600 + night - night_seconds / 3600
+    if status == 'holiday':
+        overtime = worked
+    else:
+        overtime = max(worked - daily_hours, 0.0)
+    return WorkedHours(round(worked, 2), round(overtime, 2), round(night, 2))
+
+
+def recompute_period(start_date, end_date, employee_id=None, daily_hours=DAILY_HOURS,
+                     chunk_size=RECOMPUTE_CHUNK_SIZE):
+    """Recalcula as horas de todos os registros do período, em blocos
+
+    Lê os registros por faixa de id (sem carregar objetos do ORM), calcula o
+    bloco inteiro e grava só as linhas alteradas com um UPDATE em lote. Cada
+    bloco é confirmado em sua própria transação.
+    """
+    table = TimeRecord.__table__
+    columns = [table.c.id, table.c.record_date, table.c.status] + [table.c[slot] for slot in SLOTS] + [
+        table.c.worked_hours, table.c.overtime_hours, table.c.night_shift_hours
+    ]
+    update = table.update().where(table.c.id == bindparam('b_id')).values(
+        worked_hours=bindparam('b_worked'),
+        overtime_hours=bindparam('b_overtime'),
+        night_shift_hours=bindparam('b_night'),
+    )
+
+    processed = 0
+    updated = 0
+    last_id = 0
+    while True:
+        query = select(*columns).where(
+            table.c.id > last_id,
+            table.c.record_date >= start_date,
+            table.c.record_date <= end_date
+        )
+        if employee_id:
+            query = query.where(table.c.employee_id == employee_id)
+        rows = db.session.execute(query.order_by(table.c.id).limit(chunk_size)).all()
+        if not rows:
+            break
+
+        results = [compute_day(row[1], row[3:7], row[2], daily_hours) for row in rows]
+        changes = [
+            {'b_id': row[0], 'b_worked': result.worked, 'b_overtime': result.overtime, 'b_night': result.night}
+            for row, result in zip(rows, results)
+            if (row[7], row[8], row[9]) != tuple(result)
+        ]
+        if changes:
+            db.session.execute(update, changes)
+        db.session.commit()
+
+        processed += len(rows)
+        updated += len(changes)
+        last_id = rows[-1][0]
+
+    return {'processed': processed, 'updated': updated}
@@ -0,0 +1,69 @@
+"""Pools compartilhados: processos para tarefas pesadas de CPU e threads para tarefas em segundo plano"""
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+
+BACKGROUND_WORKERS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+_background = None
+
+
+def get_process_pool():
+    """Retorna o pool de processos da aplicação (um processo por CPU), criando-o na primeira chamada"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _pool
+
+
+def as_completed_in_pool(func, argument_lists, max_workers=None):
+    """Executa func(*args) no pool com no máximo max_workers tarefas ao mesmo tempo
+
+    Gera (índice em argument_lists, future) na ordem de conclusão; sem
+    max_workers, todas as tarefas são enviadas de uma vez.
+    """
+    pool = get_process_pool()
+    tasks = enumerate(argument_lists)
+    pending = {pool.submit(func, *args): index for index, args in islice(tasks, max_workers or None)}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            for next_index, args in islice(tasks, 1):
+                pending[pool.submit(func, *args)] = next_index
+            yield index, future
+
+
+def map_in_pool(func, items, max_workers=None, chunksize=1):
+    """Aplica func a cada item; usa o pool apenas quando há mais de um item
+
+    max_workers limita quantos itens ficam no pool ao mesmo tempo (o pool é
+    compartilhado); sem limite, os itens seguem em blocos de chunksize.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    if max_workers:
+        results = [None] * len(items)
+        for index, future in as_completed_in_pool(func, [(item,) for item in items], max_workers):
+            results[index] = future.result()
+        return results
+    return list(get_process_pool().map(func, items, chunksize=chunksize))
+
+
+def run_in_background(app, func, *args):
+    """Executa func em uma thread de segundo plano, dentro do contexto da aplicação"""
+    global _background
+    with _pool_lock:
+        if _background is None:
+            _background = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='background')
+
+    def task():
+        with app.app_context():
+            return func(*args)
+
+    return _background.submit(task)
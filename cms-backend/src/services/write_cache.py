@@ -0,0 +1,91 @@
+"""Cache em memória invalidado pelas gravações confirmadas na sessão
+
+watch_writes marca a sessão quando um flush ou uma instrução em lote (insert,
+update, delete via ORM) toca algum dos modelos observados e chama o callback
+de invalidação quando essa transação é confirmada; num rollback a marca é
+descartada.
+
+WriteCache guarda resultados por chave até expirar o TTL (que protege contra
+gravações feitas por outros processos) ou até a próxima invalidação. Cada
+invalidação avança a geração do cache: um resultado calculado enquanto uma
+gravação era confirmada só é guardado se a geração não mudou desde o início
+do cálculo, para não deixar um valor já desatualizado no cache.
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+DEFAULT_TTL = 600  # segundos
+
+
+def watch_writes(models, on_invalidate):
+    """Chama on_invalidate() a cada commit de transação que gravou algum dos modelos"""
+    models = tuple(models)
+    flag = object()  # marca própria em session.info para cada observador
+
+    @event.listens_for(Session, 'after_flush')
+    def _track_flush(session, flush_context):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, models):
+                session.info[flag] = True
+                return
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def _track_bulk(orm_execute_state):
+        if orm_execute_state.is_select:
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, models):
+            orm_execute_state.session.info[flag] = True
+
+    @event.listens_for(Session, 'after_commit')
+    def _invalidate_on_commit(session):
+        if session.info.pop(flag, False):
+            on_invalidate()
+
+    @event.listens_for(Session, 'after_soft_rollback')
+    def _discard_on_rollback(session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop(flag, None)
+
+
+class WriteCache:
+    """Resultados por chave, esvaziados a cada gravação confirmada dos modelos observados"""
+
+    def __init__(self, models, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        watch_writes(models, self.invalidate)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def get(self, key):
+        """Valor guardado para a chave, ou None se ausente ou expirado"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def begin(self):
+        """Marca o início de um cálculo; passar o retorno a store()"""
+        with self._lock:
+            return self._generation, time.monotonic()
+
+    def store(self, key, value, started, replace=False):
+        """Guarda o valor se não houve invalidação desde begin(); replace descarta as demais chaves"""
+        generation, computed_at = started
+        with self._lock:
+            if generation != self._generation:
+                return False
+            if replace:
+                self._entries.clear()
+            self._entries[key] = (computed_at, value)
+            return True
@@ -0,0 +1,254 @@
+"""Planilhas XLSX geradas e lidas em streaming, sem dependências externas
+
+Gera uma pasta de trabalho com uma única planilha. As linhas são escritas no
+XML da planilha à medida que chegam (textos como inlineStr, sem tabela de
+strings compartilhadas) e o pacote é compactado por iter_zip, então a memória
+usada não depende do número de linhas. A leitura (iter_xlsx_rows) percorre o
+XML da primeira planilha com iterparse, mantendo em memória apenas a tabela de
+strings compartilhadas.
+"""
+import io
+import posixpath
+import re
+import zipfile
+from datetime import date, datetime, timedelta
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape
+
+from src.services.zipstream import iter_zip
+
+CHUNK_SIZE = 64 * 1024
+
+# Estilos (índice em cellXfs): 0 padrão, 1 moeda, 2 negrito, 3 moeda em negrito, 4 data
+STYLE_DEFAULT = 0
+STYLE_MONEY = 1
+STYLE_BOLD = 2
+STYLE_MONEY_BOLD = 3
+STYLE_DATE = 4
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="4" fontId="1" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '</styleSheet>'
+)
+
+EXCEL_EPOCH = date(1899, 12, 30)
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def column_name(index):
+    """Letra da coluna a partir do índice (0 -> A, 26 -> AA)"""
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+def _cell(reference, value, style):
+    style_attr = f' s="{style}"' if style else ''
+    if value is None or value == '':
+        return f'<c r="{reference}"{style_attr}/>' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{reference}" t="b"{style_attr}><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{reference}"{style_attr}><v>{value!r}</v></c>'
+    if isinstance(value, (date, datetime)):
+        serial = ((value.date() if isinstance(value, datetime) else value) - EXCEL_EPOCH).days
+        return f'<c r="{reference}" s="{style or STYLE_DATE}"><v>{serial}</v></c>'
+    return f'<c r="{reference}" t="inlineStr"{style_attr}><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def _sheet(rows, column_widths):
+    """XML da planilha em blocos de bytes"""
+    header = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/>'
+        '</sheetView></sheetViews>'
+    ]
+    if column_widths:
+        header.append('<cols>' + ''.join(
+            f'<col min="{index + 1}" max="{index + 1}" width="{width}" customWidth="1"/>'
+            for index, width in enumerate(column_widths)
+        ) + '</cols>')
+    header.append('<sheetData>')
+    buffer = [''.join(header)]
+    size = 0
+    for number, (values, styles) in enumerate(rows, start=1):
+        styles = styles or ()
+        cells = ''.join(
+            _cell(f'{column_name(index)}{number}', value, styles[index] if index < len(styles) else STYLE_DEFAULT)
+            for index, value in enumerate(values)
+        )
+        line = f'<row r="{number}">{cells}</row>'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    buffer.append('</sheetData></worksheet>')
+    yield ''.join(buffer).encode('utf-8')
+
+
+def iter_xlsx(sheet_name, rows, column_widths=None):
+    """Gera os bytes de um XLSX com uma planilha
+
+    rows: iterável de pares (valores, estilos), com um STYLE_* por coluna em
+    estilos ou None para o estilo padrão.
+    """
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+    return iter_zip([
+        ('[Content_Types].xml', CONTENT_TYPES.encode('utf-8')),
+        ('_rels/.rels', ROOT_RELS.encode('utf-8')),
+        ('xl/workbook.xml', workbook.encode('utf-8')),
+        ('xl/_rels/workbook.xml.rels', WORKBOOK_RELS.encode('utf-8')),
+        ('xl/styles.xml', STYLES.encode('utf-8')),
+        ('xl/worksheets/sheet1.xml', _sheet(rows, column_widths)),
+    ])
+
+
+# ==================== LEITURA ====================
+
+def excel_date(serial):
+    """Data a partir do número serial do Excel"""
+    return EXCEL_EPOCH + timedelta(days=int(serial))
+
+
+def column_index(reference):
+    """Índice da coluna a partir da referência da célula (A1 -> 0, AA3 -> 26)"""
+    index = 0
+    for char in re.match(r'[A-Z]+', reference).group():
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def _first_sheet_path(archive):
+    workbook = archive.read('xl/workbook.xml')
+    sheet = next(element for _, element in iterparse(io.BytesIO(workbook)) if element.tag == f'{MAIN_NS}sheet')
+    relation_id = sheet.get(f'{REL_NS}id')
+    for _, element in iterparse(io.BytesIO(archive.read('xl/_rels/workbook.xml.rels'))):
+        if element.tag == f'{PACKAGE_REL_NS}Relationship' and element.get('Id') == relation_id:
+            target = element.get('Target')
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise ValueError('Planilha não encontrada no arquivo')
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as source:
+        for _, element in iterparse(source):
+            if element.tag == f'{MAIN_NS}si':
+                strings.append(''.join(text.text or '' for text in element.iter(f'{MAIN_NS}t')))
+                element.clear()
+    return strings
+
+
+def _cell_value(cell, strings):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{MAIN_NS}t'))
+    value = cell.find(f'{MAIN_NS}v')
+    if value is None or value.text is None:
+        return None
+    if kind == 's':
+        return strings[int(value.text)]
+    if kind == 'b':
+        return value.text == '1'
+    if kind in ('str', 'e'):
+        return value.text
+    number = float(value.text)
+    return int(number) if number.is_integer() else number
+
+
+def iter_xlsx_rows(file):
+    """Linhas da primeira planilha como listas de valores (textos, números ou booleanos)
+
+    Linhas ausentes no XML vêm como listas vazias. file: caminho ou objeto binário com seek. Datas chegam como o número
+    serial do Excel (ver excel_date). Levanta ValueError se não for um XLSX.
+    """
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile as e:
+        raise ValueError('Arquivo XLSX inválido') from e
+    with archive:
+        strings = _shared_strings(archive)
+        with archive.open(_first_sheet_path(archive)) as source:
+            number = 0
+            for _, element in iterparse(source):
+                if element.tag != f'{MAIN_NS}row':
+                    continue
+                # Linhas vazias não aparecem no XML: preserva a numeração da planilha
+                number += 1
+                target = int(element.get('r') or number)
+                while number < target:
+                    yield []
+                    number += 1
+                values = {}
+                for position, cell in enumerate(element.iter(f'{MAIN_NS}c')):
+                    reference = cell.get('r')
+                    values[column_index(reference) if reference else position] = _cell_value(cell, strings)
+                element.clear()
+                yield [values.get(index) for index in range(max(values) + 1)] if values else []
@@ -0,0 +1,59 @@
+"""Geração de arquivos ZIP em streaming, sem montar o arquivo em memória"""
+import os
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer:
+    """Destino não posicionável para o ZipFile; acumula bytes até serem consumidos"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """Gera o conteúdo de um ZIP a partir de pares (nome, origem)
+
+    A origem pode ser bytes, o caminho de um arquivo ou um iterável de blocos
+    de bytes (conteúdo gerado sob demanda). Cada entrada é gravada e liberada
+    antes da próxima ser lida, então a memória usada fica limitada ao tamanho
+    de um bloco, independente do número e do tamanho dos arquivos.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=compression) as archive:
+        for name, source in entries:
+            with archive.open(name, mode='w', force_zip64=True) as target:
+                if isinstance(source, (bytes, bytearray)):
+                    target.write(source)
+                elif isinstance(source, (str, os.PathLike)):
+                    with open(source, 'rb') as handle:
+                        for block in iter(lambda: handle.read(CHUNK_SIZE), b''):
+                            target.write(block)
+                            data = buffer.drain()
+                            if data:
+                                yield data
+                else:
+                    for block in source:
+                        target.write(block)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data